@@ -0,0 +1,150 @@
+"""
+选校报告workflow的单次请求框架开销基准测试
+
+使用零延迟的FakeListChatModel, 测得的时间几乎全部是框架本身的开销(prompt/chain/管道构造、调度、tracing装饰器等)。
+对比两种实现:
+- legacy: 每次LLM调用新建PromptTemplate和LLMChain, 每次run重新定义各步骤函数并重建RunnableLambda管道(旧实现)
+- compiled: 构造workflow时编译prompt和管道, 渲染后的prompt直接调用LLM, 每次请求直接复用(当前实现)
+
+用法:
+    python benchmarks/bench_pipeline_overhead.py --requests 200
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+sys.path.append(os.path.join(ROOT_DIR, "university_selection_report"))
+
+from langchain.chains import LLMChain
+from langchain.prompts import PromptTemplate
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+
+import university_selection_workflow as workflow_module
+from university_selection_workflow import UniversitySelectionWorkflow
+
+SCHOOLS_TABLE = (
+    "| School Name | Reason |\n| --- | --- |\n"
+    "| Purdue University | Safety |\n| Ohio State University | Target |\n| Carnegie Mellon University | Reach |"
+)
+PROFILE = "GPA 3.8, SAT 1500, interested in computer science and robotics."
+
+
+class LegacyWorkflow(UniversitySelectionWorkflow):
+    """复现旧实现的每次请求开销: 每次调用重建prompt和LLMChain, 每次run重建管道"""
+
+    def _invoke_chain(self, stage: str, inputs: Dict[str, Any]) -> str:
+        prompt = PromptTemplate(input_variables=self._prompts[stage].input_variables,
+                                template=self._prompts[stage].template)
+        return LLMChain(llm=self.llm, prompt=prompt).run(inputs)
+
+    async def _ainvoke_chain(self, stage: str, inputs: Dict[str, Any], on_token=None) -> str:
+        prompt = PromptTemplate(input_variables=self._prompts[stage].input_variables,
+                                template=self._prompts[stage].template)
+        chain = LLMChain(llm=self.llm, prompt=prompt)
+        return (await chain.ainvoke(inputs))[chain.output_key]
+
+    def generate(self, profile: str) -> str:
+        pipeline = (
+            {"profile": RunnablePassthrough(),
+             "majors_report": RunnableLambda(lambda p: self._recommend_majors_step(p))}
+            | RunnableLambda(lambda x: self._recommend_schools_step(x))
+            | RunnableLambda(lambda x: self._extract_schools_step(x))
+            | RunnableLambda(lambda x: self._fill_school_info_step(x))
+            | RunnableLambda(lambda x: self._final_report_step(x))
+        )
+        return pipeline.invoke(profile)
+
+    async def agenerate(self, profile: str) -> str:
+        async def majors(p):
+            return await self._arecommend_majors_step(p)
+
+        async def schools(x):
+            return await self._arecommend_schools_step(x)
+
+        async def extract(x):
+            return await self._aextract_schools_step(x)
+
+        async def fill(x):
+            return await self._afill_school_info_step(x)
+
+        pipeline = (
+            {"profile": RunnablePassthrough(), "majors_report": RunnableLambda(majors)}
+            | RunnableLambda(schools)
+            | RunnableLambda(extract)
+            | RunnableLambda(fill)
+            | RunnableLambda(lambda x: self._final_report_step(x))
+        )
+        return await pipeline.ainvoke(profile)
+
+
+class CompiledWorkflow(UniversitySelectionWorkflow):
+    """当前实现, 只执行管道, 不写报告文件"""
+
+    def generate(self, profile: str) -> str:
+        return self._pipeline.invoke(profile)
+
+    async def agenerate(self, profile: str) -> str:
+        return await self._pipeline.ainvoke(profile)
+
+
+def measure(func: Callable[[], Any], requests: int, warmup: int) -> List[float]:
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def summarize(label: str, timings: List[float]) -> float:
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    mean = statistics.mean(timings)
+    print(f"{label:<18} mean={mean:7.3f} ms  p50={statistics.median(timings):7.3f} ms  p95={p95:7.3f} ms")
+    return mean
+
+
+def main():
+    parser = argparse.ArgumentParser(description="workflow单次请求的框架开销: 旧实现 vs 预编译")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=1, help="学校信息填充的并发数, 1表示顺序执行")
+    args = parser.parse_args()
+
+    # 关闭LangSmith上报, 避免网络请求影响结果
+    os.environ.pop("LANGSMITH_API_KEY", None)
+    os.environ["LANGCHAIN_TRACING_V2"] = "false"
+    workflow_module.LLM_REGISTRY["bench-fake"] = lambda: FakeListChatModel(responses=[SCHOOLS_TABLE])
+
+    output_dir = tempfile.mkdtemp(prefix="bench-overhead-")
+    workflows = {
+        "legacy": LegacyWorkflow("bench-fake", debug=False, output_dir=output_dir, max_concurrency=args.concurrency),
+        "compiled": CompiledWorkflow("bench-fake", debug=False, output_dir=output_dir, max_concurrency=args.concurrency),
+    }
+
+    print(f"请求数: {args.requests}, 学校并发: {args.concurrency}")
+    means = {}
+    for name, wf in workflows.items():
+        means[f"{name} run"] = summarize(f"{name} run", measure(lambda: wf.generate(PROFILE), args.requests, args.warmup))
+    for name, wf in workflows.items():
+        means[f"{name} arun"] = summarize(
+            f"{name} arun", measure(lambda: asyncio.run(wf.agenerate(PROFILE)), args.requests, args.warmup))
+
+    for mode in ("run", "arun"):
+        legacy, compiled = means[f"legacy {mode}"], means[f"compiled {mode}"]
+        print(f"{mode}: 每次请求节省 {legacy - compiled:.3f} ms ({(1 - compiled / legacy) * 100:.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
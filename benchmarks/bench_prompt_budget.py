@@ -0,0 +1,145 @@
+"""
+Prompt token预算基准测试
+
+用确定性的假LLM生成报告, 学生profile在样例profile后追加不同行数的日常琐事和活动经历,
+专业推荐章节替换为一份较长的专业推荐报告, 知识库返回带有大量字段和长文本的学校记录。
+对比关闭压缩(只计数)和按预算压缩两种模式下各阶段prompt的平均token数、超出预算的次数和生成一份报告的耗时。
+
+tiktoken的编码文件无法下载时(离线)按4个字符一个token估算, 输出中会注明。
+
+用法:
+    python benchmarks/bench_prompt_budget.py --reports 5 --profile-lines 0 50 200
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+sys.path.append(os.path.join(ROOT_DIR, "university_selection_report"))
+
+from fake_llm import DEFAULT_MAJORS, register_fake_provider
+from prompt_budget import PromptBudget
+from report_metrics import get_default_metrics
+from school_section_store import SchoolSectionStore
+from university_selection_workflow import UniversitySelectionWorkflow
+
+SAMPLE_PROFILE = os.path.join(ROOT_DIR, "university_selection_report", "StudentProfile.txt")
+FILLER_LINES = (
+    "周末常和朋友去商场吃火锅，偶尔一起看电影。",
+    "家里养了一只橘猫，每天放学回家负责喂猫和铲猫砂。",
+    "学校食堂的早餐种类不多，经常在校门口买煎饼果子。",
+    "喜欢听流行音乐，手机里收藏了几百首歌曲。",
+    "寒假和家人去海南旅游，在海边住了一周。",
+)
+ACTIVITY_LINES = (
+    "参加学校机器人社团，负责传感器调试，获得市级比赛二等奖。",
+    "暑假在本地科技公司实习两周，协助整理测试数据。",
+    "担任班级学习委员，组织每周一次的数学互助小组。",
+    "自学Python完成一个天气查询小项目，代码放在GitHub上。",
+)
+
+
+def make_profile(rng: random.Random, base: str, lines: int) -> str:
+    extra = [rng.choice(FILLER_LINES if rng.random() < 0.7 else ACTIVITY_LINES) for _ in range(lines)]
+    return base + ("\n九、其他经历\n" + "\n".join(extra) if extra else "")
+
+
+def make_majors_report(rng: random.Random) -> str:
+    """较长的专业推荐报告: 每个专业一个标题, 多段理由"""
+    parts = ["# Major Recommendations", ""]
+    for index, major in enumerate(rng.sample(DEFAULT_MAJORS, 3), 1):
+        parts += [f"## {index}. {major}", "", "**Reasons:**",
+                  f"- The student's coursework and long-standing interests align closely with {major}.",
+                  "- Strong quantitative preparation suggests the student will handle the core sequence well, "
+                  "and the field offers a wide range of career paths after graduation.",
+                  "- Many universities offer undergraduate research opportunities and internships in this area, "
+                  "which would help the student build practical experience early on.",
+                  ""]
+    parts.append("Overall, these majors balance the student's interests with strong job prospects.")
+    return "\n".join(parts)
+
+
+class LargeRecordKnowledge:
+    """返回大记录的知识库: 录取相关字段和大量无关字段、长文本"""
+
+    def __init__(self, extra_fields: int = 40):
+        self.extra_fields = extra_fields
+
+    def query_many(self, school_names: Sequence[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        records = {}
+        for school in school_names:
+            record: Dict[str, Any] = {
+                "University Name": school,
+                "acceptance_rate": 0.42,
+                "sat_range": [1280, 1480],
+                "toefl_minimum": 90,
+                "international_students": 0.12,
+                "description": f"{school} is a large research university with a broad range of programs. " * 6,
+                "history": f"{school} was founded in the nineteenth century and has grown steadily since. " * 20,
+            }
+            for index in range(self.extra_fields):
+                record[f"misc_{index}"] = f"campus facility note {index}: dining hall hours and parking permits. " * 3
+            records[school] = record
+        return records
+
+
+def run_mode(compaction: bool, profiles: List[str], majors: List[str], knowledge: Any) -> Dict[str, Any]:
+    budget = PromptBudget(compaction=compaction, metrics=get_default_metrics())
+    timings = []
+    for profile, majors_report in zip(profiles, majors):
+        workflow = UniversitySelectionWorkflow(
+            "fake", debug=False, knowledge=knowledge, school_store=SchoolSectionStore(), prompt_budget=budget)
+        started = time.perf_counter()
+        workflow.run(profile, save=False, overrides={"recommend_majors": majors_report})
+        timings.append((time.perf_counter() - started) * 1000)
+    return {"stats": budget.stats()["stages"], "ms": statistics.mean(timings)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="各阶段prompt token数: 只计数 vs 按预算压缩")
+    parser.add_argument("--reports", type=int, default=5, help="每种profile长度生成的报告数")
+    parser.add_argument("--profile-lines", type=int, nargs="+", default=[0, 50, 200], help="样例profile后追加的行数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ.pop("LANGSMITH_API_KEY", None)
+    os.environ["LANGCHAIN_TRACING_V2"] = "false"
+    register_fake_provider("fake", latency=0.0)
+    counter = get_default_metrics().tokens
+    encoding = counter._get_encoding(None)
+    print("token计数:", "tiktoken cl100k_base" if encoding is not None else "tiktoken编码不可用, 按4个字符一个token估算")
+
+    with open(SAMPLE_PROFILE, encoding="utf-8") as f:
+        base = f.read()
+    knowledge = LargeRecordKnowledge()
+    for lines in args.profile_lines:
+        rng = random.Random(args.seed)
+        profiles = [make_profile(rng, base, lines) for _ in range(args.reports)]
+        majors = [make_majors_report(rng) for _ in range(args.reports)]
+        size = statistics.mean(counter.count(profile) for profile in profiles)
+        print(f"\nprofile追加 {lines} 行, 平均 {size:.0f} tokens")
+        results = {mode: run_mode(mode == "compact", profiles, majors, knowledge) for mode in ("count", "compact")}
+        print(f"{'stage':<30}{'budget':>8}{'count-only':>12}{'compact':>10}{'saved':>8}{'over budget':>14}")
+        total = {"count": 0.0, "compact": 0.0}
+        for stage, raw in results["count"]["stats"].items():
+            compacted = results["compact"]["stats"][stage]
+            if not raw["prompts"]:
+                continue
+            saved = 1 - compacted["mean_tokens"] / raw["mean_tokens"]
+            for mode, stats in (("count", raw), ("compact", compacted)):
+                total[mode] += stats["mean_tokens"] * stats["prompts"] / args.reports
+            print(f"{stage:<30}{raw['budget']:>8}{raw['mean_tokens']:>12.0f}{compacted['mean_tokens']:>10.0f}"
+                  f"{saved * 100:>7.1f}%{raw['over_budget']:>7} -> {compacted['over_budget']}")
+        print(f"每份报告prompt总token数: {total['count']:.0f} -> {total['compact']:.0f} "
+              f"({(1 - total['compact'] / total['count']) * 100:.1f}%), "
+              f"生成耗时 {results['count']['ms']:.1f} ms -> {results['compact']['ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+相同请求合并(single-flight)基准测试
+
+用确定性的假LLM模拟两种场景, 对比关闭合并(每个请求各自执行)和开启合并时的LLM调用次数和总耗时:
+- 重复提交: 同一份profile被并发提交多次(顾问双击、客户端超时重试), 一半请求走同步run()(线程), 一半走异步arun()
+- 热门学校: 多个请求的报告key不同(重新生成的章节不同), 但各阶段的prompt相同, 只能在LLM调用层合并
+
+用法:
+    python benchmarks/bench_single_flight.py --duplicates 8 --latency 0.05
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+sys.path.append(os.path.join(ROOT_DIR, "university_selection_report"))
+
+from fake_llm import register_fake_provider
+from school_section_store import SchoolSectionStore
+from single_flight import SingleFlight
+from university_selection_workflow import UniversitySelectionWorkflow
+
+SAMPLE_PROFILE = os.path.join(ROOT_DIR, "university_selection_report", "StudentProfile.txt")
+REGENERATE_TARGETS = ([], ["safety"], ["target"], ["reach"])
+
+
+class NoFlight(SingleFlight):
+    """关闭合并: 每个调用各自执行"""
+
+    def do(self, key: Any, fn: Callable[[], Any], stage: str = "", llm_name: str = "") -> Any:
+        return fn()
+
+    async def ado(self, key: Any, fn: Callable[[], Any], stage: str = "", llm_name: str = "") -> Any:
+        return await fn()
+
+
+def make_workflow(coalesce: bool) -> UniversitySelectionWorkflow:
+    workflow = UniversitySelectionWorkflow("fake", debug=False, school_store=SchoolSectionStore())
+    if not coalesce:
+        workflow.llm_flight = NoFlight("llm_call")
+        workflow.report_flight = NoFlight("report")
+    else:
+        workflow.llm_flight = SingleFlight("llm_call")
+        workflow.report_flight = SingleFlight("report")
+    return workflow
+
+
+def run_concurrently(workflow: UniversitySelectionWorkflow, profile: str, requests: List[List[str]]) -> float:
+    """一半请求在线程中调用run(), 另一半在事件循环中调用arun(), 返回全部完成的耗时"""
+    sync_requests, async_requests = requests[::2], requests[1::2]
+    threads = [threading.Thread(target=workflow.run, args=(profile,), kwargs={"save": False, "regenerate": regenerate})
+               for regenerate in sync_requests]
+
+    async def arun_all():
+        await asyncio.gather(*[workflow.arun(profile, save=False, regenerate=regenerate)
+                               for regenerate in async_requests])
+
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    asyncio.run(arun_all())
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started
+
+
+def run_scenario(coalesce: bool, profile: str, requests: List[List[str]]) -> Dict[str, Any]:
+    workflow = make_workflow(coalesce)
+    # 假LLM实例由客户端池共享, 调用次数按差值计算
+    before = sum(workflow.llm._calls.values())
+    elapsed = run_concurrently(workflow, profile, requests)
+    return {"calls": sum(workflow.llm._calls.values()) - before, "seconds": elapsed,
+            "llm_call": workflow.llm_flight.stats(), "report": workflow.report_flight.stats()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="相同请求合并前后的LLM调用次数和耗时")
+    parser.add_argument("--duplicates", type=int, default=8, help="同一份profile并发提交的次数")
+    parser.add_argument("--latency", type=float, default=0.05, help="假LLM每次调用的延迟(秒)")
+    args = parser.parse_args()
+
+    os.environ.pop("LANGSMITH_API_KEY", None)
+    os.environ["LANGCHAIN_TRACING_V2"] = "false"
+    register_fake_provider("fake", latency=args.latency)
+    with open(SAMPLE_PROFILE, encoding="utf-8") as f:
+        profile = f.read()
+
+    scenarios = {
+        "重复提交": [[] for _ in range(args.duplicates)],
+        "热门学校": [list(REGENERATE_TARGETS[i % len(REGENERATE_TARGETS)]) for i in range(args.duplicates)],
+    }
+    print(f"{'scenario':<12}{'mode':<12}{'LLM calls':>10}{'seconds':>10}  leaders/followers")
+    for name, requests in scenarios.items():
+        for coalesce in (False, True):
+            result = run_scenario(coalesce, profile, requests)
+            flights = (f"report {result['report']['leaders']}/{result['report']['followers']}, "
+                       f"llm {result['llm_call']['leaders']}/{result['llm_call']['followers']}") if coalesce else "-"
+            print(f"{name:<12}{'coalesce' if coalesce else 'off':<12}{result['calls']:>10}"
+                  f"{result['seconds']:>10.2f}  {flights}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+确定性的离线假LLM
+
+按prompt内容生成固定格式的输出(专业推荐、学校推荐表格或JSON、学校章节、推荐理由、学校名称提取)，
+相同的prompt和seed总是得到相同的结果，不需要网络和API key。
+可配置首token延迟、每秒token数、失败率和慢调用(长尾延迟)比例，用于基准测试并发、缓存、流式输出和对冲请求。
+
+用法:
+    from fake_llm import register_fake_provider
+    register_fake_provider("fake", latency=0.2, tokens_per_second=200, failure_rate=0.01)
+    UniversitySelectionWorkflow(llm_name="fake").run("GPA 3.8 ...")
+"""
+
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+DEFAULT_SCHOOLS = [
+    "Purdue University", "Ohio State University", "Carnegie Mellon University",
+    "University of Michigan-Ann Arbor", "Rutgers University-New Brunswick", "Stanford University",
+    "Boston University", "Northeastern University", "Cornell University", "Georgia Institute of Technology",
+    "University of Washington-Seattle Campus", "Duke University",
+]
+DEFAULT_MAJORS = ["Computer Science", "Electrical Engineering", "Data Science", "Economics", "Mechanical Engineering"]
+
+_TOKEN = re.compile(r"\S+\s*|\s+")
+_FILLER = ("The admission committee values sustained academic rigor, meaningful extracurricular depth "
+           "and a clear fit between the applicant's goals and the program's strengths. ").split()
+
+
+class FakeLLMError(RuntimeError):
+    """假LLM按failure_rate模拟的调用失败"""
+
+
+class DeterministicFakeChatModel(BaseChatModel):
+    """按prompt内容返回确定性输出的chat模型"""
+
+    latency: float = 0.05
+    """每次调用的首token延迟(秒)"""
+    tokens_per_second: float = 0.0
+    """输出速度, 0表示首token之后立即输出全部内容"""
+    failure_rate: float = 0.0
+    """调用失败的概率(0~1), 由prompt、seed和该prompt的调用次数决定, 重试同一个prompt可能成功"""
+    slow_rate: float = 0.0
+    """慢调用的概率(0~1), 与失败一样由prompt、seed和调用次数决定; 不同seed的实例相互独立"""
+    slow_latency: float = 1.0
+    """慢调用额外增加的首token延迟(秒)"""
+    min_tokens: int = 120
+    """学校章节等长文本的最少token数, 不足时用填充文本补齐"""
+    seed: int = 0
+    schools: List[str] = DEFAULT_SCHOOLS
+    majors: List[str] = DEFAULT_MAJORS
+
+    _calls: Dict[str, int] = PrivateAttr(default_factory=dict)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def _llm_type(self) -> str:
+        return "deterministic-fake"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": "deterministic-fake", "seed": self.seed, "min_tokens": self.min_tokens}
+
+    def _digest(self, prompt: str) -> int:
+        return int.from_bytes(hashlib.sha256(f"{self.seed}:{prompt}".encode("utf-8")).digest()[:8], "big")
+
+    def _pick(self, prompt: str, options: List[str], count: int) -> List[str]:
+        start = self._digest(prompt) % len(options)
+        return [options[(start + i) % len(options)] for i in range(min(count, len(options)))]
+
+    def _pad(self, text: str, prompt: str) -> str:
+        tokens = len(_TOKEN.findall(text))
+        if tokens >= self.min_tokens:
+            return text
+        offset = self._digest(prompt) % len(_FILLER)
+        filler = [_FILLER[(offset + i) % len(_FILLER)] for i in range(self.min_tokens - tokens)]
+        return f"{text}\n\n{' '.join(filler)}"
+
+    def respond(self, prompt: str) -> str:
+        """按prompt类型生成输出, 格式与真实模型的常见输出一致"""
+        if "recommend 1 safety school" in prompt:
+            # 与真实模型类似, 优先推荐学生profile中自己列出的学校
+            listed = [school for school in self.schools if school in prompt]
+            picked = listed + [school for school in self._pick(prompt, self.schools, 6) if school not in listed]
+            if "JSON schema" in prompt:
+                return json.dumps({"schools": [
+                    {"tier": tier, "school": school, "reason": f"{tier} choice matching the student's profile"}
+                    for school, tier in zip(picked[:3], ("safety", "target", "reach"))]})
+            rows = [f"| {school} | {tier} choice matching the student's profile |"
+                    for school, tier in zip(picked[:3], ("Safety", "Target", "Reach"))]
+            return "| School Name | Reason |\n| ------------- | ------------- |\n" + "\n".join(rows)
+        if "extract the names" in prompt:
+            found = [school for school in self.schools if school in prompt]
+            return "\n".join((found or self._pick(prompt, self.schools, 3))[:3])
+        if "recommend 3 most suitable majors" in prompt:
+            majors = self._pick(prompt, self.majors, 3)
+            return "\n\n".join(f"### {major}\n\nStrong alignment with the student's coursework and interests."
+                               for major in majors)
+        if "general part of the university selection report" in prompt:
+            sections = ["### School description and introduction", "### Historical admission data",
+                        "### Admission requirements", "### Admission rate and overview for Asian students"]
+            return self._pad("\n\n".join(f"{title}\n\nDetails for this section." for title in sections), prompt)
+        if "briefly explain why" in prompt:
+            return "- Academic profile fits the program\n- Strong major alignment\n- Balanced admission odds"
+        return self._pad("Fake response.", prompt)
+
+    def _prepare(self, messages: List[BaseMessage]) -> Tuple[str, float]:
+        """返回 (输出文本, 首token延迟)"""
+        prompt = "\n".join(message.text() for message in messages)
+        with self._lock:
+            count = self._calls.get(prompt, 0)
+            self._calls[prompt] = count + 1
+        if self.failure_rate > 0:
+            roll = self._digest(f"{count}:{prompt}") % 10000 / 10000
+            if roll < self.failure_rate:
+                raise FakeLLMError(f"fake LLM failure (attempt {count + 1})")
+        latency = self.latency
+        if self.slow_rate > 0 and self._digest(f"slow:{count}:{prompt}") % 10000 / 10000 < self.slow_rate:
+            latency += self.slow_latency
+        return self.respond(prompt), latency
+
+    def _token_delay(self) -> float:
+        return 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        text, latency = self._prepare(messages)
+        time.sleep(latency + self._token_delay() * len(_TOKEN.findall(text)))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        text, latency = self._prepare(messages)
+        await asyncio.sleep(latency + self._token_delay() * len(_TOKEN.findall(text)))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        text, latency = self._prepare(messages)
+        time.sleep(latency)
+        for token in _TOKEN.findall(text):
+            time.sleep(self._token_delay())
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager is not None:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        text, latency = self._prepare(messages)
+        await asyncio.sleep(latency)
+        delay = self._token_delay()
+        for token in _TOKEN.findall(text):
+            if delay:
+                await asyncio.sleep(delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager is not None:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+def register_fake_provider(name: str = "fake", **options: Any) -> None:
+    """在LLM_REGISTRY中注册假LLM, options为DeterministicFakeChatModel的字段"""
+    from university_selection_workflow import LLM_REGISTRY
+    LLM_REGISTRY[name] = lambda: DeterministicFakeChatModel(**options)
@@ -0,0 +1,93 @@
+"""
+启动耗时预算检查
+
+用 python -X importtime 分别在新进程中导入 university_selection_workflow 和 langserve_app，
+检查累计导入耗时不超过预算，并且不会在导入时加载LLM provider SDK、渲染后端和大型科学计算库
+(这些依赖应在第一次使用时才导入)。超出预算或加载了禁止的模块时退出码为1。
+
+用法:
+    python benchmarks/import_budget.py
+    python benchmarks/import_budget.py --workflow-budget-ms 800 --app-budget-ms 1500 --repeat 5 --top 15
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(ROOT_DIR, "university_selection_report")
+
+# 导入时不应加载的模块: provider SDK、渲染后端、向量模型和数据分析库
+FORBIDDEN_MODULES = [
+    "langchain_openai", "langchain_google_genai", "openai", "google.generativeai",
+    "markdown", "weasyprint", "pypandoc",
+    "torch", "torchvision", "torchaudio", "sentence_transformers", "faiss", "duckdb",
+    "pandas", "matplotlib", "streamlit",
+]
+
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+def measure_import(module: str) -> Tuple[float, Dict[str, Tuple[float, float]]]:
+    """在新进程中导入module, 返回 (累计耗时ms, {模块名: (自身耗时ms, 累计耗时ms)})"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [APP_DIR, ROOT_DIR, env.get("PYTHONPATH")]))
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=APP_DIR, env=env, capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{completed.stderr[-2000:]}")
+
+    modules: Dict[str, Tuple[float, float]] = {}
+    total = 0.0
+    for line in completed.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        modules[name] = (int(self_us) / 1000, int(cumulative_us) / 1000)
+        if name == module and len(indent) <= 1:
+            total = int(cumulative_us) / 1000
+    return total, modules
+
+
+def forbidden_imports(modules: Dict[str, Tuple[float, float]]) -> List[str]:
+    return [name for name in FORBIDDEN_MODULES if name in modules]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="import耗时预算检查")
+    parser.add_argument("--workflow-budget-ms", type=float,
+                        default=float(os.getenv("IMPORT_BUDGET_WORKFLOW_MS", "1000")),
+                        help="import university_selection_workflow 的预算(毫秒)")
+    parser.add_argument("--app-budget-ms", type=float,
+                        default=float(os.getenv("IMPORT_BUDGET_APP_MS", "2000")),
+                        help="import langserve_app 的预算(毫秒)")
+    parser.add_argument("--repeat", type=int, default=3, help="重复次数, 取最小值以排除磁盘缓存等噪声")
+    parser.add_argument("--top", type=int, default=10, help="显示累计耗时最长的前N个模块")
+    args = parser.parse_args()
+
+    budgets = {"university_selection_workflow": args.workflow_budget_ms, "langserve_app": args.app_budget_ms}
+    failed = False
+    for module, budget in budgets.items():
+        runs = [measure_import(module) for _ in range(max(1, args.repeat))]
+        total, modules = min(runs, key=lambda run: run[0])
+        status = "OK" if total <= budget else "超出预算"
+        print(f"\n{module}: {total:.1f} ms (预算 {budget:.0f} ms) {status}")
+        slowest = sorted(((cumulative, name) for name, (_, cumulative) in modules.items() if name != module),
+                         reverse=True)[:args.top]
+        for cumulative, name in slowest:
+            print(f"  {cumulative:8.1f} ms  {name}")
+        forbidden = forbidden_imports(modules)
+        if forbidden:
+            print(f"  导入时加载了应延迟导入的模块: {', '.join(forbidden)}")
+        failed = failed or total > budget or bool(forbidden)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,445 @@
+"""
+选校报告离线负载基准测试
+
+在LLM_REGISTRY中注册确定性的假LLM(见fake_llm.py)，不需要网络和API key，对以下目标施加并发负载:
+- workflow:       UniversitySelectionWorkflow.run()，线程池并发
+- workflow-async: UniversitySelectionWorkflow.arun()，asyncio并发
+- api:            FastAPI POST /generate_report
+- langserve:      LangServe POST /langserve/generate_report/invoke
+- stream:         POST /generate_report/stream (SSE)，额外统计首个事件的延迟
+统计每个目标的p50/p95/p99延迟、吞吐量、失败数、进程峰值RSS，以及各阶段(专业推荐、学校推荐、名称提取、学校信息填充、保存报告)的耗时。
+
+结果可以用--json保存，之后用--baseline对比，p95延迟或吞吐量的退化超过--max-regression时以退出码1结束，可作为回归门禁。
+
+用法:
+    python benchmarks/load_benchmark.py --requests 50 --concurrency 8 --latency 0.2 --tokens-per-second 300
+    python benchmarks/load_benchmark.py --targets api,langserve --json out.json --baseline baseline.json
+    python benchmarks/load_benchmark.py --targets workflow-async --slow-rate 0.05 --slow-latency 2 --hedge
+    python benchmarks/load_benchmark.py --targets workflow-async --tokens-per-second 100 --profile-targets 2 --pipelined
+    python benchmarks/load_benchmark.py --targets workflow,workflow-async --structured
+"""
+
+import argparse
+import asyncio
+import contextlib
+import functools
+import inspect
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+sys.path.append(os.path.join(ROOT_DIR, "university_selection_report"))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+TARGETS = ["workflow", "workflow-async", "api", "langserve", "stream"]
+
+# 按阶段统计耗时的workflow方法: 阶段名 -> (同步方法, 异步方法)
+STAGE_METHODS = {
+    "recommend_majors": ("recommend_majors", "arecommend_majors"),
+    "recommend_schools": ("recommend_schools", "arecommend_schools"),
+    "extract_school_names": ("extract_school_names", "aextract_school_names"),
+    "fill_school_info": ("fill_school_sections", "afill_school_sections"),
+    "save_report": ("_save_report",),
+}
+
+
+def percentile(values: List[float], q: float) -> float:
+    """最近秩法的百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))]
+
+
+def peak_rss_mb() -> float:
+    """进程峰值RSS(MB), Linux上ru_maxrss单位为KB, macOS上为字节"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class StageTimer:
+    """在workflow类的各阶段方法外包一层计时, 同步和异步方法都适用"""
+
+    def __init__(self):
+        self.timings: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+        self._originals: Dict[str, Any] = {}
+
+    def record(self, stage: str, elapsed: float) -> None:
+        with self._lock:
+            self.timings.setdefault(stage, []).append(elapsed)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.timings = {}
+
+    def install(self, cls: type) -> None:
+        for stage, method_names in STAGE_METHODS.items():
+            for method_name in method_names:
+                original = getattr(cls, method_name)
+                self._originals[method_name] = original
+                setattr(cls, method_name, self._wrap(stage, original))
+        self._cls = cls
+
+    def uninstall(self) -> None:
+        for method_name, original in self._originals.items():
+            setattr(self._cls, method_name, original)
+        self._originals.clear()
+
+    def _wrap(self, stage: str, func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - started)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - started)
+        return wrapper
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                stage: {
+                    "count": len(values),
+                    "mean_ms": sum(values) / len(values) * 1000,
+                    "p50_ms": percentile(values, 50) * 1000,
+                    "p95_ms": percentile(values, 95) * 1000,
+                }
+                for stage, values in self.timings.items() if values
+            }
+
+
+def make_profiles(requests: int, distinct: int, targets: int = 0) -> List[str]:
+    """
+    生成请求使用的profile, distinct控制不同profile的数量(影响缓存命中率),
+    targets为profile中学生自己列出的目标学校数(流水线模式会提前生成这些学校的章节)
+    """
+    distinct = max(1, distinct)
+    profiles = []
+    for i in range(requests):
+        n = i % distinct
+        profile = (f"Student #{n}: GPA {3.0 + n % 10 / 10:.1f}, SAT {1300 + n % 30 * 10}, "
+                   f"interested in engineering and computer science.")
+        if targets:
+            from fake_llm import DEFAULT_SCHOOLS
+            schools = [DEFAULT_SCHOOLS[(n + k) % len(DEFAULT_SCHOOLS)] for k in range(targets)]
+            profile += f" Target schools: {', '.join(schools)}."
+        profiles.append(profile)
+    return profiles
+
+
+def summarize(target: str, latencies: List[float], failures: int, wall: float,
+              extra: Optional[Dict[str, List[float]]] = None) -> Dict[str, Any]:
+    completed = len(latencies)
+    result = {
+        "target": target,
+        "requests": completed + failures,
+        "succeeded": completed,
+        "failed": failures,
+        "wall_s": wall,
+        "throughput_rps": completed / wall if wall > 0 else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    for name, values in (extra or {}).items():
+        result[f"{name}_p50_ms"] = percentile(values, 50) * 1000
+        result[f"{name}_p95_ms"] = percentile(values, 95) * 1000
+    return result
+
+
+def bench_workflow(workflow, profiles: List[str], concurrency: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    failures = 0
+    lock = threading.Lock()
+
+    def one(profile: str) -> None:
+        nonlocal failures
+        started = time.perf_counter()
+        try:
+            workflow.run(profile)
+        except Exception:
+            with lock:
+                failures += 1
+            return
+        with lock:
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bench") as executor:
+        list(executor.map(one, profiles))
+    return summarize("workflow", latencies, failures, time.perf_counter() - started)
+
+
+async def bench_workflow_async(workflow, profiles: List[str], concurrency: int) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    failures = 0
+
+    async def one(profile: str) -> None:
+        nonlocal failures
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await workflow.arun(profile)
+            except Exception:
+                failures += 1
+                return
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(profile) for profile in profiles))
+    return summarize("workflow-async", latencies, failures, time.perf_counter() - started)
+
+
+class LocalServer:
+    """在后台线程中用uvicorn监听127.0.0.1的空闲端口, 请求走真实的HTTP和SSE流程(不需要外部网络)"""
+
+    def __init__(self, app):
+        import socket
+        import uvicorn
+
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self._thread = threading.Thread(target=self.server.run, name="bench-uvicorn", daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self) -> "LocalServer":
+        self._thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.server.should_exit = True
+        self._thread.join()
+
+
+async def _post_stream(client, body: Dict[str, Any], started: float, first_event: List[float]) -> bool:
+    """读取SSE事件流, 记录首个事件的延迟, 收到report事件视为成功"""
+    ok = False
+    seen_first = False
+    async with client.stream("POST", "/generate_report/stream", json=body) as response:
+        if response.status_code != 200:
+            return False
+        async for line in response.aiter_lines():
+            if not line.startswith("event:"):
+                continue
+            if not seen_first:
+                first_event.append(time.perf_counter() - started)
+                seen_first = True
+            event = line.split(":", 1)[1].strip()
+            if event == "error":
+                return False
+            if event == "report":
+                ok = True
+    return ok
+
+
+async def bench_http(target: str, base_url: str, profiles: List[str], concurrency: int, llm_name: str) -> Dict[str, Any]:
+    import httpx
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    first_event: List[float] = []
+    failures = 0
+
+    async def one(client, profile: str) -> None:
+        nonlocal failures
+        body = {"profile": profile, "llm_name": llm_name, "debug": False}
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                if target == "api":
+                    response = await client.post("/generate_report", json=body)
+                    ok = response.status_code == 200
+                elif target == "langserve":
+                    response = await client.post("/langserve/generate_report/invoke", json={"input": body})
+                    # LangServe路由出错时不返回错误码, 而是返回空报告(输出按UniversitySelectionResponse序列化)
+                    ok = response.status_code == 200 and bool(response.json()["output"].get("report"))
+                else:
+                    ok = await _post_stream(client, body, started, first_event)
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                failures += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=None, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(client, profile) for profile in profiles))
+        wall = time.perf_counter() - started
+    extra = {"first_event": first_event} if target == "stream" else None
+    return summarize(target, latencies, failures, wall, extra)
+
+
+def compare_with_baseline(results: List[Dict[str, Any]], baseline_path: str, max_regression: float) -> List[str]:
+    """与基线结果对比p95延迟和吞吐量, 返回超出容忍度的退化项"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {item["target"]: item for item in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        base = baseline.get(result["target"])
+        if base is None:
+            continue
+        if base["p95_ms"] > 0 and result["p95_ms"] > base["p95_ms"] * (1 + max_regression):
+            regressions.append(f"{result['target']}: p95 {base['p95_ms']:.1f} -> {result['p95_ms']:.1f} ms")
+        if result["throughput_rps"] < base["throughput_rps"] * (1 - max_regression):
+            regressions.append(f"{result['target']}: 吞吐量 {base['throughput_rps']:.2f} -> {result['throughput_rps']:.2f} req/s")
+    return regressions
+
+
+def print_result(result: Dict[str, Any], stages: Dict[str, Dict[str, float]]) -> None:
+    print(f"\n[{result['target']}] {result['succeeded']}/{result['requests']} 成功, "
+          f"吞吐量 {result['throughput_rps']:.2f} req/s, 峰值RSS {result['peak_rss_mb']:.1f} MB")
+    print(f"  延迟: p50={result['p50_ms']:.1f} ms  p95={result['p95_ms']:.1f} ms  p99={result['p99_ms']:.1f} ms")
+    if "first_event_p50_ms" in result:
+        print(f"  首个事件: p50={result['first_event_p50_ms']:.1f} ms  p95={result['first_event_p95_ms']:.1f} ms")
+    for stage, timing in stages.items():
+        print(f"  {stage:<22} n={timing['count']:<5} mean={timing['mean_ms']:8.1f} ms  "
+              f"p50={timing['p50_ms']:8.1f} ms  p95={timing['p95_ms']:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="选校报告离线负载基准测试")
+    parser.add_argument("--targets", default=",".join(TARGETS), help=f"逗号分隔, 可选: {','.join(TARGETS)}")
+    parser.add_argument("--requests", type=int, default=30, help="每个目标的请求数")
+    parser.add_argument("--concurrency", type=int, default=8, help="同时进行的请求数")
+    parser.add_argument("--distinct-profiles", type=int, default=0, help="不同profile的数量, 0表示每个请求都不同")
+    parser.add_argument("--latency", type=float, default=0.1, help="假LLM每次调用的首token延迟(秒)")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="假LLM的输出速度, 0表示瞬时输出")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="假LLM调用失败的概率")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="假LLM慢调用(长尾延迟)的概率")
+    parser.add_argument("--slow-latency", type=float, default=1.0, help="慢调用额外增加的延迟(秒)")
+    parser.add_argument("--hedge", action="store_true",
+                        help="注册第二个独立的假LLM作为备选, 学校信息填充按主LLM的p95延迟对冲")
+    parser.add_argument("--hedge-after", type=float, help="固定的对冲等待秒数(隐含--hedge)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pipelined", action="store_true",
+                        help="流水线模式: 学校推荐表边生成边开始各学校章节(只影响异步和HTTP目标)")
+    parser.add_argument("--structured", action="store_true",
+                        help="结构化输出模式: 学校推荐按JSON schema返回, 不再提取学校名称")
+    parser.add_argument("--profile-targets", type=int, default=0, help="profile中学生自己列出的目标学校数")
+    parser.add_argument("--school-concurrency", type=int, default=3, help="workflow内学校信息填充的并发数")
+    parser.add_argument("--cache", default="none", choices=["none", "memory"], help="LLM响应缓存和报告阶段检查点")
+    parser.add_argument("--verbose", action="store_true", help="显示workflow和服务的输出")
+    parser.add_argument("--json", dest="json_path", help="把结果保存为JSON")
+    parser.add_argument("--baseline", help="基线结果JSON, 退化超过--max-regression时退出码为1")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="允许的p95延迟/吞吐量退化比例")
+    args = parser.parse_args()
+
+    targets = [target.strip() for target in args.targets.split(",") if target.strip()]
+    unknown = set(targets) - set(TARGETS)
+    if unknown:
+        parser.error(f"未知的目标: {', '.join(sorted(unknown))}")
+
+    # 服务模块在导入时读取这些环境变量; 关闭LangSmith上报, 避免网络请求
+    os.environ["LLM_CACHE_BACKEND"] = args.cache
+    os.environ["REPORT_CHECKPOINT_BACKEND"] = args.cache
+    os.environ["REPORT_STRUCTURED_OUTPUT"] = "true" if args.structured else "false"
+    os.environ.pop("LANGSMITH_API_KEY", None)
+    os.environ["LANGCHAIN_TRACING_V2"] = "false"
+
+    from fake_llm import register_fake_provider
+    from llm_cache import InMemoryLRUCache
+    from report_checkpoints import ReportCheckpointStore
+    from school_section_store import SchoolSectionStore
+    from university_selection_workflow import UniversitySelectionWorkflow
+
+    llm_name = "bench-fake"
+    fake_options = dict(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                        failure_rate=args.failure_rate, slow_rate=args.slow_rate, slow_latency=args.slow_latency)
+    register_fake_provider(llm_name, seed=args.seed, **fake_options)
+    fallback_llms = []
+    if args.hedge or args.hedge_after is not None:
+        # 不同seed的备选假LLM, 慢调用与主LLM相互独立
+        fallback_llms = [f"{llm_name}-b"]
+        register_fake_provider(fallback_llms[0], seed=args.seed + 1, **fake_options)
+    output_dir = tempfile.mkdtemp(prefix="load-benchmark-")
+    profiles = make_profiles(args.requests, args.distinct_profiles or args.requests, args.profile_targets)
+
+    def new_workflow() -> UniversitySelectionWorkflow:
+        # 每个目标使用新的缓存和学校章节存储, 互不影响
+        return UniversitySelectionWorkflow(
+            llm_name=llm_name, debug=False, output_dir=output_dir, max_concurrency=args.school_concurrency,
+            cache=InMemoryLRUCache() if args.cache == "memory" else None, school_store=SchoolSectionStore(),
+            fallback_llms=fallback_llms, hedge_after=args.hedge_after,
+            checkpoints=ReportCheckpointStore() if args.cache == "memory" else None, pipelined=args.pipelined,
+            structured_output=args.structured,
+        )
+
+    def run_target(target: str) -> Dict[str, Any]:
+        if target == "workflow":
+            return bench_workflow(new_workflow(), profiles, args.concurrency)
+        if target == "workflow-async":
+            return asyncio.run(bench_workflow_async(new_workflow(), profiles, args.concurrency))
+        import langserve_app
+
+        # 预先放入使用临时输出目录的workflow, 服务不会写入仓库目录
+        langserve_app.service.workflows = {f"{llm_name}_False": new_workflow()}
+        with LocalServer(langserve_app.app) as server:
+            return asyncio.run(bench_http(target, server.base_url, profiles, args.concurrency, llm_name))
+
+    timer = StageTimer()
+    timer.install(UniversitySelectionWorkflow)
+    print(f"目标: {', '.join(targets)}; 每个目标 {args.requests} 个请求, 并发 {args.concurrency}; "
+          f"假LLM延迟 {args.latency}s, {args.tokens_per_second or '∞'} token/s, 失败率 {args.failure_rate}, "
+          f"慢调用 {args.slow_rate}(+{args.slow_latency}s){', 对冲' if fallback_llms else ''}")
+    results = []
+    devnull = open(os.devnull, "w", encoding="utf-8")
+    try:
+        for target in targets:
+            timer.reset()
+            # workflow保存报告时会打印输出路径, 默认不显示
+            with contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull):
+                result = run_target(target)
+            result["stages"] = timer.summary()
+            print_result(result, result["stages"])
+            results.append(result)
+    finally:
+        timer.uninstall()
+        devnull.close()
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存: {args.json_path}")
+    if args.baseline:
+        regressions = compare_with_baseline(results, args.baseline, args.max_regression)
+        if regressions:
+            print("\n性能退化:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("\n与基线相比没有超出容忍度的退化")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,402 @@
+"""
+大学知识库
+
+大学的录取数据和基本信息(json结构，每所大学一条记录，含 "University Name" 字段)存放在DuckDB列式文件中，
+学校通用章节prompt用到的字段(学校介绍、录取率、录取要求、标化和语言成绩、亚裔学生概况等, 见PROMPT_FIELDS)
+导入时按字段名映射为各自的列, 其余字段存放在extra列中。
+查询时输入学校名称，经过多路召回和重排找到对应的学校，只读取prompt用到的列:
+1. 召回: 名称精确/归一化匹配 + BM25关键词检索 + 向量检索(可选, SchoolNameVectorIndex)
+2. 融合: Reciprocal Rank Fusion 合并各路结果
+3. 重排: 按与查询名称的编辑距离相似度重排，取第一名
+热点学校的记录保存在LRU中；一份报告里的所有学校可以通过 query_many 一次查完。
+
+用法:
+    python knowledge_base/university_knowledge.py ingest data/*.json   # 导入json数据
+    python knowledge_base/university_knowledge.py query "Purdue University"
+    python knowledge_base/university_knowledge.py migrate              # 旧格式(整条记录一个JSON列)迁移为按列存储
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from normalization.university_normalization import fold_name, levenshtein
+
+KNOWLEDGE_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DB_PATH = os.path.join(KNOWLEDGE_BASE_DIR, "university_knowledge.duckdb")
+DEFAULT_INDEX_DIR = os.path.join(KNOWLEDGE_BASE_DIR, "index")
+NAME_FIELD = "University Name"
+
+# 学校通用章节prompt用到的字段: (列名, DuckDB类型, 对应的json字段名(折叠后, 下划线视为空格))
+PROMPT_FIELDS = (
+    ("description", "VARCHAR", ("description", "introduction", "intro", "overview", "about", "school description")),
+    ("location", "VARCHAR", ("location", "city", "state", "address")),
+    ("ranking", "VARCHAR", ("ranking", "rank", "us news ranking", "us news rank", "national ranking")),
+    ("acceptance_rate", "DOUBLE", ("acceptance rate", "admission rate", "admit rate", "acceptance")),
+    ("historical_admissions", "VARCHAR", ("historical admission data", "historical admissions", "admission history",
+                                          "admission data", "admissions data")),
+    ("admission_requirements", "VARCHAR", ("admission requirements", "application requirements", "requirements")),
+    ("sat_range", "VARCHAR", ("sat", "sat range", "sat scores", "sat score range")),
+    ("act_range", "VARCHAR", ("act", "act range", "act scores", "act score range")),
+    ("toefl_minimum", "VARCHAR", ("toefl", "toefl minimum", "minimum toefl", "toefl requirement")),
+    ("ielts_minimum", "VARCHAR", ("ielts", "ielts minimum", "minimum ielts", "ielts requirement")),
+    ("application_deadline", "VARCHAR", ("deadline", "deadlines", "application deadline", "application deadlines")),
+    ("international_students", "VARCHAR", ("international students", "international", "international student ratio")),
+    ("asian_students", "VARCHAR", ("asian students", "asian student overview", "asian admission", "asian")),
+    ("tuition", "VARCHAR", ("tuition", "tuition and fees", "cost", "cost of attendance")),
+)
+PROMPT_COLUMNS = [column for column, _, _ in PROMPT_FIELDS]
+_FIELD_COLUMNS = {alias: index for index, (_, _, aliases) in enumerate(PROMPT_FIELDS) for alias in aliases}
+_CREATE_TABLE = (
+    "CREATE TABLE IF NOT EXISTS universities (name VARCHAR PRIMARY KEY, name_folded VARCHAR, "
+    + ", ".join(f"{column} {column_type}" for column, column_type, _ in PROMPT_FIELDS)
+    + ", extra JSON)"
+)
+# resolve缓存中表示"没有缓存"(缓存的结果本身可能是None)
+_MISS = object()
+
+
+class BM25Index:
+    """学校名称的BM25关键词索引"""
+
+    def __init__(self, documents: Sequence[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._lengths: List[int] = []
+        for doc_id, document in enumerate(documents):
+            tokens = fold_name(document).split()
+            self._lengths.append(len(tokens))
+            for token, tf in Counter(tokens).items():
+                self._postings.setdefault(token, []).append((doc_id, tf))
+        self._avg_length = sum(self._lengths) / len(self._lengths) if self._lengths else 0.0
+
+    def idf(self, token: str) -> float:
+        """词的idf, 不在索引中的词按只出现一次计算"""
+        frequency = len(self._postings.get(token, ())) or 1
+        return math.log(1 + (len(self._lengths) - frequency + 0.5) / (frequency + 0.5))
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[int, float]]:
+        scores: Dict[int, float] = {}
+        for token in set(fold_name(query).split()):
+            posting = self._postings.get(token)
+            if not posting:
+                continue
+            idf = self.idf(token)
+            for doc_id, tf in posting:
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / self._avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+def _rate(value: Any) -> Optional[float]:
+    """录取率: 0.42、42、"42%" 都按比例返回, 无法解析时返回None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) / 100 if value > 1 else float(value)
+    text = str(value).strip()
+    try:
+        if text.endswith("%"):
+            return float(text[:-1]) / 100
+        return _rate(float(text))
+    except ValueError:
+        return None
+
+
+def split_record(record: Dict[str, Any]) -> Tuple[List[Any], Dict[str, Any]]:
+    """
+    把json记录拆成prompt字段的列值(按PROMPT_COLUMNS顺序)和其余字段;
+    同一列有多个字段时取第一个, 无法转换为列类型的值留在其余字段中
+    """
+    values: List[Any] = [None] * len(PROMPT_FIELDS)
+    extra: Dict[str, Any] = {}
+    for key, value in record.items():
+        if key == NAME_FIELD:
+            continue
+        index = _FIELD_COLUMNS.get(fold_name(str(key).replace("_", " ")))
+        if index is None or values[index] is not None or value in (None, "", [], {}):
+            extra[key] = value
+            continue
+        if PROMPT_FIELDS[index][1] == "DOUBLE":
+            converted = _rate(value)
+        elif isinstance(value, str):
+            converted = value
+        else:
+            converted = json.dumps(value, ensure_ascii=False)
+        if converted is None:
+            extra[key] = value
+        else:
+            values[index] = converted
+    return values, extra
+
+
+class UniversityKnowledge:
+    """大学知识库: DuckDB按列存储prompt用到的字段，多路召回+重排定位学校"""
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, vector_index: Any = None,
+                 top_k: int = 10, min_score: float = 0.65, lru_size: int = 512,
+                 read_only: bool = False, debug: bool = False):
+        """
+        vector_index: 可选的学校名称向量索引, 需提供 search(query, k) -> [(name, score), ...]
+        min_score: 重排后最佳候选的最低相似度, 低于该值视为知识库中没有这所学校
+        read_only: 只读打开, 多个worker进程可以同时读取同一个DuckDB文件
+        """
+        import duckdb
+
+        self.db_path = db_path
+        self.vector_index = vector_index
+        self.top_k = top_k
+        self.min_score = min_score
+        self.debug = debug
+        self._conn = duckdb.connect(db_path, read_only=read_only)
+        self._lock = threading.Lock()
+        if not read_only:
+            self._conn.execute(_CREATE_TABLE)
+        columns = {row[0] for row in self._conn.execute("DESCRIBE universities").fetchall()}
+        # 旧格式的知识库(整条记录存放在record列): 读写打开时迁移, 只读打开时查询后在Python中拆分
+        self._legacy = "record" in columns
+        if self._legacy and not read_only:
+            self._migrate()
+        self._lru: "OrderedDict[str, Optional[Dict[str, Any]]]" = OrderedDict()
+        self._lru_size = lru_size
+        self._resolved: Dict[str, Optional[str]] = {}
+        self._load_names()
+
+    @classmethod
+    def open_if_exists(cls, db_path: str = DEFAULT_DB_PATH, **kwargs) -> Optional["UniversityKnowledge"]:
+        """知识库文件存在时只读打开(有向量索引时一并以mmap方式加载)，否则返回None"""
+        if not os.path.exists(db_path):
+            return None
+        kwargs.setdefault("read_only", True)
+        if "vector_index" not in kwargs:
+            from normalization.school_vector_index import SchoolNameVectorIndex
+            kwargs["vector_index"] = SchoolNameVectorIndex.open_if_exists(DEFAULT_INDEX_DIR)
+        return cls(db_path=db_path, **kwargs)
+
+    def log(self, message: str, data: Any = None):
+        if self.debug:
+            print(f"[DEBUG][UniversityKnowledge] {message}")
+            if data is not None:
+                print(data)
+
+    def _migrate(self) -> None:
+        """旧格式的record列拆分为prompt字段的列和extra列, 在一个事务中完成"""
+        rows = self._conn.execute("SELECT record FROM universities").fetchall()
+        self._conn.execute("BEGIN TRANSACTION")
+        try:
+            self._conn.execute("DROP TABLE universities")
+            self._conn.execute(_CREATE_TABLE)
+            self._insert([json.loads(record) for record, in rows])
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+        self._legacy = False
+        self.log(f"已迁移 {len(rows)} 条旧格式记录")
+
+    def _insert(self, records: Iterable[Dict[str, Any]]) -> int:
+        rows = []
+        for record in records:
+            name = str(record.get(NAME_FIELD, "")).strip()
+            if name:
+                values, extra = split_record(record)
+                rows.append((name, fold_name(name), *values, json.dumps(extra, ensure_ascii=False)))
+        if rows:
+            placeholders = ", ".join("?" * (len(PROMPT_FIELDS) + 3))
+            with self._lock:
+                self._conn.executemany(f"INSERT OR REPLACE INTO universities VALUES ({placeholders})", rows)
+        return len(rows)
+
+    def _load_names(self) -> None:
+        with self._lock:
+            rows = self._conn.execute("SELECT name, name_folded FROM universities ORDER BY name").fetchall()
+        self.names = [row[0] for row in rows]
+        self._by_folded = {row[1]: row[0] for row in rows}
+        self._name_set = set(self.names)
+        self._bm25 = BM25Index(self.names)
+        self._resolved.clear()
+        self._lru.clear()
+
+    def ingest(self, records: Iterable[Dict[str, Any]]) -> int:
+        """导入学校记录(同名覆盖)，返回导入条数"""
+        count = self._insert(records)
+        self._load_names()
+        return count
+
+    def ingest_files(self, paths: Iterable[str]) -> int:
+        """导入json文件，每个文件为一条记录或记录数组"""
+        records = []
+        for path in paths:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            records.extend(data if isinstance(data, list) else [data])
+        return self.ingest(records)
+
+    def resolve(self, school_name: str) -> Optional[str]:
+        """多路召回 + RRF融合 + 重排，返回知识库中的学校名称"""
+        # 其他线程可能同时清空缓存, 只读取一次, 不能先判断再取值
+        cached = self._resolved.get(school_name, _MISS)
+        if cached is not _MISS:
+            return cached
+        folded = fold_name(school_name)
+        resolved = self._by_folded.get(folded)
+        if resolved is None:
+            candidates = self._recall(school_name)
+            resolved = self._rerank(folded, candidates)
+        if len(self._resolved) >= 4 * self._lru_size:
+            self._resolved.clear()
+        self._resolved[school_name] = resolved
+        return resolved
+
+    def _recall(self, school_name: str) -> Dict[str, float]:
+        """BM25和向量两路召回，用Reciprocal Rank Fusion合并"""
+        routes: Dict[str, List[str]] = {
+            "bm25": [self.names[doc_id] for doc_id, _ in self._bm25.search(school_name, self.top_k)],
+        }
+        if self.vector_index is not None:
+            routes["vector"] = [name for name, _ in self.vector_index.search(school_name, self.top_k)
+                                if name in self._name_set]
+        fused: Dict[str, float] = {}
+        for route, names in routes.items():
+            self.log(f"{route}召回: {school_name}", names)
+            for rank, name in enumerate(names):
+                fused[name] = fused.get(name, 0.0) + 1.0 / (60 + rank)
+        return fused
+
+    def _token_overlap(self, query_tokens: List[str], candidate_tokens: List[str]) -> float:
+        """按idf加权的词重合度, 缩写按前缀匹配(univ -> university)"""
+        total = sum(self._bm25.idf(token) for token in query_tokens)
+        matched = sum(
+            self._bm25.idf(token) for token in query_tokens
+            if any(other.startswith(token) or token.startswith(other) for other in candidate_tokens)
+        )
+        return matched / total if total else 0.0
+
+    def _rerank(self, folded: str, candidates: Dict[str, float]) -> Optional[str]:
+        """按编辑距离相似度和idf加权词重合度重排，RRF分数用于打破平局"""
+        ranked = []
+        query_tokens = folded.split()
+        for name, fused_score in candidates.items():
+            candidate = fold_name(name)
+            similarity = 1 - levenshtein(folded, candidate) / max(len(folded), len(candidate), 1)
+            overlap = self._token_overlap(query_tokens, candidate.split())
+            ranked.append(((similarity + overlap) / 2, fused_score, name))
+        ranked.sort(reverse=True)
+        self.log(f"重排结果: {folded}", ranked[:3])
+        if not ranked or ranked[0][0] < self.min_score:
+            return None
+        return ranked[0][2]
+
+    def _fetch(self, names: List[str]) -> List[Tuple[str, Dict[str, Any]]]:
+        """一条SQL取出多所学校prompt用到的列, 返回 (名称, {NAME_FIELD: 名称, 非空的列...})"""
+        if self._legacy:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT name, record FROM universities WHERE name IN (SELECT UNNEST(?::VARCHAR[]))", [names],
+                ).fetchall()
+            rows = [(name, *split_record(json.loads(record))[0]) for name, record in rows]
+        else:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT name, {', '.join(PROMPT_COLUMNS)} FROM universities "
+                    "WHERE name IN (SELECT UNNEST(?::VARCHAR[]))",
+                    [names],
+                ).fetchall()
+        records = []
+        for name, *values in rows:
+            record: Dict[str, Any] = {NAME_FIELD: name}
+            record.update((column, value) for column, value in zip(PROMPT_COLUMNS, values) if value is not None)
+            records.append((name, record))
+        return records
+
+    def query(self, school_name: str) -> Optional[Dict[str, Any]]:
+        """查询单所学校prompt用到的字段，找不到时返回None"""
+        return self.query_many([school_name])[school_name]
+
+    def query_many(self, school_names: Sequence[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """批量查询多所学校prompt用到的字段，未命中LRU的记录用一条SQL一次取出"""
+        resolved = {school: self.resolve(school) for school in school_names}
+        with self._lock:
+            missing = [name for name in set(resolved.values()) if name is not None and name not in self._lru]
+        if missing:
+            rows = self._fetch(missing)
+            with self._lock:
+                for name, record in rows:
+                    self._lru[name] = record
+                    self._lru.move_to_end(name)
+                while len(self._lru) > self._lru_size:
+                    self._lru.popitem(last=False)
+
+        results = {}
+        with self._lock:
+            for school, name in resolved.items():
+                record = self._lru.get(name) if name is not None else None
+                if record is not None:
+                    self._lru.move_to_end(name)
+                results[school] = record
+        self.log("查询结果", {school: name for school, name in resolved.items()})
+        return results
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+_default_knowledge: Optional[UniversityKnowledge] = None
+_default_knowledge_loaded = False
+_default_lock = threading.Lock()
+
+
+def get_default_knowledge() -> Optional[UniversityKnowledge]:
+    """进程内共享的只读知识库实例，默认知识库文件不存在时返回None"""
+    global _default_knowledge, _default_knowledge_loaded
+    if not _default_knowledge_loaded:
+        with _default_lock:
+            if not _default_knowledge_loaded:
+                _default_knowledge = UniversityKnowledge.open_if_exists()
+                _default_knowledge_loaded = True
+    return _default_knowledge
+
+
+def main():
+    parser = argparse.ArgumentParser(description="大学知识库")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    ingest_parser = subparsers.add_parser("ingest", help="导入json数据")
+    ingest_parser.add_argument("paths", nargs="+")
+    query_parser = subparsers.add_parser("query", help="查询学校")
+    query_parser.add_argument("names", nargs="+")
+    subparsers.add_parser("migrate", help="旧格式的知识库迁移为按列存储")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH)
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        knowledge = UniversityKnowledge(db_path=args.db)
+        count = knowledge.ingest_files(args.paths)
+        print(f"已导入 {count} 条记录, 知识库共 {len(knowledge)} 所学校")
+        # 为知识库中的学校名称建立向量索引(需要sentence-transformers)
+        try:
+            from normalization.school_vector_index import SchoolNameVectorIndex
+            SchoolNameVectorIndex(index_dir=DEFAULT_INDEX_DIR).build(knowledge.names)
+            print(f"向量索引已建立: {DEFAULT_INDEX_DIR}")
+        except ImportError as e:
+            print(f"跳过向量索引: {e}")
+    elif args.command == "migrate":
+        knowledge = UniversityKnowledge(db_path=args.db, debug=True)
+        print(f"知识库共 {len(knowledge)} 所学校")
+    else:
+        knowledge = UniversityKnowledge.open_if_exists(db_path=args.db, debug=True)
+        if knowledge is None:
+            print(f"知识库不存在: {args.db}")
+            return
+        print(json.dumps(knowledge.query_many(args.names), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
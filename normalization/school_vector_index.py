@@ -0,0 +1,256 @@
+"""
+学校名称向量索引
+
+用本地sentence-transformer模型（默认bge）批量生成学校名称的embedding，建立FAISS HNSW索引并持久化到本地文件。
+加载时使用mmap，多个uvicorn worker共享同一份索引文件的页缓存，启动时不需要重新生成embedding。
+学校名称列表增加时只对新增的名称生成embedding并增量加入索引。
+每次保存写入 index/versions/ 下新的版本目录(索引、名称列表和meta), 写完后原子替换 index/CURRENT 指向新版本,
+其他worker加载时索引和名称列表总是来自同一个版本。
+
+用法:
+    python normalization/school_vector_index.py build              # 为默认名称列表建立索引
+    python normalization/school_vector_index.py add new_names.txt  # 增量加入新名称
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+NORMALIZATION_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_INDEX_DIR = os.path.join(NORMALIZATION_DIR, "index")
+DEFAULT_MODEL = "BAAI/bge-small-en-v1.5"
+
+INDEX_FILE = "school_names.hnsw.faiss"
+NAMES_FILE = "school_names.json"
+META_FILE = "meta.json"
+# 指向当前版本目录的文件, 以及保留的版本数(正在加载旧版本的worker不会读到被删除的文件)
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+KEEP_VERSIONS = 2
+
+
+def _import_faiss():
+    try:
+        import faiss
+    except ImportError as e:
+        raise ImportError("需要安装faiss-cpu: pip install faiss-cpu") from e
+    return faiss
+
+
+class SchoolNameVectorIndex:
+    """学校名称的FAISS HNSW索引，向量已归一化，内积即余弦相似度"""
+
+    def __init__(self, index_dir: str = DEFAULT_INDEX_DIR, model_name: str = DEFAULT_MODEL,
+                 encoder: Optional[Callable[[List[str]], np.ndarray]] = None,
+                 batch_size: int = 256, hnsw_m: int = 32, ef_construction: int = 200, ef_search: int = 64):
+        """
+        encoder: 自定义的embedding函数(名称列表 -> 归一化后的float32矩阵), 默认使用sentence-transformers加载model_name
+        """
+        self.index_dir = index_dir
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.names: List[str] = []
+        self.index = None
+        self._encoder = encoder
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._name_set = set()
+        # 当前加载或保存的版本目录
+        self._version_dir: Optional[str] = None
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self._version_dir or _current_dir(self.index_dir), INDEX_FILE)
+
+    @classmethod
+    def open_if_exists(cls, index_dir: str = DEFAULT_INDEX_DIR, **kwargs) -> Optional["SchoolNameVectorIndex"]:
+        """索引文件存在时以mmap方式打开，否则返回None"""
+        if not os.path.exists(os.path.join(_current_dir(index_dir), INDEX_FILE)):
+            return None
+        vector_index = cls(index_dir=index_dir, **kwargs)
+        vector_index.load()
+        return vector_index
+
+    def encode(self, names: Sequence[str]) -> np.ndarray:
+        """分批生成归一化后的embedding"""
+        if self._encoder is not None:
+            vectors = np.asarray(self._encoder(list(names)), dtype="float32")
+        else:
+            model = self._get_model()
+            vectors = model.encode(list(names), batch_size=self.batch_size, normalize_embeddings=True,
+                                   convert_to_numpy=True, show_progress_bar=len(names) > 10 * self.batch_size)
+            vectors = np.asarray(vectors, dtype="float32")
+        return np.ascontiguousarray(vectors)
+
+    def warm(self) -> None:
+        """加载sentence-transformer模型并编码一次, 第一次查询不再承担模型加载的开销"""
+        self.encode(["university"])
+
+    def _get_model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    try:
+                        from sentence_transformers import SentenceTransformer
+                    except ImportError as e:
+                        raise ImportError("需要安装sentence-transformers: pip install sentence-transformers") from e
+                    self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    def build(self, names: Sequence[str]) -> None:
+        """为names重新建立索引并保存"""
+        faiss = _import_faiss()
+        names = list(dict.fromkeys(name.strip() for name in names if name.strip()))
+        vectors = self.encode(names)
+        index = faiss.IndexHNSWFlat(vectors.shape[1], self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = self.ef_construction
+        index.add(vectors)
+        self.index = index
+        self.names = names
+        self._name_set = set(names)
+        self.save()
+
+    def save(self) -> None:
+        """写入新的版本目录后切换CURRENT, 正在mmap旧版本的worker不受影响"""
+        faiss = _import_faiss()
+        version = f"{time.time_ns():020d}-{os.getpid()}"
+        version_dir = os.path.join(self.index_dir, VERSIONS_DIR, version)
+        os.makedirs(version_dir)
+        faiss.write_index(self.index, os.path.join(version_dir, INDEX_FILE))
+        _write_json(os.path.join(version_dir, NAMES_FILE), self.names)
+        _write_json(os.path.join(version_dir, META_FILE), {
+            "model_name": self.model_name,
+            "dimension": self.index.d,
+            "count": len(self.names),
+            "hnsw_m": self.hnsw_m,
+        })
+        _write_text(os.path.join(self.index_dir, CURRENT_FILE), version)
+        self._version_dir = version_dir
+        self._prune_versions(version)
+
+    def _prune_versions(self, current: str) -> None:
+        """删除最近KEEP_VERSIONS个以外的旧版本目录"""
+        versions_dir = os.path.join(self.index_dir, VERSIONS_DIR)
+        versions = sorted(os.listdir(versions_dir))
+        for version in versions[:-KEEP_VERSIONS]:
+            if version != current:
+                shutil.rmtree(os.path.join(versions_dir, version), ignore_errors=True)
+
+    def load(self, mmap: bool = True) -> None:
+        """加载CURRENT指向的版本；mmap=True时只读映射索引文件，多个进程共享同一份内存"""
+        faiss = _import_faiss()
+        version_dir = _current_dir(self.index_dir)
+        with open(os.path.join(version_dir, META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        index_path = os.path.join(version_dir, INDEX_FILE)
+        if mmap:
+            flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+            index = faiss.read_index(index_path, flags)
+        else:
+            index = faiss.read_index(index_path)
+        with open(os.path.join(version_dir, NAMES_FILE), "r", encoding="utf-8") as f:
+            names = json.load(f)
+        # 名称列表与索引中的向量一一对应, 不一致时search_batch会取到错误的名称或越界
+        if len(names) != index.ntotal:
+            raise ValueError(f"向量索引 {index_path} 有 {index.ntotal} 个向量, 名称列表有 {len(names)} 个名称")
+        index.hnsw.efSearch = self.ef_search
+        self.model_name = meta.get("model_name", self.model_name)
+        self.index = index
+        self.names = names
+        self._name_set = set(names)
+        self._version_dir = version_dir
+
+    def add_names(self, names: Sequence[str]) -> int:
+        """增量加入新的学校名称，只为新增名称生成embedding，返回新增数量"""
+        new_names = [name for name in dict.fromkeys(n.strip() for n in names) if name and name not in self._name_set]
+        if not new_names:
+            return 0
+        if self.index is None:
+            self.build(new_names)
+            return len(new_names)
+        # mmap打开的索引是只读的，增量写入前重新完整加载
+        self.load(mmap=False)
+        self.index.add(self.encode(new_names))
+        self.names.extend(new_names)
+        self._name_set.update(new_names)
+        self.save()
+        return len(new_names)
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[str, float]]:
+        """返回最相似的k个学校名称及相似度"""
+        return self.search_batch([query], k)[0]
+
+    def search_batch(self, queries: Sequence[str], k: int = 5) -> List[List[Tuple[str, float]]]:
+        scores, ids = self.index.search(self.encode(queries), k)
+        return [
+            [(self.names[i], float(score)) for score, i in zip(row_scores, row_ids) if i >= 0]
+            for row_scores, row_ids in zip(scores, ids)
+        ]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+def _current_dir(index_dir: str) -> str:
+    """CURRENT指向的版本目录; 没有CURRENT时是旧的布局, 文件直接保存在index_dir下"""
+    try:
+        with open(os.path.join(index_dir, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return os.path.join(index_dir, VERSIONS_DIR, f.read().strip())
+    except FileNotFoundError:
+        return index_dir
+
+
+def _write_text(path: str, text: str) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def _write_json(path: str, data) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def main():
+    sys.path.append(os.path.dirname(NORMALIZATION_DIR))
+    from normalization.university_normalization import DEFAULT_KEY_FILES, _load_names
+
+    parser = argparse.ArgumentParser(description="学校名称向量索引")
+    parser.add_argument("command", choices=["build", "add"], help="build: 重建索引; add: 增量加入名称")
+    parser.add_argument("names_file", nargs="?", help="名称列表文件(.txt或.json), build默认使用normalization/下的名称列表")
+    parser.add_argument("--index-dir", default=DEFAULT_INDEX_DIR)
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="sentence-transformers模型名称, 例如bge或qwen embedding模型")
+    parser.add_argument("--batch-size", type=int, default=256)
+    args = parser.parse_args()
+
+    vector_index = SchoolNameVectorIndex(index_dir=args.index_dir, model_name=args.model, batch_size=args.batch_size)
+    if args.command == "build":
+        names = []
+        for path in ([args.names_file] if args.names_file else DEFAULT_KEY_FILES):
+            names.extend(_load_names(path))
+        vector_index.build(names)
+        print(f"索引已建立: {len(vector_index)} 个名称 -> {vector_index.index_path}")
+    else:
+        if not args.names_file:
+            parser.error("add需要指定names_file")
+        if os.path.exists(vector_index.index_path):
+            vector_index.load()
+        added = vector_index.add_names(_load_names(args.names_file))
+        print(f"新增 {added} 个名称, 共 {len(vector_index)} 个")
+
+
+if __name__ == "__main__":
+    main()
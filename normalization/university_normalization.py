@@ -0,0 +1,397 @@
+"""
+学校名称归一化
+
+把LLM输出或用户输入的学校名称映射到 normalization/ 下学校名称列表中的标准名称。
+名称列表只在第一次使用时加载一次，并预先建立索引，查询按代价从低到高依次尝试:
+1. 精确匹配
+2. 归一化匹配（大小写、标点、空白、开头的The、"-Main Campus"后缀）
+3. 字符trigram倒排索引召回候选，再用编辑距离排序
+4. 可选的向量检索（embedding_index），只处理前面都没有匹配上的名称
+
+在长文本中查找学校名称(scan)使用按词构建的Aho-Corasick自动机, 一次扫描找出所有标准名称和别名,
+自动机在第一次scan时才建立。
+
+用法:
+    normalizer = get_default_normalizer()
+    normalizer.normalize("purdue university")  # -> "Purdue University"
+    normalizer.scan("We recommend Purdue University and MIT.")  # -> ["Purdue University", "Massachusetts Institute of Technology (MIT)"]
+"""
+
+import json
+import os
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+NORMALIZATION_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_KEY_FILES = [
+    os.path.join(NORMALIZATION_DIR, "university_primary_keys.txt"),
+    os.path.join(NORMALIZATION_DIR, "primary_keys.extended.11871.json"),
+]
+
+_NON_WORD = re.compile(r"[^\w\s]")
+_SPACES = re.compile(r"\s+")
+_MAIN_CAMPUS = re.compile(r"\s*[-–,]\s*main campus$", re.IGNORECASE)
+_PARENTHESIZED = re.compile(r"\s*\(([^()]*)\)\s*$")
+_WORD = re.compile(r"\w+")
+# memo中表示"没有缓存"(缓存的结果本身可能是None)
+_MISS = object()
+
+
+class NormalizationMatch(NamedTuple):
+    """归一化结果: 标准名称、相似度(0~1)和命中方式(exact/folded/fuzzy/embedding)"""
+    name: str
+    score: float
+    method: str
+
+
+def fold_name(name: str) -> str:
+    """名称折叠: 小写、&替换为and、去掉标点和开头的the、合并空白"""
+    name = name.casefold().replace("&", " and ")
+    name = _SPACES.sub(" ", _NON_WORD.sub(" ", name)).strip()
+    if name.startswith("the "):
+        name = name[4:]
+    return name
+
+
+def _trigrams(folded: str) -> List[str]:
+    padded = f"  {folded} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def levenshtein(a: str, b: str, max_distance: Optional[int] = None) -> int:
+    """编辑距离; 超过max_distance时提前返回max_distance + 1"""
+    if len(a) < len(b):
+        a, b = b, a
+    if max_distance is not None and len(a) - len(b) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        current = [i]
+        for j, cb in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if max_distance is not None and min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+class WordAutomaton:
+    """
+    按词构建的Aho-Corasick自动机: 一次扫描找出文本中出现的所有词序列(key),
+    匹配只发生在完整的词上, 例如 "mit" 不会匹配 "submit"
+    """
+
+    def __init__(self, keys: Dict[str, int]):
+        """keys: 折叠后的key(空格分隔的词) -> 值"""
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # 节点上结束的key: (词数, 值), 以及沿失败链最近的有输出的节点
+        self._output: List[Optional[Tuple[int, int]]] = [None]
+        self._dict_link: List[int] = [-1]
+        for key, value in keys.items():
+            words = key.split()
+            if not words:
+                continue
+            node = 0
+            for word in words:
+                child = self._goto[node].get(word)
+                if child is None:
+                    child = len(self._goto)
+                    self._goto[node][word] = child
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(None)
+                    self._dict_link.append(-1)
+                node = child
+            if self._output[node] is None:
+                self._output[node] = (len(words), value)
+        self._build_links()
+
+    def _build_links(self) -> None:
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for word, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and word not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(word, 0)
+                self._fail[child] = target if target != child else 0
+                self._dict_link[child] = target if self._output[target] is not None else self._dict_link[target]
+
+    def __len__(self) -> int:
+        return len(self._goto)
+
+    def find(self, words: List[str]) -> List[Tuple[int, int, int]]:
+        """返回所有匹配 (起始词下标, 词数, 值), 按结束位置排列"""
+        matches = []
+        node = 0
+        goto, fail, output, dict_link = self._goto, self._fail, self._output, self._dict_link
+        for position, word in enumerate(words):
+            while node and word not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(word, 0)
+            hit = node if output[node] is not None else dict_link[node]
+            while hit > 0:
+                length, value = output[hit]
+                matches.append((position - length + 1, length, value))
+                hit = dict_link[hit]
+        return matches
+
+
+class UniversityNormalization:
+    """学校名称归一化引擎，名称列表在构造时一次性建立索引"""
+
+    def __init__(self, key_files: Optional[Iterable[str]] = None, names: Optional[Iterable[str]] = None,
+                 embedding_index: Any = None, min_similarity: float = 0.88,
+                 min_embedding_score: float = 0.85, max_candidates: int = 30, memo_size: int = 4096):
+        """
+        key_files: 学校名称列表文件(.txt每行一个, .json为字符串数组), 默认使用normalization/下的两个列表
+        names: 直接传入的名称列表, 与key_files合并
+        embedding_index: 可选的向量索引, 需提供 search(query, k) -> [(name, score), ...], 例如SchoolNameVectorIndex
+        min_similarity: 编辑距离相似度的最低阈值
+        min_embedding_score: 向量检索余弦相似度的最低阈值
+        """
+        self.min_similarity = min_similarity
+        self.min_embedding_score = min_embedding_score
+        self.max_candidates = max_candidates
+        self.embedding_index = embedding_index
+        self.names: List[str] = []
+        self._exact: Dict[str, int] = {}
+        self._folded: Dict[str, int] = {}
+        # 只由别名占用的折叠key -> 条目下标; 之后出现折叠后相同的标准名称时由标准名称接管
+        self._alias_entries: Dict[str, int] = {}
+        # 模糊匹配的条目: (折叠后的名称或别名, 标准名称下标)
+        self._entries: List[Tuple[str, int]] = []
+        self._trigram_index: Dict[str, List[int]] = {}
+        self._memo: Dict[str, Optional[NormalizationMatch]] = {}
+        self._memo_size = memo_size
+        self._automaton: Optional[WordAutomaton] = None
+        self._lock = threading.Lock()
+
+        all_names: List[str] = []
+        for path in (DEFAULT_KEY_FILES if key_files is None else key_files):
+            all_names.extend(_load_names(path))
+        if names is not None:
+            all_names.extend(names)
+        self.add_names(all_names)
+
+    def add_names(self, names: Iterable[str]) -> int:
+        """增量加入新的标准名称，返回实际新增的数量"""
+        added = 0
+        with self._lock:
+            for name in names:
+                name = name.strip()
+                if not name or name in self._exact:
+                    continue
+                index = len(self.names)
+                self.names.append(name)
+                self._exact[name] = index
+                folded = fold_name(name)
+                entry = self._alias_entries.pop(folded, None)
+                if entry is not None:
+                    # 别名不能遮住折叠后相同的标准名称, 例如 "Northeastern University (China)" 的别名
+                    # "Northeastern University" 让位给标准名称 "Northeastern University"
+                    self._folded[folded] = index
+                    self._entries[entry] = (folded, index)
+                else:
+                    self._add_key(folded, index)
+                for alias in _aliases(name):
+                    folded = fold_name(alias)
+                    if self._add_key(folded, index):
+                        self._alias_entries[folded] = len(self._entries) - 1
+                added += 1
+            if added:
+                self._memo.clear()
+                self._automaton = None
+        return added
+
+    def _add_key(self, folded: str, index: int) -> bool:
+        """登记折叠后的key, 已被占用时不覆盖, 返回是否新增"""
+        if folded in self._folded:
+            return False
+        self._folded[folded] = index
+        entry = len(self._entries)
+        self._entries.append((folded, index))
+        for gram in set(_trigrams(folded)):
+            self._trigram_index.setdefault(gram, []).append(entry)
+        return True
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def is_canonical(self, name: str) -> bool:
+        """名称是否恰好是名单中的标准名称(不做折叠)"""
+        return name.strip() in self._exact
+
+    def normalize(self, name: str) -> Optional[str]:
+        """返回标准名称，找不到时返回None"""
+        match = self.lookup(name)
+        return match.name if match is not None else None
+
+    def normalize_many(self, names: Iterable[str]) -> List[Optional[str]]:
+        return [self.normalize(name) for name in names]
+
+    def lookup(self, name: str) -> Optional[NormalizationMatch]:
+        """按 精确 -> 归一化 -> trigram+编辑距离 -> 向量 的顺序查找标准名称"""
+        name = name.strip()
+        if not name:
+            return None
+        index = self._exact.get(name)
+        if index is not None:
+            return NormalizationMatch(self.names[index], 1.0, "exact")
+        folded = fold_name(name)
+        index = self._folded.get(folded)
+        if index is not None:
+            return NormalizationMatch(self.names[index], 1.0, "folded")
+
+        # 其他线程可能同时清空memo, 只读取一次, 不能先判断再取值
+        memoized = self._memo.get(folded, _MISS)
+        if memoized is not _MISS:
+            return memoized
+        match = self._fuzzy_lookup(folded)
+        if match is None and self.embedding_index is not None:
+            match = self._embedding_lookup(name)
+        if len(self._memo) >= self._memo_size:
+            self._memo.clear()
+        self._memo[folded] = match
+        return match
+
+    def lookup_span(self, text: str) -> Optional[NormalizationMatch]:
+        """
+        对正则抓取的文本片段查找学校名称，片段开头可能带有多余的词
+        （例如 "recommend Purdue University"）: 整段查不到时依次去掉开头的词再做精确/归一化匹配
+        """
+        match = self.lookup(text)
+        if match is not None:
+            return match
+        words = text.split()
+        for start in range(1, len(words) - 1):
+            candidate = " ".join(words[start:])
+            index = self._exact.get(candidate)
+            if index is None:
+                index = self._folded.get(fold_name(candidate))
+            if index is not None:
+                return NormalizationMatch(self.names[index], 1.0, "span")
+        return None
+
+    def warm(self) -> None:
+        """提前建立scan用的自动机, 并加载向量检索的索引和模型, 避免第一个请求承担这些开销"""
+        self._get_automaton()
+        if self.embedding_index is not None and hasattr(self.embedding_index, "warm"):
+            self.embedding_index.warm()
+
+    def _get_automaton(self) -> WordAutomaton:
+        automaton = self._automaton
+        if automaton is None:
+            with self._lock:
+                if self._automaton is None:
+                    self._automaton = WordAutomaton(self._folded)
+                automaton = self._automaton
+        return automaton
+
+    def scan(self, text: str, exclude: Iterable[str] = ()) -> List[str]:
+        """
+        在文本中查找所有学校名称或别名, 返回按出现顺序去重的标准名称;
+        重叠的匹配取最靠前、最长的一个。只有一个词的别名(缩写, 如MIT)要求原文全部大写, 避免匹配普通单词。
+        exclude: 不作为学校名称的折叠后key(例如示例中的占位名称)
+        """
+        exclude = set(exclude)
+        tokens = list(_WORD.finditer(text.replace("&", " and ")))
+        words = [token.group().casefold() for token in tokens]
+        matches = sorted(self._get_automaton().find(words), key=lambda m: (m[0], -m[1]))
+        names: List[str] = []
+        covered = 0
+        for start, length, index in matches:
+            if start < covered:
+                continue
+            if length == 1 and not (tokens[start].group().isupper() and len(words[start]) >= 2):
+                continue
+            if " ".join(words[start:start + length]) in exclude:
+                continue
+            covered = start + length
+            if self.names[index] not in names:
+                names.append(self.names[index])
+        return names
+
+    def _fuzzy_lookup(self, folded: str) -> Optional[NormalizationMatch]:
+        # 召回: 统计与查询共享trigram的名称, 过于常见的trigram(如"uni")不参与计数
+        grams = set(_trigrams(folded))
+        common_limit = max(50, len(self._entries) // 20)
+        postings = [self._trigram_index[g] for g in grams if g in self._trigram_index]
+        rare = [p for p in postings if len(p) <= common_limit] or postings
+        counts: Counter = Counter()
+        for posting in rare:
+            counts.update(posting)
+        if not counts:
+            return None
+
+        # 排序: 按编辑距离相似度选出最佳候选
+        best: Optional[NormalizationMatch] = None
+        for entry, _ in counts.most_common(self.max_candidates):
+            candidate, index = self._entries[entry]
+            longest = max(len(candidate), len(folded))
+            max_distance = int(longest * (1 - self.min_similarity))
+            distance = levenshtein(folded, candidate, max_distance)
+            if distance > max_distance:
+                continue
+            score = 1 - distance / longest
+            if best is None or score > best.score:
+                best = NormalizationMatch(self.names[index], score, "fuzzy")
+        return best
+
+    def _embedding_lookup(self, name: str) -> Optional[NormalizationMatch]:
+        results = self.embedding_index.search(name, 1)
+        if not results:
+            return None
+        candidate, score = results[0]
+        if score < self.min_embedding_score:
+            return None
+        return NormalizationMatch(candidate, float(score), "embedding")
+
+
+def _aliases(name: str) -> List[str]:
+    """
+    标准名称的别名:
+    "Ohio State University-Main Campus" -> "Ohio State University"
+    "Massachusetts Institute of Technology (MIT)" -> "Massachusetts Institute of Technology", "MIT"
+    """
+    aliases = []
+    stripped = _MAIN_CAMPUS.sub("", name)
+    if stripped != name:
+        aliases.append(stripped)
+    parenthesized = _PARENTHESIZED.search(name)
+    if parenthesized:
+        aliases.append(name[:parenthesized.start()])
+        abbreviation = parenthesized.group(1).strip()
+        if abbreviation.isupper() and len(abbreviation) >= 2:
+            aliases.append(abbreviation)
+    return aliases
+
+
+def _load_names(path: str) -> List[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".json"):
+            return [str(name) for name in json.load(f)]
+        return [line.strip() for line in f if line.strip()]
+
+
+_default_normalizer: Optional[UniversityNormalization] = None
+_default_lock = threading.Lock()
+
+
+def get_default_normalizer() -> UniversityNormalization:
+    """
+    进程内共享的归一化实例，第一次调用时加载默认名称列表；
+    如果已经用 school_vector_index.py build 建立过向量索引，则以mmap方式打开作为最后一级检索。
+    服务启动时调用 get_default_normalizer().warm() 预先加载, 向量模型不在请求中加载
+    """
+    global _default_normalizer
+    if _default_normalizer is None:
+        with _default_lock:
+            if _default_normalizer is None:
+                from normalization.school_vector_index import SchoolNameVectorIndex
+                _default_normalizer = UniversityNormalization(embedding_index=SchoolNameVectorIndex.open_if_exists())
+    return _default_normalizer
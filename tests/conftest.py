@@ -0,0 +1,66 @@
+"""
+测试共用的配置
+与benchmarks相同, 把项目根目录、university_selection_report和benchmarks加入sys.path;
+LLM使用benchmarks/fake_llm中的确定性假LLM, 不需要网络和API key。
+
+运行:
+    python -m pytest tests
+"""
+
+import os
+import sys
+import tempfile
+import uuid
+from typing import Any, Callable
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(ROOT_DIR, "university_selection_report")
+for path in (ROOT_DIR, APP_DIR, os.path.join(ROOT_DIR, "benchmarks")):
+    if path not in sys.path:
+        sys.path.append(path)
+
+# 报告文件写到临时目录, 不调用LangSmith
+os.environ.setdefault("REPORT_ARTIFACT_DIR", tempfile.mkdtemp(prefix="report-artifacts-"))
+os.environ.pop("LANGSMITH_API_KEY", None)
+os.environ["LANGCHAIN_TRACING_V2"] = "false"
+
+SAMPLE_PROFILE = os.path.join(APP_DIR, "StudentProfile.txt")
+
+
+@pytest.fixture
+def profile() -> str:
+    with open(SAMPLE_PROFILE, encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.fixture
+def fake_llm_name() -> str:
+    """每个测试注册一个新的假LLM provider, 调用次数和调度状态不受其他测试影响"""
+    from fake_llm import register_fake_provider
+
+    name = f"fake-{uuid.uuid4().hex[:8]}"
+    register_fake_provider(name, latency=0)
+    return name
+
+
+@pytest.fixture
+def make_workflow(fake_llm_name: str) -> Callable[..., Any]:
+    """创建使用假LLM的workflow, 学校通用章节和调度器每个测试单独一份"""
+    from llm_scheduler import LLMScheduler
+    from school_section_store import SchoolSectionStore
+    from university_selection_workflow import UniversitySelectionWorkflow
+
+    def make(**kwargs: Any) -> UniversitySelectionWorkflow:
+        kwargs.setdefault("school_store", SchoolSectionStore())
+        kwargs.setdefault("scheduler", LLMScheduler(base_backoff=0.001))
+        return UniversitySelectionWorkflow(fake_llm_name, debug=False, **kwargs)
+
+    return make
+
+
+@pytest.fixture
+def llm_calls() -> Callable[[Any], int]:
+    """假LLM收到的调用次数"""
+    return lambda workflow: sum(workflow.llm._calls.values())
@@ -0,0 +1,39 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import APP_DIR, ROOT_DIR
+from import_budget import FORBIDDEN_MODULES, forbidden_imports, measure_import
+
+# 与benchmarks/import_budget.py相同的预算, 取3次中的最小值排除磁盘缓存等噪声
+BUDGETS_MS = {
+    "university_selection_workflow": float(os.getenv("IMPORT_BUDGET_WORKFLOW_MS", "1000")),
+    "langserve_app": float(os.getenv("IMPORT_BUDGET_APP_MS", "2000")),
+}
+
+
+@pytest.mark.parametrize("module", sorted(BUDGETS_MS))
+def test_import_within_budget_without_heavy_dependencies(module):
+    runs = [measure_import(module) for _ in range(3)]
+    total, modules = min(runs, key=lambda run: run[0])
+    assert forbidden_imports(modules) == []
+    assert total <= BUDGETS_MS[module], f"import {module} took {total:.0f} ms"
+
+
+def test_constructing_workflow_does_not_load_provider_sdks():
+    code = (
+        "import sys\n"
+        "from fake_llm import register_fake_provider\n"
+        "register_fake_provider('fake', latency=0)\n"
+        "from university_selection_workflow import UniversitySelectionWorkflow\n"
+        "UniversitySelectionWorkflow('fake', debug=False)\n"
+        f"print('loaded:' + ','.join(m for m in {FORBIDDEN_MODULES!r} if m in sys.modules))\n"
+    )
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([APP_DIR, ROOT_DIR, os.path.join(ROOT_DIR, "benchmarks")])
+    completed = subprocess.run([sys.executable, "-c", code], cwd=APP_DIR, env=env, capture_output=True, text=True)
+    assert completed.returncode == 0, completed.stderr[-2000:]
+    # 假LLM工作流的构造不应加载供应商SDK, 它们只在首次使用对应供应商时导入
+    assert "loaded:" in completed.stdout.splitlines()
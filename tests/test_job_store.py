@@ -0,0 +1,108 @@
+import threading
+
+import pytest
+
+from job_store import STATUS_FAILED, STATUS_QUEUED, STATUS_RUNNING, STATUS_SUCCEEDED, JobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"), max_attempts=2)
+    yield store
+    store.close()
+
+
+def test_claim_orders_by_priority_then_submission(store):
+    batch = store.submit("batch profile", "fake", priority=10)
+    first = store.submit("first profile", "fake")
+    second = store.submit("second profile", "fake")
+    assert [store.claim("w")["id"] for _ in range(3)] == [first, second, batch]
+    assert store.claim("w") is None
+
+
+def test_submit_keeps_options(store):
+    job_id = store.submit("profile", "fake", regenerate=["reach"],
+                          overrides={"extract_school_names": ["Purdue University"]})
+    job = store.claim("w")
+    assert job["id"] == job_id and job["status"] == STATUS_RUNNING and job["attempts"] == 1
+    assert job["options"] == {"regenerate": ["reach"], "overrides": {"extract_school_names": ["Purdue University"]}}
+
+
+def test_concurrent_claims_do_not_share_jobs(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    stores = [JobStore(path) for _ in range(4)]
+    submitted = {stores[0].submit(f"profile {i}", "fake") for i in range(20)}
+    claimed = []
+
+    def work(store, worker):
+        while True:
+            job = store.claim(worker)
+            if job is None:
+                return
+            claimed.append(job["id"])
+
+    threads = [threading.Thread(target=work, args=(store, f"w{i}")) for i, store in enumerate(stores)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for store in stores:
+        store.close()
+    assert sorted(claimed) == sorted(submitted)
+
+
+def test_expired_lease_is_reclaimed_and_stale_worker_cannot_complete(store):
+    job_id = store.submit("profile", "fake")
+    store.claim("a", lease=-1)
+    job = store.claim("b")
+    assert job["id"] == job_id and job["worker"] == "b" and job["attempts"] == 2
+    # 租约过期的worker不能覆盖新worker的结果
+    store.complete(job_id, "a", "stale report", {})
+    assert store.get(job_id)["status"] == STATUS_RUNNING
+    store.complete(job_id, "b", "report", {"percent": 100})
+    job = store.get(job_id)
+    assert job["status"] == STATUS_SUCCEEDED and job["report"] == "report"
+
+
+def test_heartbeat_extends_lease(store):
+    job_id = store.submit("profile", "fake")
+    store.claim("a", lease=-1)
+    store.heartbeat([job_id], "a", lease=60)
+    assert store.claim("b") is None
+
+
+def test_expired_lease_fails_after_max_attempts(store):
+    job_id = store.submit("profile", "fake")
+    store.claim("a", lease=-1)
+    store.claim("b", lease=-1)
+    assert store.claim("c") is None
+    job = store.get(job_id)
+    assert job["status"] == STATUS_FAILED and job["finished_at"] is not None
+
+
+def test_fail_with_retry_requeues_until_max_attempts(store):
+    job_id = store.submit("profile", "fake")
+    store.claim("a")
+    store.fail(job_id, "a", "rate limited", retry=True)
+    job = store.get(job_id)
+    assert job["status"] == STATUS_QUEUED and job["worker"] is None and job["finished_at"] is None
+    store.claim("b")
+    store.fail(job_id, "b", "rate limited", retry=True)
+    job = store.get(job_id)
+    assert job["status"] == STATUS_FAILED and job["error"] == "rate limited"
+
+
+def test_submit_batch_reuses_jobs_and_resubmits_failed_items(store):
+    items = [{"id": "alice", "profile": "a"}, {"id": "bob", "profile": "b"}]
+    first = store.submit_batch("cohort", items, "fake")
+    assert store.submit_batch("cohort", items, "fake") == first
+
+    job = store.claim("w")
+    store.fail(job["id"], "w", "boom")
+    failed_item = next(item for item in first if item["job_id"] == job["id"])["id"]
+    second = {item["id"]: item for item in store.submit_batch("cohort", items, "fake")}
+    assert second[failed_item]["job_id"] != job["id"] and second[failed_item]["status"] == STATUS_QUEUED
+
+    latest = {job["item_id"]: job for job in store.batch("cohort")}
+    assert set(latest) == {"alice", "bob"}
+    assert latest[failed_item]["id"] == second[failed_item]["job_id"]
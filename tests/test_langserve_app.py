@@ -0,0 +1,42 @@
+import asyncio
+from functools import reduce
+from operator import add
+
+import pytest
+
+SCHOOL_TABLE = (
+    "| School Name | Reason |\n| ------------- | ------------- |\n"
+    "| Purdue University | Safety choice |\n"
+    "| Boston University | Target choice |\n"
+    "| Carnegie Mellon University | Reach choice |"
+)
+
+
+@pytest.fixture
+def runnable():
+    from langserve_app import UniversitySelectionReportRunnable
+
+    return UniversitySelectionReportRunnable()
+
+
+def test_stream_chunks_add_up_to_invoke_result(runnable, fake_llm_name, profile):
+    request = {"profile": profile, "llm_name": fake_llm_name, "debug": False,
+               "regenerate": ["reach"], "overrides": {"recommend_schools": SCHOOL_TABLE}}
+
+    async def collect():
+        return [chunk async for chunk in runnable.astream(request)]
+
+    streamed = reduce(add, asyncio.run(collect()))
+    invoked = asyncio.run(runnable.ainvoke(request))
+    assert streamed == invoked
+    assert invoked["status"] == "success" and "## Boston University" in invoked["report"]
+
+
+def test_stream_reports_invalid_overrides_as_error(runnable, fake_llm_name, profile):
+    request = {"profile": profile, "llm_name": fake_llm_name, "overrides": {"unknown_stage": "x"}}
+
+    async def collect():
+        return [chunk async for chunk in runnable.astream(request)]
+
+    streamed = reduce(add, asyncio.run(collect()))
+    assert streamed["status"] == "error" and streamed["report"] == ""
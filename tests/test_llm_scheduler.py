@@ -0,0 +1,131 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from llm_scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, LLMScheduler, llm_priority
+
+
+class RateLimitError(Exception):
+    """与openai SDK同名的429异常, 带Retry-After响应头"""
+
+    def __init__(self, retry_after: str = "0.05"):
+        super().__init__("rate limited")
+        self.status_code = 429
+        self.response = SimpleNamespace(headers={"retry-after": retry_after})
+
+
+def flaky(failures, result="ok"):
+    """前len(failures)次调用依次抛出failures中的异常, 之后返回result"""
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) <= len(failures):
+            raise failures[len(calls) - 1]
+        return result
+
+    return fn, calls
+
+
+def test_retries_transient_errors():
+    scheduler = LLMScheduler(max_retries=3, base_backoff=0.001)
+    fn, calls = flaky([TimeoutError(), ConnectionError()])
+    assert scheduler.call("p", fn, "prompt") == "ok"
+    assert len(calls) == 3
+
+
+def test_does_not_retry_permanent_errors():
+    scheduler = LLMScheduler(max_retries=3, base_backoff=0.001)
+    fn, calls = flaky([ValueError("bad request")])
+    with pytest.raises(ValueError):
+        scheduler.call("p", fn, "prompt")
+    assert len(calls) == 1
+
+
+def test_gives_up_after_max_retries():
+    scheduler = LLMScheduler(max_retries=2, base_backoff=0.001)
+    fn, calls = flaky([TimeoutError()] * 5)
+    with pytest.raises(TimeoutError):
+        scheduler.call("p", fn, "prompt")
+    assert len(calls) == 3
+    # 失败后释放并发槽位
+    assert scheduler.provider("p").in_flight == 0
+
+
+def test_can_retry_false_stops_retries():
+    scheduler = LLMScheduler(max_retries=3, base_backoff=0.001)
+    fn, calls = flaky([TimeoutError()])
+    with pytest.raises(TimeoutError):
+        scheduler.call("p", fn, "prompt", can_retry=lambda: False)
+    assert len(calls) == 1
+
+
+def test_rate_limit_halves_limit_and_honours_retry_after():
+    scheduler = LLMScheduler(max_retries=1, base_backoff=0.001)
+    state = scheduler.provider("p")
+    limit = state.limit
+    fn, calls = flaky([RateLimitError("0.05")])
+    assert scheduler.call("p", fn, "prompt") == "ok"
+    assert len(calls) == 2
+    assert state.limit < limit
+    assert state.cooldown_until > 0
+
+
+def test_acall_retries_transient_errors():
+    scheduler = LLMScheduler(max_retries=2, base_backoff=0.001)
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        if len(calls) == 1:
+            raise TimeoutError()
+        return "ok"
+
+    assert asyncio.run(scheduler.acall("p", fn, "prompt")) == "ok"
+    assert len(calls) == 2
+
+
+def test_interactive_calls_are_served_before_queued_batch_calls():
+    scheduler = LLMScheduler(max_concurrency={"p": 1})
+    state = scheduler.provider("p")
+    order = []
+
+    async def main():
+        # 占用唯一的槽位, 之后的调用排队
+        await state.aacquire(PRIORITY_INTERACTIVE)
+
+        def call(name, priority):
+            async def fn():
+                order.append(name)
+                return name
+            with llm_priority(priority):
+                return asyncio.ensure_future(scheduler.acall("p", fn, "prompt"))
+
+        batch = [call(f"batch-{i}", PRIORITY_BATCH) for i in range(2)]
+        interactive = call("interactive", PRIORITY_INTERACTIVE)
+        while state.queued() < 3:
+            await asyncio.sleep(0.001)
+        state.release()
+        await asyncio.gather(*batch, interactive)
+
+    asyncio.run(main())
+    assert order == ["interactive", "batch-0", "batch-1"]
+    assert state.in_flight == 0
+
+
+def test_cancelled_waiter_does_not_leak_slot():
+    scheduler = LLMScheduler(max_concurrency={"p": 1})
+    state = scheduler.provider("p")
+
+    async def main():
+        await state.aacquire(PRIORITY_INTERACTIVE)
+        waiter = asyncio.ensure_future(state.aacquire(PRIORITY_INTERACTIVE))
+        await asyncio.sleep(0.001)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        state.release()
+
+    asyncio.run(main())
+    assert state.in_flight == 0 and state.queued() == 0
@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+from pydantic import ValidationError
+
+from report_checkpoints import RegenerationPlan, ReportCheckpointStore, make_checkpoint_key, validate_overrides
+
+SCHOOL_TABLE = (
+    "| School Name | Reason |\n| ------------- | ------------- |\n"
+    "| Purdue University | Safety choice |\n"
+    "| Ohio State University | Target choice |\n"
+    "| Carnegie Mellon University | Reach choice |"
+)
+
+
+def test_checkpoint_key_depends_on_stage_inputs():
+    key = make_checkpoint_key("recommend_schools", {"profile": "a"}, "fake", {}, "English", ["t"])
+    assert key == make_checkpoint_key("recommend_schools", {"profile": "a"}, "fake", {}, "English", ["t"])
+    assert key != make_checkpoint_key("recommend_schools", {"profile": "b"}, "fake", {}, "English", ["t"])
+    assert key != make_checkpoint_key("recommend_majors", {"profile": "a"}, "fake", {}, "English", ["t"])
+
+
+def test_plan_matches_stage_school_and_tier_targets():
+    plan = RegenerationPlan(["Reach", "fill_school_info:Purdue University"])
+    assert plan.forces("fill_school_info", "Carnegie Mellon University", "reach")
+    assert plan.forces("fill_school_info", "Purdue University", "safety")
+    assert not plan.forces("fill_school_info", "Ohio State University", "target")
+    assert not plan.forces("recommend_schools")
+
+
+@pytest.mark.parametrize("overrides", [
+    {"unknown_stage": "x"},
+    {"recommend_schools": ""},
+    {"extract_school_names": []},
+    {"extract_school_names": ["Purdue University", " "]},
+])
+def test_invalid_overrides_are_rejected(overrides):
+    with pytest.raises(ValidationError):
+        validate_overrides(overrides)
+
+
+def test_unchanged_report_reuses_every_checkpoint(make_workflow, llm_calls, profile):
+    workflow = make_workflow(checkpoints=ReportCheckpointStore())
+    report = workflow.run(profile, save=False)
+    calls = llm_calls(workflow)
+    assert workflow.run(profile, save=False) == report
+    assert llm_calls(workflow) == calls
+
+
+def test_regenerate_tier_only_calls_llm_for_that_school(make_workflow, llm_calls, profile):
+    workflow = make_workflow(checkpoints=ReportCheckpointStore())
+    overrides = {"recommend_schools": SCHOOL_TABLE}
+    workflow.run(profile, save=False, overrides=overrides)
+    prompts = set(workflow.llm._calls)
+
+    workflow.run(profile, save=False, regenerate=["reach"], overrides=overrides)
+    regenerated = [prompt for prompt, count in workflow.llm._calls.items() if count > 1 or prompt not in prompts]
+    # 冲刺校的通用章节和推荐理由都跳过检查点和共享的学校章节重新生成
+    assert len(regenerated) == 2
+    assert all("Carnegie Mellon University" in prompt for prompt in regenerated)
+
+
+def test_overridden_school_table_only_generates_new_schools(make_workflow, llm_calls, profile):
+    workflow = make_workflow(checkpoints=ReportCheckpointStore())
+    workflow.run(profile, save=False, overrides={"recommend_schools": SCHOOL_TABLE})
+    calls = llm_calls(workflow)
+
+    edited = SCHOOL_TABLE.replace("Ohio State University", "Boston University")
+    report = asyncio.run(workflow.arun(profile, save=False, overrides={"recommend_schools": edited}))
+    assert "Boston University" in report and "Ohio State University" not in report
+    # 只有新学校的通用章节和推荐理由调用LLM
+    assert llm_calls(workflow) - calls == 2
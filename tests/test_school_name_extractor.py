@@ -0,0 +1,103 @@
+import re
+
+import pytest
+
+from normalization.university_normalization import UniversityNormalization, fold_name
+from school_name_extractor import _PLACEHOLDER_KEYS, SchoolNameExtractor, clean_cell, parse_school_table
+
+SCHOOLS = [
+    "Purdue University", "Ohio State University-Main Campus", "Carnegie Mellon University",
+    "Massachusetts Institute of Technology (MIT)", "Boston University",
+]
+
+
+@pytest.fixture(scope="module")
+def extractor():
+    return SchoolNameExtractor(UniversityNormalization(key_files=[], names=SCHOOLS))
+
+
+def test_table_is_sorted_by_tier_column(extractor):
+    report = (
+        "## Recommended schools\n\n"
+        "| Tier | School Name | Reason |\n|:---|:---|:---|\n"
+        "| Reach | **Carnegie Mellon University** | Top CS program |\n"
+        "| Safety | [Purdue University](https://purdue.edu) | Strong engineering |\n"
+        "| Target | Ohio State University | Good fit |\n"
+    )
+    assert extractor.extract(report) == [
+        "Purdue University", "Ohio State University-Main Campus", "Carnegie Mellon University",
+    ]
+
+
+def test_table_order_kept_without_tiers(extractor):
+    report = (
+        "| School Name | Reason |\n| --- | --- |\n"
+        "| Boston University (Boston, MA) | Urban campus |\n"
+        "| MIT | Research |\n"
+        "| Purdue University - great value | Engineering |\n"
+    )
+    assert extractor.extract(report) == [
+        "Boston University", "Massachusetts Institute of Technology (MIT)", "Purdue University",
+    ]
+
+
+def test_placeholders_are_ignored(extractor):
+    report = (
+        "| School Name | Reason |\n| --- | --- |\n"
+        "| Safety University | example |\n| Target University | example |\n| Purdue University | fit |\n"
+    )
+    assert extractor.from_table(report) == ["Purdue University"]
+
+
+def test_unknown_school_with_keyword_is_kept(extractor):
+    assert extractor.school_from_cell("Example State University (in-state tuition)") == "Example State University"
+    assert extractor.school_from_cell("No preference") is None
+
+
+def test_short_table_is_completed_from_report_body(extractor):
+    report = (
+        "| School Name | Reason |\n| --- | --- |\n| Purdue University | fit |\n\n"
+        "We also considered Boston University and MIT, but did not submit applications to others."
+    )
+    assert extractor.extract(report) == [
+        "Purdue University", "Boston University", "Massachusetts Institute of Technology (MIT)",
+    ]
+
+
+def test_scan_requires_uppercase_abbreviations(extractor):
+    assert extractor.scan("mit and submit are not schools") == []
+    assert extractor.scan("The Ohio State University and MIT") == [
+        "Ohio State University-Main Campus", "Massachusetts Institute of Technology (MIT)",
+    ]
+
+
+def test_parse_school_table_uses_header_column():
+    rows = parse_school_table("| Reason | University |\n|---|---|\n| fit | Purdue University |\n")
+    assert [cell for cell, _ in rows] == ["Purdue University"]
+
+
+@pytest.fixture(scope="module")
+def bundled():
+    return SchoolNameExtractor(UniversityNormalization())
+
+
+def test_aliases_do_not_shadow_bundled_names(bundled):
+    assert bundled.school_from_cell("Northeastern University") == "Northeastern University"
+    assert bundled.school_from_cell("Saint Louis University") == "Saint Louis University"
+    assert bundled.scan("We recommend Soochow University.") == ["Soochow University"]
+    assert bundled.normalizer.normalize("northeastern university") == "Northeastern University"
+
+
+def test_every_bundled_name_maps_to_itself(bundled):
+    names = [name for name in bundled.normalizer.names
+             if clean_cell(name) == name and fold_name(name) not in _PLACEHOLDER_KEYS]
+    assert [name for name in names if bundled.school_from_cell(name) != name] == []
+    # 名单中折叠后相同的不同写法(例如开头带The)在scan中取第一种写法, 但不能被其他学校的别名接管;
+    # 单个词的名称在scan中要求全部大写, 折叠后产生组合字符的名称(如İ)分词不同, 不在这里检查
+    def tokenized(name):
+        words = [word.casefold() for word in re.findall(r"\w+", name.replace("&", " and "))]
+        return " ".join(words[1:] if words[:1] == ["the"] else words)
+
+    scanned = [name for name in names if len(fold_name(name).split()) > 1 and fold_name(name) == tokenized(name)]
+    assert len(scanned) > len(names) * 0.9
+    assert [name for name in scanned if [fold_name(found) for found in bundled.scan(name)[:1]] != [fold_name(name)]] == []
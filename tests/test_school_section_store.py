@@ -0,0 +1,51 @@
+import sqlite3
+
+from school_section_store import SchoolSectionStore
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = SchoolSectionStore(max_entries=2)
+    store.put("Purdue University", "English", "purdue")
+    store.put("Boston University", "English", "boston")
+    assert store.get("purdue university", "English") == "purdue"
+    store.put("Carnegie Mellon University", "English", "cmu")
+    assert len(store) == 2
+    assert store.get("Boston University", "English") is None
+    assert store.get("Purdue University", "English") == "purdue"
+
+
+def test_sections_are_not_shared_across_models(tmp_path):
+    store = SchoolSectionStore(str(tmp_path / "sections.sqlite3"))
+    calls = []
+
+    def create(content):
+        def factory():
+            calls.append(content)
+            return content
+        return factory
+
+    assert store.get_or_create("Purdue University", "English", create("gemini"), model="gemini") == "gemini"
+    assert store.get_or_create("Purdue University", "English", create("openai"),
+                               model="openai:gpt-4o-mini") == "openai"
+    assert store.get_or_create("The Purdue University", "English", create("again"), model="gemini") == "gemini"
+    assert calls == ["gemini", "openai"]
+
+    reopened = SchoolSectionStore(str(tmp_path / "sections.sqlite3"))
+    assert reopened.get("Purdue University", "English", model="openai:gpt-4o-mini") == "openai"
+
+
+def test_legacy_table_without_model_is_rebuilt(tmp_path):
+    path = str(tmp_path / "sections.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE school_sections (school_key TEXT NOT NULL, locale TEXT NOT NULL, "
+                 "version INTEGER NOT NULL, school_name TEXT NOT NULL, content TEXT NOT NULL, "
+                 "created_at REAL NOT NULL, PRIMARY KEY (school_key, locale, version))")
+    conn.execute("INSERT INTO school_sections VALUES ('purdue university', 'English', 1, 'Purdue University', "
+                 "'old', 0)")
+    conn.commit()
+    conn.close()
+
+    store = SchoolSectionStore(path)
+    assert len(store) == 0
+    store.put("Purdue University", "English", "new", model="gemini")
+    assert store.get("Purdue University", "English", model="gemini") == "new"
@@ -0,0 +1,58 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+
+from normalization.school_vector_index import (CURRENT_FILE, KEEP_VERSIONS, NAMES_FILE, VERSIONS_DIR,
+                                               SchoolNameVectorIndex)
+
+
+def encode(names):
+    """按名称哈希生成的确定性单位向量"""
+    vectors = np.stack([np.random.default_rng(int(hashlib.md5(name.encode()).hexdigest()[:8], 16)).normal(size=16)
+                        for name in names])
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype("float32")
+
+
+def make_index(index_dir):
+    return SchoolNameVectorIndex(index_dir=str(index_dir), encoder=encode)
+
+
+def test_add_names_publishes_new_version_without_touching_loaded_one(tmp_path):
+    make_index(tmp_path).build(["Purdue University", "Boston University"])
+    reader = SchoolNameVectorIndex.open_if_exists(str(tmp_path), encoder=encode)
+    loaded_dir = os.path.dirname(reader.index_path)
+
+    writer = make_index(tmp_path)
+    writer.load()
+    assert writer.add_names(["Carnegie Mellon University"]) == 1
+    # 已加载的worker仍然使用旧版本的索引和名称列表, 重新加载后得到新版本
+    assert os.path.isdir(loaded_dir) and os.path.dirname(writer.index_path) != loaded_dir
+    assert reader.search("Boston University", 3)[0][0] == "Boston University"
+    reader.load()
+    assert len(reader) == reader.index.ntotal == 3
+    assert reader.search("Carnegie Mellon University", 1)[0][0] == "Carnegie Mellon University"
+
+
+def test_old_versions_are_pruned(tmp_path):
+    index = make_index(tmp_path)
+    index.build(["Purdue University"])
+    for i in range(KEEP_VERSIONS + 2):
+        index.add_names([f"Example University {i}"])
+    versions = os.listdir(tmp_path / VERSIONS_DIR)
+    assert len(versions) == KEEP_VERSIONS
+    assert (tmp_path / CURRENT_FILE).read_text() in versions
+
+
+def test_load_rejects_names_that_do_not_match_index(tmp_path):
+    index = make_index(tmp_path)
+    index.build(["Purdue University", "Boston University"])
+    names_path = os.path.join(os.path.dirname(index.index_path), NAMES_FILE)
+    with open(names_path, "w", encoding="utf-8") as f:
+        json.dump(["Purdue University"], f)
+    with pytest.raises(ValueError):
+        make_index(tmp_path).load()
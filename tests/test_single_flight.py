@@ -0,0 +1,167 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def _wait_until(predicate, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.001)
+
+
+def test_do_coalesces_concurrent_threads():
+    flight = SingleFlight("test")
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return "report"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("key", compute))) for _ in range(5)]
+    threads[0].start()
+    _wait_until(lambda: calls)
+    for thread in threads[1:]:
+        thread.start()
+    _wait_until(lambda: flight.stats()["followers"] == 4)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [1]
+    assert results == ["report"] * 5
+    assert flight.stats() == {"leaders": 1, "followers": 4, "inflight": 0}
+
+
+def test_do_shares_error_and_retries_afterwards():
+    flight = SingleFlight("test")
+    release = threading.Event()
+    errors = []
+
+    def failing():
+        release.wait(5)
+        raise ValueError("boom")
+
+    def call():
+        try:
+            flight.do("key", failing)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    threads[0].start()
+    _wait_until(lambda: flight.stats()["inflight"] == 1)
+    for thread in threads[1:]:
+        thread.start()
+    _wait_until(lambda: flight.stats()["followers"] == 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 3 and len({id(e) for e in errors}) == 1
+    # 出错后不再合并, 之后的调用重新执行
+    assert flight.do("key", lambda: "ok") == "ok"
+
+
+def test_ado_waits_for_sync_leader():
+    flight = SingleFlight("test")
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return "report"
+
+    leader = threading.Thread(target=flight.do, args=("key", compute))
+    leader.start()
+    _wait_until(lambda: calls)
+
+    async def follow():
+        async def never():
+            raise AssertionError("follower must not execute")
+        waiter = asyncio.ensure_future(flight.ado("key", never))
+        await asyncio.sleep(0.01)
+        release.set()
+        return await waiter
+
+    assert asyncio.run(follow()) == "report"
+    leader.join()
+    assert calls == [1]
+
+
+def test_ado_coalesces_within_event_loop():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "report"
+
+    async def main():
+        return await asyncio.gather(*[flight.ado("key", compute) for _ in range(4)])
+
+    assert asyncio.run(main()) == ["report"] * 4
+    assert calls == [1]
+
+
+def test_cancelled_waiter_does_not_cancel_shared_call():
+    flight = SingleFlight("test")
+
+    async def main():
+        gate = asyncio.Event()
+
+        async def compute():
+            await gate.wait()
+            return "report"
+
+        first = asyncio.ensure_future(flight.ado("key", compute))
+        second = asyncio.ensure_future(flight.ado("key", compute))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        gate.set()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == "report"
+
+
+def test_last_cancelled_waiter_cancels_leader_task():
+    flight = SingleFlight("test")
+    cancelled = []
+
+    async def main():
+        async def compute():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+            return "stale"
+
+        waiters = [asyncio.ensure_future(flight.ado("key", compute)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0.01)
+
+        # 取消后的调用不再合并到已取消的任务上
+        async def fresh():
+            return "fresh"
+        return await flight.ado("key", fresh)
+
+    assert asyncio.run(main()) == "fresh"
+    assert cancelled == [1]
+    assert flight.stats()["inflight"] == 0
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+# 构造时编译prompt和管道的方法, 请求路径上不应再调用
+_COMPILE_METHODS = ("_majors_prompt", "_schools_prompt", "_schools_structured_prompt", "_school_profile_prompt",
+                    "_school_reasons_prompt", "_extract_prompt", "_build_pipeline", "_model_params")
+
+
+@pytest.fixture
+def compiled_once(monkeypatch):
+    def forbid(workflow):
+        for name in _COMPILE_METHODS:
+            def fail(*args, _name=name, **kwargs):
+                raise AssertionError(f"{_name} called on the request path")
+            monkeypatch.setattr(workflow, name, fail)
+        return workflow
+    return forbid
+
+
+def test_run_reuses_compiled_prompts_and_pipeline(make_workflow, llm_calls, compiled_once, profile):
+    workflow = compiled_once(make_workflow())
+    prompts, pipeline = dict(workflow._prompts), workflow._pipeline
+    report = workflow.run(profile, save=False)
+
+    assert report.count("School description and introduction") == 3
+    # 专业推荐、学校推荐各一次, 三所学校的通用章节和推荐理由各一次; 学校名单从推荐表中解析, 不调用LLM
+    assert llm_calls(workflow) == 8
+    assert workflow._prompts == prompts and workflow._pipeline is pipeline
+
+
+def test_arun_matches_run(make_workflow, compiled_once, profile):
+    sync_report = make_workflow().run(profile, save=False)
+    workflow = compiled_once(make_workflow())
+    assert asyncio.run(workflow.arun(profile, save=False)) == sync_report
+
+
+def test_astream_emits_sections_and_final_report(make_workflow, profile):
+    workflow = make_workflow()
+
+    async def collect():
+        return [event async for event in workflow.astream(profile, save=False)]
+
+    events = asyncio.run(collect())
+    stages = [event["stage"] for event in events if event["type"] == "section"]
+    assert stages[:2] == ["recommend_majors", "recommend_schools"]
+    assert stages.count("fill_school_info") == 3
+    assert events[-1]["type"] == "report"
+    assert events[-1]["content"] == make_workflow().run(profile, save=False)
+
+
+@pytest.mark.parametrize("runs", [1, 2])
+def test_astream_school_tokens_join_to_section(make_workflow, profile, runs):
+    # 第二次生成时学校通用章节直接取自共用的章节存储, 没有逐token输出
+    workflow = make_workflow()
+
+    async def collect():
+        return [event async for event in workflow.astream(profile, save=False)]
+
+    for _ in range(runs):
+        events = asyncio.run(collect())
+    school_events = [event for event in events if event.get("stage") == "fill_school_info"]
+    sections = {event["index"]: event["content"] for event in school_events if event["type"] == "section"}
+    deltas = {index: "" for index in sections}
+    for event in school_events:
+        if event["type"] == "token":
+            deltas[event["index"]] += event["delta"]
+    assert len(sections) == 3
+    assert deltas == sections
+
+
+def test_model_names_must_be_allowed(fake_llm_name, monkeypatch):
+    from university_selection_workflow import get_llm
+
+    monkeypatch.delenv("LLM_ALLOWED_MODELS", raising=False)
+    monkeypatch.setenv("LLM_FALLBACKS", "openai:gpt-4o-mini")
+    assert get_llm(fake_llm_name) is get_llm(fake_llm_name)
+    with pytest.raises(ValueError, match="not allowed"):
+        get_llm(f"{fake_llm_name}:any-model")
+    with pytest.raises(ValueError, match="not allowed"):
+        get_llm("openai:gpt-4o")
+
+
+def test_metrics_label_model_names_by_provider():
+    from prometheus_client import CollectorRegistry
+
+    from report_metrics import ReportMetrics
+
+    registry = CollectorRegistry()
+    metrics = ReportMetrics(registry)
+    for llm_name in ("openai", "openai:gpt-4o-mini", "openai:gpt-4o"):
+        metrics.observe_llm_call("recommend_majors", llm_name, 0.1, 10, 20)
+    count = registry.get_sample_value("report_llm_call_duration_seconds_count",
+                                      {"stage": "recommend_majors", "llm_name": "openai"})
+    assert count == 3
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+批量生成选校报告
+输入为profile目录（每个.txt文件一个学生）或JSONL文件（每行 {"id": ..., "profile": ...}），
+全局并发受max_concurrency限制，LLM调用按provider限流并以批量优先级排在交互式请求之后，学校通用章节在整批报告之间共享。
+每个profile的结果追加写入manifest.jsonl，重新运行同一批次时跳过已经成功的profile。
+
+用法:
+    python batch_reports.py profiles/ --output-dir output/batch --concurrency 8 --rate-limit openai=60
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from llm_cache import LLMCache
+from llm_scheduler import PRIORITY_BATCH, LLMScheduler, llm_priority
+from rate_limiter import parse_rate_limits
+from school_section_store import SchoolSectionStore
+from university_selection_workflow import UniversitySelectionWorkflow, load_environment
+
+_UNSAFE_ID_CHARS = re.compile(r"[^\w.-]+")
+
+
+def load_profiles(source: str) -> List[Dict[str, str]]:
+    """从目录或JSONL文件读取profile列表，返回 [{"id": ..., "profile": ...}]"""
+    profiles = []
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            path = os.path.join(source, name)
+            if not name.endswith(".txt") or not os.path.isfile(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                profiles.append({"id": os.path.splitext(name)[0], "profile": f.read()})
+        return profiles
+
+    with open(source, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            profiles.append({"id": str(record.get("id") or f"line-{line_no}"), "profile": record["profile"]})
+    return profiles
+
+
+class BatchReportRunner:
+    """批量报告执行器，结果和进度保存在output_dir下，可断点续跑"""
+
+    def __init__(self, output_dir: str, llm_name: str = "openai", max_concurrency: int = 4,
+                 workflow: Optional[UniversitySelectionWorkflow] = None,
+                 scheduler: Optional[LLMScheduler] = None,
+                 cache: Optional[LLMCache] = None,
+                 school_store: Optional[SchoolSectionStore] = None,
+                 debug: bool = False):
+        self.output_dir = output_dir
+        self.reports_dir = os.path.join(output_dir, "reports")
+        self.manifest_path = os.path.join(output_dir, "manifest.jsonl")
+        os.makedirs(self.reports_dir, exist_ok=True)
+        self.max_concurrency = max(1, max_concurrency)
+        # 整批共用一个workflow，学校通用章节只生成一次
+        self.workflow = workflow or UniversitySelectionWorkflow(
+            llm_name=llm_name,
+            debug=debug,
+            output_dir=os.path.join(output_dir, "workflow"),
+            cache=cache,
+            school_store=school_store,
+            scheduler=scheduler,
+        )
+
+    def load_manifest(self) -> Dict[str, Dict[str, Any]]:
+        """读取已有的结果清单，同一个profile以最后一条记录为准"""
+        records = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        records[record["id"]] = record
+        return records
+
+    def _append_manifest(self, record: Dict[str, Any]) -> None:
+        with open(self.manifest_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _report_path(self, profile_id: str) -> str:
+        return os.path.join(self.reports_dir, _UNSAFE_ID_CHARS.sub("_", profile_id) + ".md")
+
+    async def arun(self, profiles: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+        """执行整批报告，返回每个profile的结果记录（顺序与输入一致）"""
+        done = self.load_manifest()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        manifest_lock = asyncio.Lock()
+
+        async def run_one(item: Dict[str, str]) -> Dict[str, Any]:
+            previous = done.get(item["id"])
+            if previous is not None and previous["status"] == "success":
+                return previous
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    report = await self.workflow.arun(item["profile"])
+                    report_path = self._report_path(item["id"])
+                    await asyncio.to_thread(_write_text, report_path, report)
+                    record = {"id": item["id"], "status": "success", "report_path": report_path}
+                except Exception as e:
+                    record = {"id": item["id"], "status": "error", "error": str(e)}
+                record["elapsed"] = round(time.perf_counter() - started, 3)
+            async with manifest_lock:
+                self._append_manifest(record)
+            return record
+
+        # gather创建的任务复制当前context, 整批的LLM调用都以批量优先级排队
+        with llm_priority(PRIORITY_BATCH):
+            return list(await asyncio.gather(*(run_one(item) for item in profiles)))
+
+    def run(self, profiles: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+        return asyncio.run(self.arun(profiles))
+
+
+def _write_text(path: str, content: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def main():
+    load_environment()
+    parser = argparse.ArgumentParser(description="批量生成选校报告")
+    parser.add_argument("source", help="profile目录（*.txt）或JSONL文件")
+    parser.add_argument("--output-dir", default=os.path.join(os.path.dirname(__file__), "output", "batch"),
+                        help="报告和manifest.jsonl的输出目录，重复运行时跳过已成功的profile")
+    parser.add_argument("--llm", default="openai", help="使用的LLM模型名称")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时生成的报告数")
+    parser.add_argument("--rate-limit", default=os.getenv("LLM_RATE_LIMITS", ""),
+                        help='按provider的每分钟请求数，例如 "openai=60,gemini=30"')
+    parser.add_argument("--school-store", default=os.getenv("SCHOOL_SECTION_STORE_PATH"),
+                        help="学校通用章节的SQLite路径，不设置时只在本批次内存中共享")
+    parser.add_argument("--debug", action="store_true", help="开启调试日志")
+    args = parser.parse_args()
+
+    profiles = load_profiles(args.source)
+    runner = BatchReportRunner(
+        output_dir=args.output_dir,
+        llm_name=args.llm,
+        max_concurrency=args.concurrency,
+        scheduler=LLMScheduler.from_env(parse_rate_limits(args.rate_limit)) if args.rate_limit else None,
+        school_store=SchoolSectionStore(path=args.school_store),
+        debug=args.debug,
+    )
+    records = runner.run(profiles)
+    succeeded = sum(1 for record in records if record["status"] == "success")
+    print(f"完成 {succeeded}/{len(records)} 份报告，结果清单: {runner.manifest_path}")
+    return 0 if succeeded == len(records) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,231 @@
+"""
+报告生成任务的SQLite存储
+POST /jobs 写入排队中的任务后立即返回job id，worker(服务进程内或单独的进程, 见job_worker.py)领取任务执行，
+任务状态、各阶段进度和最终报告都保存在同一个SQLite文件中，GET /jobs/{id} 轮询查询。
+
+多个worker进程通过 BEGIN IMMEDIATE 事务互斥领取任务；worker定期续租，
+进程退出或卡死导致租约过期的任务会被其他worker重新领取，超过最大尝试次数后标记为失败。
+同一个SQLite文件只适合单机上的多个进程共享。
+
+任务状态: queued -> running -> succeeded / failed
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+
+# 报告按顺序经过的阶段, 用于计算进度
+JOB_STAGES = ["recommend_majors", "recommend_schools", "extract_school_names", "fill_school_info", "report"]
+
+_COLUMNS = ("id", "status", "priority", "llm_name", "profile", "options", "batch_id", "item_id", "progress", "report",
+            "error", "attempts", "worker", "lease_until", "created_at", "started_at", "updated_at", "finished_at")
+# 旧版本数据库中没有的列, 打开时补上
+_ADDED_COLUMNS = {"options": "TEXT", "batch_id": "TEXT", "item_id": "TEXT"}
+
+
+def default_job_store_path() -> str:
+    return os.getenv("JOB_STORE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs", "jobs.sqlite3"))
+
+
+def empty_progress() -> Dict[str, Any]:
+    return {"stage": None, "completed": [], "schools_total": 0, "schools_done": 0, "percent": 0}
+
+
+class JobStore:
+    """任务存储, 同一进程内多个线程共享一个连接, 多个进程各自打开同一个文件"""
+
+    def __init__(self, path: Optional[str] = None, max_attempts: int = 3):
+        self.path = path or default_job_store_path()
+        self.max_attempts = max(1, max_attempts)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # 其他进程持有写锁时最多等待30秒
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, priority INTEGER NOT NULL DEFAULT 0, "
+                "llm_name TEXT NOT NULL, profile TEXT NOT NULL, progress TEXT NOT NULL, report TEXT, error TEXT, "
+                "attempts INTEGER NOT NULL DEFAULT 0, worker TEXT, lease_until REAL, "
+                "created_at REAL NOT NULL, started_at REAL, updated_at REAL NOT NULL, finished_at REAL)"
+            )
+            existing = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in _ADDED_COLUMNS.items():
+                if column not in existing:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority, created_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch_id, item_id)")
+
+    def _row(self, row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        job = dict(row)
+        job["progress"] = json.loads(job["progress"])
+        job["options"] = json.loads(job["options"]) if job["options"] else {}
+        return job
+
+    def submit(self, profile: str, llm_name: str = "openai", priority: int = 0, regenerate: Iterable[str] = (),
+               overrides: Optional[Dict[str, Any]] = None) -> str:
+        """写入排队中的任务, 返回job id; regenerate和overrides与workflow.run相同, 由worker执行时使用"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        options = {"regenerate": list(regenerate), "overrides": overrides or {}}
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, priority, llm_name, profile, options, progress, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, STATUS_QUEUED, priority, llm_name, profile, json.dumps(options, ensure_ascii=False),
+                 json.dumps(empty_progress()), now, now),
+            )
+        return job_id
+
+    def submit_batch(self, batch_id: str, items: List[Dict[str, str]], llm_name: str = "openai",
+                     priority: int = 0) -> List[Dict[str, str]]:
+        """
+        批量写入任务, items为 [{"id": ..., "profile": ...}]; 同一批次中排队、执行中或已成功的item不重复提交,
+        失败的item重新提交。返回每个item对应的 {"id", "job_id", "status"}, 顺序与输入一致
+        """
+        now = time.time()
+        results = []
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for item in items:
+                    row = self._conn.execute(
+                        "SELECT id, status FROM jobs WHERE batch_id = ? AND item_id = ? AND status != ? "
+                        "ORDER BY created_at DESC LIMIT 1",
+                        (batch_id, item["id"], STATUS_FAILED),
+                    ).fetchone()
+                    if row is not None:
+                        results.append({"id": item["id"], "job_id": row["id"], "status": row["status"]})
+                        continue
+                    job_id = uuid.uuid4().hex
+                    self._conn.execute(
+                        "INSERT INTO jobs (id, status, priority, llm_name, profile, options, batch_id, item_id, "
+                        "progress, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (job_id, STATUS_QUEUED, priority, llm_name, item["profile"], json.dumps({}), batch_id,
+                         item["id"], json.dumps(empty_progress()), now, now),
+                    )
+                    results.append({"id": item["id"], "job_id": job_id, "status": STATUS_QUEUED})
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return results
+
+    def batch(self, batch_id: str) -> List[Dict[str, Any]]:
+        """批次中每个item最新的任务(不含profile和报告), 按提交顺序"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, item_id, status, progress, error, attempts, created_at, finished_at FROM jobs "
+                "WHERE batch_id = ? ORDER BY created_at, rowid",
+                (batch_id,),
+            ).fetchall()
+        latest: Dict[str, Dict[str, Any]] = {}
+        for row in rows:
+            job = dict(row)
+            job["progress"] = json.loads(job["progress"])
+            latest.pop(job["item_id"], None)
+            latest[job["item_id"]] = job
+        return list(latest.values())
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row(row)
+
+    def claim(self, worker: str, lease: float = 60.0) -> Optional[Dict[str, Any]]:
+        """
+        领取一个任务: 优先级数值小的、先提交的排在前面; 租约过期的运行中任务同样可以被领取。
+        尝试次数已达上限的过期任务直接标记为失败
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, finished_at = ?, updated_at = ?, lease_until = NULL "
+                    "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                    (STATUS_FAILED, "worker租约过期且已达最大尝试次数", now, now, STATUS_RUNNING, now, self.max_attempts),
+                )
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE status = ? OR (status = ? AND lease_until < ?) "
+                    "ORDER BY priority, created_at LIMIT 1",
+                    (STATUS_QUEUED, STATUS_RUNNING, now),
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1, "
+                    "started_at = COALESCE(started_at, ?), updated_at = ?, progress = ? WHERE id = ?",
+                    (STATUS_RUNNING, worker, now + lease, now, now, json.dumps(empty_progress()), row["id"]),
+                )
+                job = self._conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?",
+                                         (row["id"],)).fetchone()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self._row(job)
+
+    def heartbeat(self, job_ids: List[str], worker: str, lease: float = 60.0) -> None:
+        """为worker正在执行的任务续租"""
+        if not job_ids:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = ?",
+                [(now + lease, job_id, worker, STATUS_RUNNING) for job_id in job_ids],
+            )
+
+    def update_progress(self, job_id: str, worker: str, progress: Dict[str, Any]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET progress = ?, updated_at = ? WHERE id = ? AND worker = ? AND status = ?",
+                (json.dumps(progress, ensure_ascii=False), time.time(), job_id, worker, STATUS_RUNNING),
+            )
+
+    def complete(self, job_id: str, worker: str, report: str, progress: Dict[str, Any]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, report = ?, error = NULL, progress = ?, lease_until = NULL, "
+                "finished_at = ?, updated_at = ? WHERE id = ? AND worker = ?",
+                (STATUS_SUCCEEDED, report, json.dumps(progress, ensure_ascii=False), now, now, job_id, worker),
+            )
+
+    def fail(self, job_id: str, worker: str, error: str, retry: bool = False) -> None:
+        """记录失败; retry为True且未达最大尝试次数时重新排队"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = CASE WHEN ? AND attempts < ? THEN ? ELSE ? END, error = ?, "
+                "lease_until = NULL, worker = NULL, updated_at = ?, "
+                "finished_at = CASE WHEN ? AND attempts < ? THEN NULL ELSE ? END "
+                "WHERE id = ? AND worker = ?",
+                (retry, self.max_attempts, STATUS_QUEUED, STATUS_FAILED, error, now,
+                 retry, self.max_attempts, now, job_id, worker),
+            )
+
+    def counts(self) -> Dict[str, int]:
+        """各状态的任务数"""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+报告任务worker
+从JobStore领取排队中的任务，在一个事件循环中并发执行workflow.astream，按章节事件更新进度，
+完成后把报告写回JobStore。可以在服务进程内运行(langserve_app启动时按JOB_WORKER_CONCURRENCY启动)，
+也可以单独启动多个进程共享同一个SQLite文件横向扩展:
+
+    python job_worker.py --concurrency 8
+    python job_worker.py --db jobs/jobs.sqlite3 --concurrency 4 --poll-interval 1
+
+worker停止时进行中的任务重新排队；进程被强制结束时，任务在租约过期后由其他worker重新领取。
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import threading
+import uuid
+from typing import Any, Callable, Dict, Optional, Set
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from job_store import JOB_STAGES, JobStore, empty_progress
+from llm_cache import build_llm_cache_from_env
+from llm_scheduler import is_retryable_error, llm_priority
+from report_checkpoints import build_checkpoint_store_from_env
+from school_section_store import SchoolSectionStore
+from university_selection_workflow import UniversitySelectionWorkflow, load_environment
+
+
+def apply_event(progress: Dict[str, Any], event: Dict[str, Any]) -> bool:
+    """按workflow的章节事件更新进度, 进度有变化时返回True(token事件不改变进度)"""
+    if event["type"] == "section":
+        stage = event["stage"]
+        if stage == "extract_school_names":
+            progress["schools_total"] = len(event["content"])
+        if stage == "fill_school_info":
+            progress["schools_done"] += 1
+            if progress["schools_done"] < progress["schools_total"]:
+                stage = None
+        if stage is not None and stage not in progress["completed"]:
+            progress["completed"].append(stage)
+        progress["stage"] = event["stage"]
+    elif event["type"] == "report":
+        progress["completed"].append("report")
+        progress["stage"] = "report"
+    else:
+        return False
+    done = len(progress["completed"])
+    if "fill_school_info" not in progress["completed"] and progress["schools_total"]:
+        done += progress["schools_done"] / progress["schools_total"]
+    progress["percent"] = int(100 * done / len(JOB_STAGES))
+    return True
+
+
+def workflow_factory_from_env() -> Callable[[str], UniversitySelectionWorkflow]:
+    """与服务相同的环境变量配置创建workflow, 按llm_name缓存, 所有workflow共享LLM缓存、学校通用章节和检查点"""
+    cache = build_llm_cache_from_env()
+    school_store = SchoolSectionStore.from_env()
+    checkpoints = build_checkpoint_store_from_env()
+    pipelined = os.getenv("REPORT_PIPELINED", "false").lower() in ("1", "true", "yes")
+    structured_output = os.getenv("REPORT_STRUCTURED_OUTPUT", "false").lower() in ("1", "true", "yes")
+    fallback_llms = [name.strip() for name in os.getenv("LLM_FALLBACKS", "").split(",") if name.strip()]
+    hedge_after = os.getenv("LLM_HEDGE_AFTER")
+    workflows: Dict[str, UniversitySelectionWorkflow] = {}
+    lock = threading.Lock()
+
+    def get_workflow(llm_name: str) -> UniversitySelectionWorkflow:
+        with lock:
+            if llm_name not in workflows:
+                workflows[llm_name] = UniversitySelectionWorkflow(
+                    llm_name=llm_name, debug=False, cache=cache, school_store=school_store,
+                    fallback_llms=fallback_llms, hedge_after=float(hedge_after) if hedge_after else None,
+                    checkpoints=checkpoints, pipelined=pipelined, structured_output=structured_output,
+                )
+            return workflows[llm_name]
+
+    return get_workflow
+
+
+class JobWorker:
+    """在当前事件循环中最多同时执行concurrency个任务"""
+
+    def __init__(self, store: JobStore, get_workflow: Callable[[str], UniversitySelectionWorkflow],
+                 concurrency: int = 4, poll_interval: float = 0.5, lease: float = 60.0,
+                 worker_id: Optional[str] = None):
+        self.store = store
+        self.get_workflow = get_workflow
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._running: Dict[str, asyncio.Task] = {}
+
+    async def _run_job(self, job: Dict[str, Any]) -> None:
+        job_id = job["id"]
+        progress = empty_progress()
+        report = None
+        try:
+            workflow = await asyncio.to_thread(self.get_workflow, job["llm_name"])
+            # astream内部创建的任务复制当前context, 整个任务的LLM调用都使用该优先级
+            with llm_priority(job["priority"]):
+                async for event in workflow.astream(job["profile"], save=False,
+                                                    regenerate=job["options"].get("regenerate", ()),
+                                                    overrides=job["options"].get("overrides")):
+                    if event["type"] == "report":
+                        report = event["content"]
+                    elif apply_event(progress, event):
+                        await asyncio.to_thread(self.store.update_progress, job_id, self.worker_id, dict(progress))
+            apply_event(progress, {"type": "report"})
+            await asyncio.to_thread(self.store.complete, job_id, self.worker_id, report, progress)
+        except asyncio.CancelledError:
+            # worker停止, 任务重新排队, 不计为失败
+            self.store.fail(job_id, self.worker_id, "worker已停止", retry=True)
+            raise
+        except Exception as e:
+            # 限流、超时等临时性错误重新排队, 其他错误直接失败
+            await asyncio.to_thread(self.store.fail, job_id, self.worker_id, str(e), is_retryable_error(e))
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            await asyncio.to_thread(self.store.heartbeat, list(self._running), self.worker_id, self.lease)
+
+    async def run(self, stop: Optional[asyncio.Event] = None) -> None:
+        """领取并执行任务直到stop被设置; 退出时取消进行中的任务(重新排队)"""
+        stop = stop or asyncio.Event()
+        heartbeat = asyncio.ensure_future(self._heartbeat())
+        slot_freed = asyncio.Event()
+        try:
+            while not stop.is_set():
+                if len(self._running) >= self.concurrency:
+                    slot_freed.clear()
+                    await _wait_any(stop, slot_freed, None)
+                    continue
+                job = await asyncio.to_thread(self.store.claim, self.worker_id, self.lease)
+                if job is None:
+                    await _wait_any(stop, slot_freed, self.poll_interval)
+                    continue
+                task = asyncio.ensure_future(self._run_job(job))
+                self._running[job["id"]] = task
+
+                def done(_task: asyncio.Task, job_id: str = job["id"]) -> None:
+                    self._running.pop(job_id, None)
+                    slot_freed.set()
+
+                task.add_done_callback(done)
+        finally:
+            heartbeat.cancel()
+            tasks: Set[asyncio.Task] = set(self._running.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _wait_any(stop: asyncio.Event, other: asyncio.Event, timeout: Optional[float]) -> None:
+    waiters = [asyncio.ensure_future(stop.wait()), asyncio.ensure_future(other.wait())]
+    try:
+        await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for waiter in waiters:
+            waiter.cancel()
+
+
+def main():
+    load_environment()
+    parser = argparse.ArgumentParser(description="选校报告任务worker")
+    parser.add_argument("--db", default=None, help="任务SQLite文件, 默认JOB_STORE_PATH或jobs/jobs.sqlite3")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("JOB_WORKER_CONCURRENCY", "4")),
+                        help="同时执行的任务数")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="没有任务时的轮询间隔(秒)")
+    parser.add_argument("--lease", type=float, default=60.0, help="任务租约(秒), worker每隔三分之一租约续租")
+    args = parser.parse_args()
+
+    store = JobStore(args.db)
+    worker = JobWorker(store, workflow_factory_from_env(), concurrency=args.concurrency,
+                       poll_interval=args.poll_interval, lease=args.lease)
+    print(f"worker {worker.worker_id} 开始处理任务: {store.path}")
+    try:
+        asyncio.run(worker.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
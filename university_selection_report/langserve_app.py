@@ -4,17 +4,38 @@ LangServe应用 - 美国本科留学选校报告生成服务
 提供REST API接口，支持学生profile输入，返回完整的选校报告
 """
 
+import asyncio
+import hashlib
+import json
+import math
 import os
 import sys
-from typing import Dict, Any
-from fastapi import FastAPI
+import threading
+from contextlib import asynccontextmanager
+from typing import Dict, Any, AsyncIterator, Iterable, List, Optional
+from fastapi import FastAPI, HTTPException, Request, Response
 from langserve import add_routes
+from sse_starlette.sse import EventSourceResponse
 from pydantic import BaseModel, Field
 
 # 添加当前目录到Python路径
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from university_selection_workflow import UniversitySelectionWorkflow
+from university_selection_workflow import UniversitySelectionWorkflow, load_environment
+from normalization.university_normalization import get_default_normalizer
+from batch_reports import load_profiles
+from job_store import JobStore
+from job_worker import JobWorker
+from llm_cache import build_llm_cache_from_env
+from llm_client_pool import get_default_client_pool
+from llm_scheduler import PRIORITY_BATCH, get_default_scheduler, is_rate_limit_error
+from prompt_budget import get_default_prompt_budget
+from report_artifacts import get_default_artifact_store
+from report_checkpoints import ReportOverrides, build_checkpoint_store_from_env, validate_overrides
+from report_metrics import get_default_metrics
+from report_renderer import RENDER_VERSION, RenderUnavailableError, get_default_renderer, report_id_for
+from school_section_store import SchoolSectionStore
+from single_flight import single_flight_stats
 
 
 class StudentProfileRequest(BaseModel):
@@ -22,6 +43,10 @@ class StudentProfileRequest(BaseModel):
     profile: str = Field(..., description="学生profile内容，可以是完整文本或文件路径")
     llm_name: str = Field(default="openai", description="使用的LLM模型名称")
     debug: bool = Field(default=False, description="是否开启调试模式")
+    regenerate: List[str] = Field(default_factory=list,
+                                  description="需要重新生成的章节: 阶段名称、学校名称或safety/target/reach，其余章节优先使用检查点")
+    overrides: Optional[ReportOverrides] = Field(default=None,
+                                                 description="替换指定阶段的内容，例如修改过的学校推荐表 {\"recommend_schools\": \"...\"}")
 
 # Rebuild model to ensure all references are resolved
 StudentProfileRequest.model_rebuild()
@@ -32,37 +57,167 @@ class UniversitySelectionResponse(BaseModel):
     report: str = Field(..., description="生成的完整选校报告")
     llm_used: str = Field(..., description="使用的LLM模型")
     debug_mode: bool = Field(..., description="调试模式状态")
+    report_id: Optional[str] = Field(default=None, description="报告ID, 通过 /reports/{report_id}.pdf 下载PDF")
 
 # Rebuild model to ensure all references are resolved
 UniversitySelectionResponse.model_rebuild()
 
 
+class BatchReportRequest(BaseModel):
+    """批量报告请求模型"""
+    source: Optional[str] = Field(default=None,
+                                  description="BATCH_SOURCE_DIR下的profile目录或JSONL文件(相对路径)，未配置BATCH_SOURCE_DIR时不可用")
+    profiles: Optional[List[str]] = Field(default=None, description="profile内容列表，与source二选一")
+    batch_id: Optional[str] = Field(default=None, pattern=r"^[A-Za-z0-9_-]{1,64}$",
+                                    description="批次ID(字母、数字、下划线和连字符)，相同批次重复提交时跳过已提交或已成功的profile")
+    llm_name: str = Field(default="openai", description="使用的LLM模型名称")
+
+
+class BatchReportResponse(BaseModel):
+    """批量报告响应模型"""
+    batch_id: str = Field(..., description="批次ID")
+    status_url: str = Field(..., description="查询批次进度的地址")
+    jobs: List[Dict[str, Any]] = Field(..., description="每个profile的item id、后台任务ID和状态")
+
+
+class BatchStatusResponse(BaseModel):
+    """批次进度响应模型"""
+    batch_id: str = Field(..., description="批次ID")
+    counts: Dict[str, int] = Field(..., description="各状态的任务数")
+    jobs: List[Dict[str, Any]] = Field(..., description="每个profile最新的任务状态和进度, 报告通过 GET /jobs/{job_id} 获取")
+
+
+class JobSubmitRequest(BaseModel):
+    """提交后台任务的请求模型, 任务由worker执行, 不支持调试模式"""
+    profile: str = Field(..., description="学生profile内容")
+    llm_name: str = Field(default="openai", description="使用的LLM模型名称")
+    regenerate: List[str] = Field(default_factory=list,
+                                  description="需要重新生成的章节: 阶段名称、学校名称或safety/target/reach，其余章节优先使用检查点")
+    overrides: Optional[ReportOverrides] = Field(default=None,
+                                                 description="替换指定阶段的内容，例如修改过的学校推荐表 {\"recommend_schools\": \"...\"}")
+
+
+class JobSubmitResponse(BaseModel):
+    """提交任务的响应模型"""
+    job_id: str = Field(..., description="任务ID")
+    status: str = Field(..., description="任务状态")
+    status_url: str = Field(..., description="查询任务状态的地址")
+
+
+class JobStatusResponse(BaseModel):
+    """任务状态响应模型"""
+    job_id: str = Field(..., description="任务ID")
+    status: str = Field(..., description="queued / running / succeeded / failed")
+    llm_name: str = Field(..., description="使用的LLM模型名称")
+    progress: Dict[str, Any] = Field(..., description="当前阶段、已完成的阶段、学校信息填充进度和完成百分比")
+    report: Optional[str] = Field(default=None, description="完成后的报告")
+    error: Optional[str] = Field(default=None, description="失败原因")
+    attempts: int = Field(..., description="已执行的次数")
+    created_at: float = Field(..., description="提交时间(unix时间戳)")
+    started_at: Optional[float] = Field(default=None, description="第一次开始执行的时间")
+    finished_at: Optional[float] = Field(default=None, description="完成或失败的时间")
+
+
 class UniversitySelectionWorkflowService:
     """选校报告生成服务类"""
     
     def __init__(self):
+        # 先读取.env, 下面的缓存、存储和限流配置都来自环境变量
+        load_environment()
         self.workflows = {}  # 缓存不同配置的workflow实例
+        self._workflows_lock = threading.Lock()
+        self.llm_cache = build_llm_cache_from_env()  # 所有workflow共享的LLM响应缓存
+        # 所有workflow共享的学校通用章节(按模型区分), 设置SCHOOL_SECTION_STORE_PATH时持久化到SQLite, 内存中最多保留SCHOOL_SECTION_MAX_ENTRIES条
+        self.school_store = SchoolSectionStore.from_env()
+        # 按provider的预算限流、优先级排队和重试, 通过LLM_RATE_LIMITS、LLM_TOKEN_LIMITS等配置
+        self.scheduler = get_default_scheduler()
+        # 对冲和故障切换的备选LLM, 例如 LLM_FALLBACKS="gemini,openai:gpt-4o-mini"
+        self.fallback_llms = [name.strip() for name in os.getenv("LLM_FALLBACKS", "").split(",") if name.strip()]
+        hedge_after = os.getenv("LLM_HEDGE_AFTER")
+        self.hedge_after = float(hedge_after) if hedge_after else None
+        # 所有workflow共享的阶段检查点, 同一份profile重新生成时只重新计算输入有变化的阶段
+        self.checkpoints = build_checkpoint_store_from_env()
+        # 流水线模式: 学校推荐表边生成边开始各学校章节, profile中列出的目标学校提前生成
+        self.pipelined = os.getenv("REPORT_PIPELINED", "false").lower() in ("1", "true", "yes")
+        # 结构化输出模式: 学校推荐按JSON schema返回, 本地渲染表格, 不需要再提取学校名称
+        self.structured_output = os.getenv("REPORT_STRUCTURED_OUTPUT", "false").lower() in ("1", "true", "yes")
+        # HTML/PDF渲染进程池, 服务启动时预热(RENDER_WORKERS)
+        self.renderer = get_default_renderer()
+        # 各阶段prompt的token预算和压缩(PROMPT_BUDGETS、PROMPT_COMPACTION), 所有workflow共享
+        self.prompt_budget = get_default_prompt_budget()
+        # 按内容哈希保存的报告文件(REPORT_ARTIFACT_DIR)
+        self.artifacts = get_default_artifact_store()
+        # 后台任务存储, 第一次使用时打开(JOB_STORE_PATH)
+        self._job_store: Optional[JobStore] = None
+
+    @property
+    def job_store(self) -> JobStore:
+        if self._job_store is None:
+            self._job_store = JobStore()
+        return self._job_store
     
     def _get_workflow(self, llm_name: str, debug: bool) -> UniversitySelectionWorkflow:
         """获取或创建workflow实例"""
         key = f"{llm_name}_{debug}"
-        if key not in self.workflows:
-            self.workflows[key] = UniversitySelectionWorkflow(
-                llm_name=llm_name,
-                debug=debug
-            )
-        return self.workflows[key]
+        workflow = self.workflows.get(key)
+        if workflow is not None:
+            return workflow
+        # 多个to_thread调用同时请求同一配置时只创建一个; llm_name中的模型名称由get_llm按LLM_ALLOWED_MODELS校验
+        with self._workflows_lock:
+            if key not in self.workflows:
+                self.workflows[key] = UniversitySelectionWorkflow(
+                    llm_name=llm_name,
+                    debug=debug,
+                    cache=self.llm_cache,
+                    school_store=self.school_store,
+                    scheduler=self.scheduler,
+                    fallback_llms=self.fallback_llms,
+                    hedge_after=self.hedge_after,
+                    checkpoints=self.checkpoints,
+                    pipelined=self.pipelined,
+                    structured_output=self.structured_output,
+                    prompt_budget=self.prompt_budget
+                )
+            return self.workflows[key]
     
-    def generate_report(self, profile: str, llm_name: str = "openai", debug: bool = False) -> Dict[str, Any]:
+    def generate_report(self, profile: str, llm_name: str = "openai", debug: bool = False,
+                        regenerate: Iterable[str] = (), overrides: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """生成选校报告"""
         try:
             workflow = self._get_workflow(llm_name, debug)
-            report = workflow.run(profile)
+            report = workflow.run(profile, regenerate=regenerate, overrides=overrides)
+            
+            return {
+                "report": report,
+                "llm_used": llm_name,
+                "debug_mode": debug,
+                "report_id": self.renderer.register(report),
+                "status": "success"
+            }
+        except Exception as e:
+            return {
+                "report": "",
+                "llm_used": llm_name,
+                "debug_mode": debug,
+                "status": "error",
+                "error": str(e),
+                # 重试后仍被provider限流, HTTP接口返回429
+                "rate_limited": is_rate_limit_error(e)
+            }
+
+    async def agenerate_report(self, profile: str, llm_name: str = "openai", debug: bool = False,
+                               regenerate: Iterable[str] = (),
+                               overrides: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """生成选校报告（异步版本）, 不阻塞事件循环"""
+        try:
+            workflow = self._get_workflow(llm_name, debug)
+            report = await workflow.arun(profile, regenerate=regenerate, overrides=overrides)
             
             return {
                 "report": report,
                 "llm_used": llm_name,
                 "debug_mode": debug,
+                "report_id": self.renderer.register(report),
                 "status": "success"
             }
         except Exception as e:
@@ -71,15 +226,63 @@ class UniversitySelectionWorkflowService:
                 "llm_used": llm_name,
                 "debug_mode": debug,
                 "status": "error",
-                "error": str(e)
+                "error": str(e),
+                # 重试后仍被provider限流, HTTP接口返回429
+                "rate_limited": is_rate_limit_error(e)
             }
 
+    async def report_markdown(self, report_id: str) -> Optional[str]:
+        """按report_id查找报告: 本进程生成的报告(内容哈希)、已保存的报告文件, 或已完成的后台任务(job id)"""
+        report = self.renderer.get_report(report_id)
+        if report is None:
+            report = await asyncio.to_thread(self.artifacts.get_report, report_id)
+        if report is None:
+            job = await asyncio.to_thread(self.job_store.get, report_id)
+            if job is not None and job["status"] == "succeeded":
+                report = job["report"]
+        return report
+
+    async def astream_report(self, profile: str, llm_name: str = "openai", debug: bool = False,
+                             regenerate: Iterable[str] = (),
+                             overrides: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """流式生成选校报告, 产出workflow的token/章节/报告事件, 出错时产出error事件"""
+        try:
+            workflow = self._get_workflow(llm_name, debug)
+            async for event in workflow.astream(profile, regenerate=regenerate, overrides=overrides):
+                yield event
+        except Exception as e:
+            yield {"type": "error", "error": str(e)}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 服务进程内的任务worker, JOB_WORKER_CONCURRENCY=0时只由单独的job_worker.py进程执行任务
+    concurrency = int(os.getenv("JOB_WORKER_CONCURRENCY", "2"))
+    stop = asyncio.Event()
+    worker_task = None
+    if concurrency > 0:
+        worker = JobWorker(service.job_store, lambda llm_name: service._get_workflow(llm_name, False),
+                           concurrency=concurrency)
+        worker_task = asyncio.ensure_future(worker.run(stop))
+    # 探测PDF后端并预热渲染进程池, 第一份PDF不再承担这些开销
+    await asyncio.to_thread(service.renderer.start)
+    # 加载学校名称列表、FAISS索引和向量模型, 第一次模糊匹配不在请求中加载
+    await asyncio.to_thread(lambda: get_default_normalizer().warm())
+    yield
+    stop.set()
+    if worker_task is not None:
+        await worker_task
+    # 服务退出时关闭共享的LLM连接池和渲染进程池
+    await get_default_client_pool().aclose()
+    service.renderer.close()
+
 
 # 创建FastAPI应用
 app = FastAPI(
     title="美国本科留学选校报告生成服务",
     description="基于AI的美国本科留学选校报告生成API服务",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 # 创建服务实例
@@ -94,7 +297,20 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "/generate_report": "生成选校报告",
-            "/health": "健康检查"
+            "/generate_report/stream": "流式生成选校报告(SSE)",
+            "/generate_reports/batch": "提交批量报告任务(立即返回批次ID)",
+            "/generate_reports/batch/{batch_id}": "查询批次中各profile的任务状态",
+            "/jobs": "提交后台报告任务(立即返回job id)",
+            "/jobs/{job_id}": "查询任务状态、进度和报告",
+            "/reports/{report_id}.pdf": "下载报告PDF(report_id为报告ID或已完成任务的job id)",
+            "/reports/{report_id}.html": "下载报告HTML",
+            "/health": "健康检查",
+            "/cache/stats": "LLM缓存命中统计",
+            "/scheduler/stats": "LLM调度器状态(并发上限、排队数、429冷却)",
+            "/prompt/stats": "各阶段prompt的token预算、实际token数和压缩节省的token数",
+            "/coalescing/stats": "相同的并发报告请求和LLM调用的合并统计",
+            "/render/stats": "PDF渲染后端、渲染缓存命中和报告文件保存统计",
+            "/metrics": "Prometheus指标(各阶段耗时、排队、token、缓存命中)"
         }
     }
 
@@ -105,31 +321,263 @@ async def health_check():
     return {"status": "healthy", "service": "university-selection-workflow"}
 
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """LLM响应缓存的命中/未命中统计"""
+    if service.llm_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **service.llm_cache.stats()}
+
+
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    """各provider的并发上限、进行中和排队的LLM调用数、429冷却时间"""
+    return service.scheduler.stats()
+
+
+@app.get("/prompt/stats")
+async def prompt_stats():
+    """各阶段prompt的token预算、平均和最大token数、超出预算次数和压缩节省的token数"""
+    return service.prompt_budget.stats()
+
+
+@app.get("/coalescing/stats")
+async def coalescing_stats():
+    """相同输入的报告、相同prompt的LLM调用和学校章节: 实际执行(leaders)和等待已有结果(followers)的次数"""
+    return {**single_flight_stats(), "school_section": service.school_store.flight_stats()}
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus指标, 按stage和llm_name统计各阶段耗时、排队时间、token数和缓存命中"""
+    report_metrics = get_default_metrics()
+    if not report_metrics.enabled:
+        raise HTTPException(status_code=503, detail="需要安装prometheus-client")
+    content, content_type = report_metrics.render()
+    return Response(content=content, media_type=content_type)
+
+
 @app.post("/generate_report", response_model=UniversitySelectionResponse)
 async def generate_report(request: StudentProfileRequest):
     """生成选校报告的主要端点"""
-    result = service.generate_report(
+    result = await service.agenerate_report(
         profile=request.profile,
         llm_name=request.llm_name,
-        debug=request.debug
+        debug=request.debug,
+        regenerate=request.regenerate,
+        overrides=validate_overrides(request.overrides)
     )
     
     if result["status"] == "error":
-        raise Exception(f"报告生成失败: {result.get('error', '未知错误')}")
+        detail = f"报告生成失败: {result.get('error', '未知错误')}"
+        if result.get("rate_limited"):
+            provider = request.llm_name.partition(":")[0]
+            retry_after = max(1, math.ceil(service.scheduler.provider(provider).cooldown_remaining()))
+            raise HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(retry_after)})
+        raise HTTPException(status_code=500, detail=detail)
     
     return UniversitySelectionResponse(
         report=result["report"],
         llm_used=result["llm_used"],
-        debug_mode=result["debug_mode"]
+        debug_mode=result["debug_mode"],
+        report_id=result["report_id"]
     )
 
 
-from langchain_core.runnables import RunnableLambda
+# 报告内容由report_id(内容哈希)决定, 可以长期缓存
+_IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    return f'"{etag}"' in request.headers.get("if-none-match", "")
+
+
+def _accepts_gzip(request: Request) -> bool:
+    return "gzip" in request.headers.get("accept-encoding", "")
+
+
+def _etag_response(request: Request, etag: str, cache_control: str, content: bytes = b"", media_type: Optional[str] = None,
+                   gzipped: Optional[bytes] = None, headers: Optional[Dict[str, str]] = None) -> Response:
+    """带ETag的响应: If-None-Match命中时返回304; 客户端支持gzip且有压缩结果时返回压缩后的内容"""
+    headers = {"ETag": f'"{etag}"', "Cache-Control": cache_control, **(headers or {})}
+    if gzipped is not None:
+        headers["Vary"] = "Accept-Encoding"
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    if gzipped is not None and _accepts_gzip(request):
+        headers["Content-Encoding"] = "gzip"
+        content = gzipped
+    return Response(content=content, media_type=media_type, headers=headers)
+
+
+async def _report_or_404(report_id: str) -> str:
+    report = await service.report_markdown(report_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail=f"报告不存在: {report_id}")
+    return report
+
+
+@app.get("/reports/{report_id}.pdf")
+async def report_pdf(report_id: str, request: Request):
+    """在渲染进程池中把报告渲染为PDF, 结果按内容缓存; 客户端已有同一份PDF时返回304, 不再渲染"""
+    report = await _report_or_404(report_id)
+    etag = f"{report_id_for(report)}-{RENDER_VERSION}"
+    headers = {"Content-Disposition": f'inline; filename="{report_id}.pdf"'}
+    if _not_modified(request, etag):
+        return _etag_response(request, etag, _IMMUTABLE, headers=headers)
+    try:
+        pdf = await service.renderer.arender_pdf(report)
+    except RenderUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"PDF渲染失败: {e}")
+    return _etag_response(request, etag, _IMMUTABLE, pdf, "application/pdf", headers=headers)
+
+
+@app.get("/reports/{report_id}.html")
+async def report_html(report_id: str, request: Request):
+    """报告渲染为带内联样式的独立HTML: 优先返回保存报告时已渲染好的文件(支持gzip), 否则在渲染进程池中渲染"""
+    media_type = service.artifacts.media_type(".html")
+    if _not_modified(request, report_id):
+        return _etag_response(request, report_id, _IMMUTABLE)
+    if _accepts_gzip(request):
+        gzipped = await asyncio.to_thread(service.artifacts.read_gzipped, report_id)
+        if gzipped is not None:
+            return _etag_response(request, report_id, _IMMUTABLE, media_type=media_type, gzipped=gzipped)
+    else:
+        html = await asyncio.to_thread(service.artifacts.read, report_id)
+        if html is not None:
+            return _etag_response(request, report_id, _IMMUTABLE, html, media_type)
+    report = await _report_or_404(report_id)
+    html = await service.renderer.arender_html(report)
+    # job id等不是内容哈希的report_id, ETag按报告内容计算
+    return _etag_response(request, report_id_for(report), _IMMUTABLE, html.encode("utf-8"), media_type)
+
+
+@app.get("/render/stats")
+async def render_stats():
+    """可用的PDF后端、渲染缓存命中, 以及报告文件的保存和跳过次数"""
+    return {**service.renderer.stats(), "artifacts": service.artifacts.stats()}
+
+
+@app.post("/jobs", response_model=JobSubmitResponse, status_code=202)
+async def submit_job(request: JobSubmitRequest):
+    """提交后台报告任务, 立即返回job id, 通过 GET /jobs/{job_id} 轮询进度和结果"""
+    job_id = await asyncio.to_thread(service.job_store.submit, request.profile, request.llm_name,
+                                     regenerate=request.regenerate,
+                                     overrides=validate_overrides(request.overrides))
+    return JobSubmitResponse(job_id=job_id, status="queued", status_url=f"/jobs/{job_id}")
+
+
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job(job_id: str):
+    """任务状态、各阶段进度, 完成后包含报告"""
+    job = await asyncio.to_thread(service.job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    return JobStatusResponse(job_id=job["id"], **{key: job[key] for key in JobStatusResponse.model_fields if key != "job_id"})
+
+
+@app.post("/generate_report/stream")
+async def generate_report_stream(request: StudentProfileRequest):
+    """以server-sent events流式返回报告的token、章节和最终报告"""
+    async def event_source():
+        async for event in service.astream_report(
+            profile=request.profile,
+            llm_name=request.llm_name,
+            debug=request.debug,
+            regenerate=request.regenerate,
+            overrides=validate_overrides(request.overrides)
+        ):
+            yield {"event": event["type"], "data": json.dumps(event, ensure_ascii=False)}
+
+    return EventSourceResponse(event_source())
+
+
+def _batch_source_path(source: str) -> str:
+    """source限定在BATCH_SOURCE_DIR目录内, 不允许读取服务器上的其他路径"""
+    root = os.getenv("BATCH_SOURCE_DIR")
+    if not root:
+        raise HTTPException(status_code=400, detail="未配置BATCH_SOURCE_DIR, 请使用profiles提交")
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, source))
+    if os.path.commonpath([root, path]) != root or not os.path.exists(path):
+        raise HTTPException(status_code=400, detail=f"BATCH_SOURCE_DIR下不存在: {source}")
+    return path
+
+
+@app.post("/generate_reports/batch", response_model=BatchReportResponse, status_code=202)
+async def generate_reports_batch(request: BatchReportRequest):
+    """
+    批量生成选校报告: 每个profile作为批量优先级的后台任务排队(排在交互式任务之后), 立即返回批次ID,
+    通过 GET /generate_reports/batch/{batch_id} 查询进度
+    """
+    if request.source:
+        try:
+            profiles = await asyncio.to_thread(load_profiles, _batch_source_path(request.source))
+        except (ValueError, KeyError) as e:
+            raise HTTPException(status_code=400, detail=f"profile文件格式错误: {e}")
+    elif request.profiles:
+        profiles = [{"id": f"item-{i}", "profile": profile} for i, profile in enumerate(request.profiles)]
+    else:
+        raise HTTPException(status_code=400, detail="source和profiles至少需要提供一个")
+
+    batch_id = request.batch_id or hashlib.sha256(
+        json.dumps(profiles, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    ).hexdigest()[:16]
+    jobs = await asyncio.to_thread(service.job_store.submit_batch, batch_id, profiles, request.llm_name,
+                                   PRIORITY_BATCH)
+    return BatchReportResponse(batch_id=batch_id, status_url=f"/generate_reports/batch/{batch_id}", jobs=jobs)
+
+
+@app.get("/generate_reports/batch/{batch_id}", response_model=BatchStatusResponse)
+async def get_batch(batch_id: str):
+    """批次中每个profile的任务状态和进度"""
+    jobs = await asyncio.to_thread(service.job_store.batch, batch_id)
+    if not jobs:
+        raise HTTPException(status_code=404, detail=f"批次不存在: {batch_id}")
+    counts: Dict[str, int] = {}
+    for job in jobs:
+        counts[job["status"]] = counts.get(job["status"], 0) + 1
+    return BatchStatusResponse(batch_id=batch_id, counts=counts, jobs=jobs)
+
+
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.utils import AddableDict
+
+
+class UniversitySelectionReportRunnable(Runnable[Dict[str, Any], Dict[str, Any]]):
+    """LangServe路由使用的Runnable: invoke返回完整报告, stream按报告顺序流式返回报告文本"""
+
+    def invoke(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> Dict[str, Any]:
+        return service.generate_report(**input)
+
+    async def ainvoke(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> Dict[str, Any]:
+        return await service.agenerate_report(**input)
+
+    async def astream(self, input: Dict[str, Any], config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[Dict[str, Any]]:
+        llm_name = input.get("llm_name", "openai")
+        debug = input.get("debug", False)
+        # 各chunk相加后得到与invoke相同结构的结果, report_id和status在最后一个chunk中
+        yield AddableDict(report="", llm_used=llm_name, debug_mode=debug)
+        parts: List[str] = []
+        try:
+            workflow = service._get_workflow(llm_name, debug)
+            async for delta in workflow.astream_text(input["profile"], regenerate=input.get("regenerate") or (),
+                                                     overrides=validate_overrides(input.get("overrides"))):
+                parts.append(delta)
+                yield AddableDict(report=delta)
+        except Exception as e:
+            # 已经输出的部分报告无法撤回, 与invoke一样用status和error表示失败
+            yield AddableDict(status="error", error=str(e), rate_limited=is_rate_limit_error(e))
+            return
+        yield AddableDict(report_id=service.renderer.register("".join(parts)), status="success")
+
 
 # 添加LangServe路由
 add_routes(
     app,
-    RunnableLambda(service.generate_report),
+    UniversitySelectionReportRunnable(),
     path="/langserve/generate_report",
     input_type=StudentProfileRequest,
     output_type=UniversitySelectionResponse
@@ -0,0 +1,234 @@
+"""
+LLM响应缓存
+相同的prompt、模型、模型参数和locale的调用直接复用之前的结果，避免重复的LLM延迟和费用。
+支持内存LRU和SQLite本地文件两种后端，都支持TTL过期和按条目数淘汰，并统计命中/未命中次数。
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+def make_cache_key(prompt: str, llm_name: str, model_params: Dict[str, Any], locale: str) -> str:
+    """根据渲染后的prompt、llm_name、模型参数和locale生成缓存key"""
+    payload = json.dumps(
+        {
+            "prompt": prompt,
+            "llm_name": llm_name,
+            "model_params": model_params,
+            "locale": locale,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """缓存后端基类，子类实现_get/_set/_clear/__len__"""
+
+    def __init__(self, ttl: Optional[float] = None):
+        # ttl单位为秒，None表示永不过期
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._get(key)
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        self._set(key, value)
+
+    def clear(self) -> None:
+        self._clear()
+        with self._stats_lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """返回命中/未命中计数"""
+        with self._stats_lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "backend": type(self).__name__,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+            "size": len(self),
+        }
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    def _get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def _set(self, key: str, value: str) -> None:
+        raise NotImplementedError
+
+    def _clear(self) -> None:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+class InMemoryLRUCache(LLMCache):
+    """进程内LRU缓存，超过max_entries时淘汰最久未使用的条目"""
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = None):
+        super().__init__(ttl=ttl)
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            created_at, value = item
+            if self._expired(created_at):
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def _set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._data[key] = (time.time(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def _clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteLLMCache(LLMCache):
+    """SQLite本地文件缓存，进程重启后依然有效；超过max_entries时按最近访问时间淘汰"""
+
+    def __init__(self, path: str, max_entries: int = 100_000, ttl: Optional[float] = None):
+        super().__init__(ttl=ttl)
+        self.path = path
+        self.max_entries = max_entries
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache(accessed_at)")
+        self._conn.commit()
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if self._expired(created_at):
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return value
+
+    def _set(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            if self.ttl is not None:
+                self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+            # 超出容量时删除最久未访问的条目
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                "SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def _clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+
+class TieredLLMCache(LLMCache):
+    """两级缓存：先查内存LRU，未命中再查SQLite，SQLite命中后回填内存"""
+
+    def __init__(self, memory: InMemoryLRUCache, disk: SQLiteLLMCache):
+        super().__init__(ttl=None)
+        self.memory = memory
+        self.disk = disk
+
+    def _get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        return value
+
+    def _set(self, key: str, value: str) -> None:
+        self.memory.set(key, value)
+        self.disk.set(key, value)
+
+    def _clear(self) -> None:
+        self.memory.clear()
+        self.disk.clear()
+
+    def __len__(self) -> int:
+        return len(self.disk)
+
+
+def build_llm_cache_from_env() -> Optional[LLMCache]:
+    """
+    根据环境变量创建缓存:
+    LLM_CACHE_BACKEND: memory(默认) / sqlite / none
+    LLM_CACHE_PATH: SQLite文件路径
+    LLM_CACHE_TTL: 过期时间(秒)
+    LLM_CACHE_MAX_ENTRIES: 最大条目数
+    """
+    backend = os.getenv("LLM_CACHE_BACKEND", "memory").lower()
+    ttl = float(os.environ["LLM_CACHE_TTL"]) if os.getenv("LLM_CACHE_TTL") else None
+    max_entries = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+    if backend == "none":
+        return None
+    memory = InMemoryLRUCache(max_entries=max_entries, ttl=ttl)
+    if backend == "sqlite":
+        path = os.getenv("LLM_CACHE_PATH", os.path.join(os.path.dirname(__file__), "cache", "llm_cache.sqlite3"))
+        return TieredLLMCache(memory, SQLiteLLMCache(path, max_entries=max_entries, ttl=ttl))
+    return memory
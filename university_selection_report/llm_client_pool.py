@@ -0,0 +1,162 @@
+"""
+进程内共享的LLM客户端池
+
+- 同一个provider的所有模型实例共享一个httpx连接池(keep-alive, 安装h2时启用HTTP/2), 不必每次重新建立TCP/TLS连接
+- 模型实例按 (名称, 模型, 工厂函数) 缓存, 不同的workflow配置(例如debug开关)复用同一个客户端
+- 同步客户端可在多个线程间共享; 异步客户端为每个事件循环单独维护连接池,
+  stream()在后台线程中用asyncio.run运行新的事件循环时也不会复用其他事件循环的连接
+
+环境变量:
+    LLM_HTTP_MAX_CONNECTIONS: 每个provider的最大连接数, 默认100
+    LLM_HTTP_MAX_KEEPALIVE: 每个provider保持的空闲连接数, 默认20
+    LLM_HTTP_KEEPALIVE_EXPIRY: 空闲连接保持时间(秒), 默认60
+    LLM_HTTP_TIMEOUT: 读写超时(秒), 默认120
+    LLM_HTTP_CONNECT_TIMEOUT: 建立连接超时(秒), 默认10
+    LLM_HTTP2: auto(默认, 安装了h2时启用) / true / false
+"""
+
+import asyncio
+import importlib.util
+import os
+import threading
+import weakref
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import httpx
+
+
+class _LoopLocalAsyncTransport(httpx.AsyncBaseTransport):
+    """按事件循环分别创建连接池的异步transport, 同一个AsyncClient可以在多个事件循环中使用"""
+
+    def __init__(self, factory: Callable[[], httpx.AsyncBaseTransport]):
+        self._factory = factory
+        self._transports: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncBaseTransport]" = \
+            weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _current(self) -> httpx.AsyncBaseTransport:
+        loop = asyncio.get_running_loop()
+        transport = self._transports.get(loop)
+        if transport is None:
+            with self._lock:
+                transport = self._transports.get(loop)
+                if transport is None:
+                    transport = self._transports[loop] = self._factory()
+        return transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._current().handle_async_request(request)
+
+    async def aclose(self) -> None:
+        """关闭当前事件循环的连接池, 其他事件循环结束后其连接池随之释放"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            transport = self._transports.pop(loop, None)
+        if transport is not None:
+            await transport.aclose()
+
+
+class LLMClientPool:
+    """按provider共享HTTP连接池、按名称和模型缓存LLM实例"""
+
+    def __init__(self, max_connections: int = 100, max_keepalive_connections: int = 20,
+                 keepalive_expiry: float = 60.0, timeout: float = 120.0, connect_timeout: float = 10.0,
+                 http2: Optional[bool] = None):
+        """http2: None表示安装了h2时自动启用"""
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_keepalive_connections,
+                                   keepalive_expiry=keepalive_expiry)
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.timeout_seconds = timeout
+        self.http2 = importlib.util.find_spec("h2") is not None if http2 is None else http2
+        self._http_clients: Dict[str, httpx.Client] = {}
+        self._http_async_clients: Dict[str, httpx.AsyncClient] = {}
+        self._models: Dict[Tuple[Hashable, ...], Any] = {}
+        self._lock = threading.Lock()
+        # 工厂函数创建模型时会调用http_client, 模型缓存使用单独的锁
+        self._models_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "LLMClientPool":
+        http2 = os.getenv("LLM_HTTP2", "auto").lower()
+        return cls(
+            max_connections=int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "60")),
+            timeout=float(os.getenv("LLM_HTTP_TIMEOUT", "120")),
+            connect_timeout=float(os.getenv("LLM_HTTP_CONNECT_TIMEOUT", "10")),
+            http2=None if http2 == "auto" else http2 in ("1", "true", "yes"),
+        )
+
+    def http_client(self, provider: str) -> httpx.Client:
+        """provider共享的同步httpx客户端(线程安全)"""
+        client = self._http_clients.get(provider)
+        if client is None:
+            with self._lock:
+                client = self._http_clients.get(provider)
+                if client is None:
+                    client = self._http_clients[provider] = httpx.Client(
+                        transport=httpx.HTTPTransport(limits=self.limits, http2=self.http2),
+                        timeout=self.timeout,
+                    )
+        return client
+
+    def http_async_client(self, provider: str) -> httpx.AsyncClient:
+        """provider共享的异步httpx客户端, 每个事件循环使用各自的连接池"""
+        client = self._http_async_clients.get(provider)
+        if client is None:
+            with self._lock:
+                client = self._http_async_clients.get(provider)
+                if client is None:
+                    transport = _LoopLocalAsyncTransport(
+                        lambda: httpx.AsyncHTTPTransport(limits=self.limits, http2=self.http2))
+                    client = self._http_async_clients[provider] = httpx.AsyncClient(
+                        transport=transport, timeout=self.timeout)
+        return client
+
+    def get(self, name: str, factory: Callable[..., Any], model: Optional[str] = None) -> Any:
+        """
+        返回缓存的LLM实例, 不存在时调用factory创建(指定model时以model=参数传入);
+        同一个名称重新注册了工厂函数时会创建新的实例
+        """
+        key = (name, model, factory)
+        llm = self._models.get(key)
+        if llm is None:
+            with self._models_lock:
+                llm = self._models.get(key)
+                if llm is None:
+                    llm = factory(model=model) if model else factory()
+                    self._models[key] = llm
+        return llm
+
+    def close(self) -> None:
+        """关闭同步连接池并清空缓存的模型实例"""
+        with self._models_lock:
+            self._models.clear()
+        with self._lock:
+            clients = list(self._http_clients.values())
+            self._http_clients.clear()
+        for client in clients:
+            client.close()
+
+    async def aclose(self) -> None:
+        """关闭当前事件循环的异步连接池和所有同步连接池"""
+        for client in list(self._http_async_clients.values()):
+            await client.aclose()
+        with self._lock:
+            self._http_async_clients.clear()
+        self.close()
+
+
+_default_pool: Optional[LLMClientPool] = None
+_default_lock = threading.Lock()
+
+
+def get_default_client_pool() -> LLMClientPool:
+    """进程内共享的客户端池, 第一次调用时按环境变量创建"""
+    global _default_pool
+    if _default_pool is None:
+        with _default_lock:
+            if _default_pool is None:
+                _default_pool = LLMClientPool.from_env()
+    return _default_pool
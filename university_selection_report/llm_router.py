@@ -0,0 +1,309 @@
+"""
+多provider路由: 对冲请求(hedged requests)和故障切换
+
+- 每次调用先发给第一个健康的provider(主provider); 对冲阶段的调用在超过主provider该阶段的p95延迟
+  (或固定的hedge_after)仍未返回时, 再发给下一个健康的provider, 采用先返回的结果, 取消另一个
+- 流式调用以第一个token为准: 先产生token的provider胜出, 另一个立即取消, token不会交错
+- 调用失败(调度器重试之后仍失败)时立即切换到下一个provider
+- 按provider记录健康状态: 连续失败达到阈值后熔断一段时间, 期间路由自动跳过; 冷却后放行调用试探,
+  成功则恢复, 再次失败则继续熔断。所有provider都不健康时仍按顺序尝试
+
+健康状态在进程内共享(见get_default_health_tracker), 各workflow看到的是同一份provider状态。
+
+环境变量:
+    LLM_HEALTH_FAILURE_THRESHOLD: 连续失败多少次后熔断, 默认3
+    LLM_HEALTH_COOLDOWN: 熔断时间(秒), 默认30
+"""
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from langchain_core.language_models import BaseLanguageModel
+
+from report_metrics import ReportMetrics, get_default_metrics
+
+# fill_school_info阶段的两个LLM调用, 占报告p99的大头
+DEFAULT_HEDGE_STAGES = ("school_profile", "school_reasons")
+
+
+class LLMRoute:
+    """可路由的一个LLM: llm_name(可带模型名, 例如 "openai:gpt-4o-mini")和对应的模型实例"""
+
+    def __init__(self, llm_name: str, llm: BaseLanguageModel, model_name: Optional[str] = None):
+        self.llm_name = llm_name
+        self.provider = llm_name.partition(":")[0]
+        self.llm = llm
+        self.model_name = model_name
+
+
+class RouteHealth:
+    """单个LLM的健康状态和按阶段的延迟分布"""
+
+    def __init__(self, failure_threshold: int = 3, cooldown: float = 30.0, window: int = 200):
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._window = window
+        self._lock = threading.Lock()
+
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.open_until
+
+    def observe_latency(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            samples = self._latencies.get(stage)
+            if samples is None:
+                samples = self._latencies[stage] = deque(maxlen=self._window)
+            samples.append(seconds)
+
+    def record_success(self, stage: str, seconds: float) -> None:
+        self.observe_latency(stage, seconds)
+        with self._lock:
+            self.consecutive_failures = 0
+            self.open_until = 0.0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                self.open_until = time.monotonic() + self.cooldown
+
+    def percentile(self, stage: str, q: float, min_samples: int = 20) -> Optional[float]:
+        """该阶段最近延迟的q分位数, 样本不足时返回None"""
+        with self._lock:
+            samples = sorted(self._latencies.get(stage, ()))
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class HealthTracker:
+    """按llm_name保存RouteHealth"""
+
+    def __init__(self, failure_threshold: int = 3, cooldown: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._routes: Dict[str, RouteHealth] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "HealthTracker":
+        return cls(failure_threshold=int(os.getenv("LLM_HEALTH_FAILURE_THRESHOLD", "3")),
+                   cooldown=float(os.getenv("LLM_HEALTH_COOLDOWN", "30")))
+
+    def get(self, llm_name: str) -> RouteHealth:
+        health = self._routes.get(llm_name)
+        if health is None:
+            with self._lock:
+                health = self._routes.get(llm_name)
+                if health is None:
+                    health = self._routes[llm_name] = RouteHealth(self.failure_threshold, self.cooldown)
+        return health
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            name: {"healthy": health.healthy(), "consecutive_failures": health.consecutive_failures}
+            for name, health in list(self._routes.items())
+        }
+
+
+def _consume_exception(task: "asyncio.Task") -> None:
+    # 被放弃的调用在后台结束, 读取其异常避免 "exception was never retrieved" 警告
+    if not task.cancelled():
+        task.exception()
+
+
+class HedgedRouter:
+    """在多个LLM之间路由一次调用: 主LLM超时后对冲, 失败时切换, 跳过熔断中的LLM"""
+
+    def __init__(self, routes: List[LLMRoute], hedge_after: Optional[float] = None, hedge_percentile: float = 0.95,
+                 min_samples: int = 20, health: Optional[HealthTracker] = None,
+                 metrics: Optional[ReportMetrics] = None):
+        """
+        routes: 按优先级排列, 第一个为主LLM
+        hedge_after: 固定的对冲等待秒数; None表示使用主LLM该阶段的hedge_percentile分位延迟,
+                     样本少于min_samples时不对冲(只做故障切换)
+        """
+        if not routes:
+            raise ValueError("HedgedRouter至少需要一个LLM")
+        self.routes = routes
+        self.hedge_after = hedge_after
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.health = health if health is not None else get_default_health_tracker()
+        self.metrics = metrics if metrics is not None else get_default_metrics()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    def candidates(self) -> List[LLMRoute]:
+        """健康的LLM按优先级排列; 全部熔断时返回所有LLM"""
+        healthy = [route for route in self.routes if self.health.get(route.llm_name).healthy()]
+        return healthy or list(self.routes)
+
+    def hedge_delay(self, stage: str, route: LLMRoute) -> Optional[float]:
+        if self.hedge_after is not None:
+            return self.hedge_after
+        return self.health.get(route.llm_name).percentile(stage, self.hedge_percentile, self.min_samples)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-hedge")
+        return self._executor
+
+    def _timed(self, stage: str, route: LLMRoute, fn: Callable[[], Any]) -> Any:
+        health = self.health.get(route.llm_name)
+        started = time.perf_counter()
+        try:
+            result = fn()
+        except Exception:
+            health.record_failure()
+            raise
+        health.record_success(stage, time.perf_counter() - started)
+        return result
+
+    async def _atimed(self, stage: str, route: LLMRoute, fn: Callable[[], Awaitable[Any]]) -> Any:
+        health = self.health.get(route.llm_name)
+        started = time.perf_counter()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            # 被对冲取消的调用至少耗时这么久, 计入延迟分布避免p95被低估
+            health.observe_latency(stage, time.perf_counter() - started)
+            raise
+        except Exception:
+            health.record_failure()
+            raise
+        health.record_success(stage, time.perf_counter() - started)
+        return result
+
+    def invoke(self, stage: str, call: Callable[[LLMRoute], Any], hedge: bool = True) -> Any:
+        """在线程池中执行call(route), 主LLM超过对冲延迟时再发给下一个LLM, 返回先成功的结果"""
+        candidates = self.candidates()
+        primary = candidates[0]
+        if len(candidates) == 1:
+            return self._timed(stage, primary, lambda: call(primary))
+        executor = self._get_executor()
+        pending: Dict[Future, LLMRoute] = {}
+        errors: List[Exception] = []
+
+        def launch(event: str) -> None:
+            route = candidates.pop(0)
+            self.metrics.record_route(stage, route.llm_name, event)
+            # 复制context, 调度优先级在线程池中同样生效
+            future = executor.submit(contextvars.copy_context().run, self._timed, stage, route, lambda: call(route))
+            pending[future] = route
+
+        launch("primary")
+        started = time.perf_counter()
+        delay = self.hedge_delay(stage, primary) if hedge else None
+        while pending:
+            timeout = None
+            if delay is not None and candidates:
+                timeout = max(0.0, delay - (time.perf_counter() - started))
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                delay = None
+                launch("hedge")
+                continue
+            for future in done:
+                route = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                # 未完成的调用无法中断, 在后台结束后丢弃结果
+                self.metrics.record_route(stage, route.llm_name, "win")
+                return result
+            if not pending and candidates:
+                launch("failover")
+        raise errors[-1]
+
+    async def ainvoke(self, stage: str, call: Callable[[LLMRoute, Callable[[], bool]], Awaitable[Any]],
+                      hedge: bool = True) -> Any:
+        """
+        异步版本, call(route, commit): 流式调用在推送第一个token前调用commit(),
+        返回True表示该调用胜出(其他调用随即取消), False表示其他调用已经胜出, 应停止输出
+        """
+        candidates = self.candidates()
+        primary = candidates[0]
+        if len(candidates) == 1:
+            return await self._atimed(stage, primary, lambda: call(primary, lambda: True))
+        tasks: Dict[asyncio.Task, LLMRoute] = {}
+        committed: List[asyncio.Task] = []
+        errors: List[BaseException] = []
+
+        def launch(event: str) -> None:
+            route = candidates.pop(0)
+            self.metrics.record_route(stage, route.llm_name, event)
+            holder: List[asyncio.Task] = []
+
+            def commit() -> bool:
+                if committed:
+                    return committed[0] is holder[0]
+                committed.append(holder[0])
+                for other in tasks:
+                    if other is not holder[0]:
+                        other.cancel()
+                return True
+
+            task = asyncio.ensure_future(self._atimed(stage, route, lambda: call(route, commit)))
+            task.add_done_callback(_consume_exception)
+            holder.append(task)
+            tasks[task] = route
+
+        launch("primary")
+        started = time.perf_counter()
+        delay = self.hedge_delay(stage, primary) if hedge else None
+        try:
+            while tasks:
+                timeout = None
+                if delay is not None and candidates and not committed:
+                    timeout = max(0.0, delay - (time.perf_counter() - started))
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    delay = None
+                    launch("hedge")
+                    continue
+                for task in done:
+                    route = tasks.pop(task)
+                    if task.cancelled():
+                        continue
+                    error = task.exception()
+                    if error is None:
+                        self.metrics.record_route(stage, route.llm_name, "win")
+                        return task.result()
+                    if committed and committed[0] is task:
+                        # 已经推送了token, 不能再切换到其他LLM
+                        raise error
+                    errors.append(error)
+                if not tasks and candidates:
+                    launch("failover")
+        finally:
+            for task in tasks:
+                task.cancel()
+        raise errors[-1]
+
+
+_default_health: Optional[HealthTracker] = None
+_default_lock = threading.Lock()
+
+
+def get_default_health_tracker() -> HealthTracker:
+    """进程内共享的provider健康状态, 第一次调用时按环境变量创建"""
+    global _default_health
+    if _default_health is None:
+        with _default_lock:
+            if _default_health is None:
+                _default_health = HealthTracker.from_env()
+    return _default_health
@@ -0,0 +1,445 @@
+"""
+LLM调用调度器, 位于workflow和LLM_REGISTRY中的provider之间
+
+- 按provider的每分钟请求数(RPM)和每分钟token数(TPM)预算限流, token数用tiktoken估算, 调用完成后按实际用量校正
+- 超出并发上限的调用按优先级排队: 交互式请求(默认)先于批量任务; 预算和429冷却的等待在获取并发槽位之前,
+  限流等待中的调用不占用槽位
+- 并发上限按AIMD调整: 从较小的初始值慢启动(每次成功+1, 直到第一次下降), 之后调用成功时加性增长,
+  遇到429(或延迟明显高于基线)时乘性下降, 同一轮并发中多个调用同时返回429只下降一次
+- 429和临时性错误(超时、连接错误、5xx)按带抖动的指数退避重试, 429时整个provider冷却到Retry-After之后,
+  避免所有调用同时重试形成重试风暴
+
+优先级通过contextvars传递, 例如批量任务:
+    with llm_priority(PRIORITY_BATCH):
+        await workflow.arun(profile)
+
+环境变量:
+    LLM_RATE_LIMITS: 每分钟请求数, 例如 openai=500,gemini=60
+    LLM_TOKEN_LIMITS: 每分钟token数, 例如 openai=200000
+    LLM_MAX_CONCURRENCY: 并发上限的最大值, 例如 openai=32, 未配置的provider为16
+    LLM_MAX_RETRIES: 失败后的最大重试次数, 默认4
+"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from rate_limiter import TokenBucket, parse_rate_limits
+from report_metrics import ReportMetrics, get_default_metrics
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_INITIAL_CONCURRENCY = 4
+DEFAULT_COMPLETION_TOKENS = 512
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("llm_priority", default=PRIORITY_INTERACTIVE)
+
+_RETRYABLE_STATUS = {408, 409, 500, 502, 503, 504, 529}
+_RATE_LIMIT_ERRORS = {"RateLimitError", "ResourceExhausted", "TooManyRequests"}
+_TRANSIENT_ERROR_MARKERS = ("Timeout", "Connection", "ConnectError", "ServiceUnavailable",
+                            "InternalServerError", "DeadlineExceeded", "RemoteProtocolError")
+
+
+@contextmanager
+def llm_priority(priority: int) -> Iterator[None]:
+    """with块内(包括其中创建的asyncio任务)发出的LLM调用使用priority排队, 数值越小越优先"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    """openai/httpx的status_code, google api_core异常的code"""
+    for obj in (exc, getattr(exc, "response", None)):
+        for attr in ("status_code", "code"):
+            code = getattr(obj, attr, None)
+            if isinstance(code, int):
+                return code
+    return None
+
+
+def is_rate_limit_error(exc: BaseException) -> bool:
+    return _status_code(exc) == 429 or type(exc).__name__ in _RATE_LIMIT_ERRORS
+
+
+def is_retryable_error(exc: BaseException) -> bool:
+    """429和临时性错误可以重试; 额度用完(insufficient_quota)时重试也不会成功"""
+    if getattr(exc, "code", None) == "insufficient_quota":
+        return False
+    if is_rate_limit_error(exc) or _status_code(exc) in _RETRYABLE_STATUS:
+        return True
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    name = type(exc).__name__
+    return any(marker in name for marker in _TRANSIENT_ERROR_MARKERS)
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """响应头中的Retry-After(秒)或retry-after-ms"""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        # HTTP日期格式的Retry-After按退避时间处理
+        return None
+    return None
+
+
+class _Waiter:
+    """排队中的调用, 同步调用用Event唤醒, 异步调用用所在事件循环的Future唤醒"""
+
+    __slots__ = ("event", "loop", "future", "granted", "cancelled")
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+        self.event = threading.Event() if loop is None else None
+        self.granted = False
+        self.cancelled = False
+
+    def grant(self) -> None:
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class ProviderState:
+    """单个provider的预算、并发上限和排队状态, 同步和异步调用共用"""
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY, min_concurrency: int = 1,
+                 initial_concurrency: int = DEFAULT_INITIAL_CONCURRENCY, latency_tolerance: float = 2.5):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        # token预算允许10秒的突发, 单个大请求透支后由后续调用顺延等待
+        self.tokens = TokenBucket(tokens_per_minute, capacity=tokens_per_minute / 6) if tokens_per_minute > 0 else None
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.latency_tolerance = latency_tolerance
+        self.limit = float(max(self.min_concurrency, min(initial_concurrency, self.max_concurrency)))
+        self._slow_start = True
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self._last_decrease = 0.0
+        self._recent_latency = 1.0
+        # stage -> [延迟EWMA, 基线], 不同stage的输出长度不同, 分别比较
+        self._latency: Dict[str, List[float]] = {}
+        self._completion_tokens: Dict[str, float] = {}
+        self._waiters: List[Tuple[int, int, _Waiter]] = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def _capacity(self) -> int:
+        return max(self.min_concurrency, int(self.limit))
+
+    def _dispatch(self) -> None:
+        """按优先级唤醒排队的调用, 需持有锁"""
+        while self._waiters and self.in_flight < self._capacity():
+            _, _, waiter = heapq.heappop(self._waiters)
+            if waiter.cancelled:
+                continue
+            self.in_flight += 1
+            waiter.grant()
+
+    def _enqueue(self, priority: int, waiter: _Waiter) -> bool:
+        """有空闲槽位且没有排队的调用时直接占用, 返回True; 否则加入队列"""
+        with self._lock:
+            if not self._waiters and self.in_flight < self._capacity():
+                self.in_flight += 1
+                return True
+            heapq.heappush(self._waiters, (priority, next(self._sequence), waiter))
+            return False
+
+    def acquire(self, priority: int) -> None:
+        waiter = _Waiter()
+        if not self._enqueue(priority, waiter):
+            waiter.event.wait()
+
+    async def aacquire(self, priority: int) -> None:
+        waiter = _Waiter(asyncio.get_running_loop())
+        if self._enqueue(priority, waiter):
+            return
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = waiter.granted
+                waiter.cancelled = True
+            if granted:
+                self.release()
+            raise
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self._dispatch()
+
+    def reserve(self, tokens: int) -> float:
+        """预留一次请求和tokens个token的预算, 返回需要等待的秒数(包括429之后的冷却时间)"""
+        wait = max(0.0, self.cooldown_until - time.monotonic())
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve())
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.reserve(tokens))
+        return wait
+
+    def estimate_tokens(self, stage: str, prompt_tokens: int) -> int:
+        """prompt的token数加上该stage最近的平均输出token数"""
+        return prompt_tokens + int(self._completion_tokens.get(stage, DEFAULT_COMPLETION_TOKENS))
+
+    def on_success(self, stage: str, latency: float, reserved_tokens: int, used_tokens: int,
+                   completion_tokens: int) -> None:
+        if self.tokens is not None:
+            # 按实际用量校正token预算: 多预留的部分退回(不超过桶容量), 少预留的部分补扣
+            if used_tokens < reserved_tokens:
+                self.tokens.refund(reserved_tokens - used_tokens)
+            elif used_tokens > reserved_tokens:
+                self.tokens.reserve(used_tokens - reserved_tokens)
+        with self._lock:
+            previous = self._completion_tokens.get(stage)
+            self._completion_tokens[stage] = completion_tokens if previous is None \
+                else 0.8 * previous + 0.2 * completion_tokens
+            self._recent_latency = 0.8 * self._recent_latency + 0.2 * latency
+            stats = self._latency.setdefault(stage, [latency, latency])
+            stats[0] = 0.8 * stats[0] + 0.2 * latency
+            # 基线缓慢上浮, 持续变慢一段时间后视为新的常态
+            stats[1] = min(stats[0], stats[1] * 1.01)
+            now = time.monotonic()
+            if stats[0] > stats[1] * self.latency_tolerance and self._can_decrease(now):
+                self._decrease(now, 0.9)
+            elif self._slow_start:
+                self.limit = min(self.max_concurrency, self.limit + 1)
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+            self._dispatch()
+
+    def _decrease(self, now: float, factor: float) -> None:
+        self.limit = max(self.min_concurrency, self.limit * factor)
+        self._last_decrease = now
+        self._slow_start = False
+
+    def _can_decrease(self, now: float) -> bool:
+        # 下降后至少间隔一个调用耗时, 这期间返回的429来自下降前发出的调用
+        return now - self._last_decrease >= self._recent_latency
+
+    def on_rate_limited(self, delay: float) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if self._can_decrease(now):
+                self._decrease(now, 0.5)
+            self.cooldown_until = max(self.cooldown_until, now + delay)
+
+    def cooldown_remaining(self) -> float:
+        return max(0.0, self.cooldown_until - time.monotonic())
+
+    def queued(self) -> int:
+        with self._lock:
+            return sum(1 for _, _, waiter in self._waiters if not waiter.cancelled)
+
+
+class LLMScheduler:
+    """按provider调度LLM调用: 预算限流、优先级排队、AIMD并发上限和带抖动的重试"""
+
+    def __init__(self, requests_per_minute: Optional[Dict[str, float]] = None,
+                 tokens_per_minute: Optional[Dict[str, float]] = None,
+                 max_concurrency: Optional[Dict[str, float]] = None,
+                 max_retries: int = 4, base_backoff: float = 0.5, max_backoff: float = 30.0,
+                 metrics: Optional[ReportMetrics] = None):
+        self.requests_per_minute = requests_per_minute or {}
+        self.tokens_per_minute = tokens_per_minute or {}
+        self.max_concurrency = max_concurrency or {}
+        self.max_retries = max(0, max_retries)
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.metrics = metrics or get_default_metrics()
+        self._providers: Dict[str, ProviderState] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, requests_per_minute: Optional[Dict[str, float]] = None) -> "LLMScheduler":
+        """requests_per_minute: 覆盖LLM_RATE_LIMITS的配置"""
+        return cls(
+            requests_per_minute=requests_per_minute or parse_rate_limits(os.getenv("LLM_RATE_LIMITS", "")),
+            tokens_per_minute=parse_rate_limits(os.getenv("LLM_TOKEN_LIMITS", "")),
+            max_concurrency=parse_rate_limits(os.getenv("LLM_MAX_CONCURRENCY", "")),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", "4")),
+        )
+
+    def provider(self, name: str) -> ProviderState:
+        state = self._providers.get(name)
+        if state is None:
+            with self._lock:
+                state = self._providers.get(name)
+                if state is None:
+                    state = self._providers[name] = ProviderState(
+                        requests_per_minute=self.requests_per_minute.get(name, 0),
+                        tokens_per_minute=self.tokens_per_minute.get(name, 0),
+                        max_concurrency=int(self.max_concurrency.get(name, DEFAULT_MAX_CONCURRENCY)),
+                    )
+        return state
+
+    def _backoff(self, attempt: int, exc: BaseException) -> float:
+        """full jitter指数退避, 不小于provider给出的Retry-After"""
+        delay = random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+        return max(delay, retry_after_seconds(exc) or 0.0)
+
+    def _on_error(self, state: ProviderState, exc: Exception, attempt: int, llm_name: str,
+                  can_retry: Optional[Callable[[], bool]]) -> Optional[float]:
+        """记录失败, 返回重试前的等待秒数; 不应重试时返回None"""
+        rate_limited = is_rate_limit_error(exc)
+        delay = self._backoff(attempt, exc)
+        if rate_limited:
+            state.on_rate_limited(delay)
+            self.metrics.set_concurrency_limit(llm_name, state.limit)
+        if attempt >= self.max_retries or not is_retryable_error(exc) or (can_retry is not None and not can_retry()):
+            return None
+        self.metrics.record_llm_retry(llm_name, "rate_limit" if rate_limited else "error")
+        return delay
+
+    def _on_success(self, state: ProviderState, stage: str, llm_name: str, started: float, reserved: int,
+                    prompt_tokens: int, result: Any, model: Optional[str]) -> None:
+        seconds = time.perf_counter() - started
+        completion_tokens = self.metrics.tokens.count(result, model) if isinstance(result, str) else 0
+        state.on_success(stage, seconds, reserved, prompt_tokens + completion_tokens, completion_tokens)
+        self.metrics.set_concurrency_limit(llm_name, state.limit)
+        self.metrics.observe_llm_call(stage, llm_name, seconds, prompt_tokens, completion_tokens)
+
+    def call(self, provider: str, fn: Callable[[], Any], prompt: str = "", stage: str = "llm",
+             llm_name: Optional[str] = None, model: Optional[str] = None,
+             can_retry: Optional[Callable[[], bool]] = None, prompt_tokens: Optional[int] = None) -> Any:
+        """
+        排队并在预算内调用fn(), 失败时按退避重试; 返回fn的结果
+        prompt用于估算token数, 调用方已经计数时传入prompt_tokens, 不再重复编码;
+        can_retry返回False时不再重试(例如流式输出已经产生了token)。成功的调用记录耗时和token数指标
+        """
+        state = self.provider(provider)
+        llm_name = llm_name or provider
+        priority = current_priority()
+        if prompt_tokens is None:
+            prompt_tokens = self.metrics.tokens.count(prompt, model)
+        for attempt in range(self.max_retries + 1):
+            # 先在槽位之外等待RPM/TPM预算和429冷却, 限流等待中的(批量)调用不占用并发槽位
+            reserved = state.estimate_tokens(stage, prompt_tokens)
+            wait = state.reserve(reserved)
+            rate_wait = queue_wait = 0.0
+            while True:
+                if wait > 0:
+                    time.sleep(wait)
+                rate_wait += wait
+                waiting = time.perf_counter()
+                state.acquire(priority)
+                queue_wait += time.perf_counter() - waiting
+                # 排队期间provider开始了429冷却时让出槽位, 冷却结束后重新排队
+                wait = state.cooldown_remaining()
+                if wait <= 0:
+                    break
+                state.release()
+            try:
+                self.metrics.observe_queue_wait(stage, llm_name, rate_wait, "rate_limit")
+                self.metrics.observe_queue_wait(stage, llm_name, queue_wait, "provider_concurrency")
+                started = time.perf_counter()
+                try:
+                    result = fn()
+                except Exception as exc:
+                    delay = self._on_error(state, exc, attempt, llm_name, can_retry)
+                    if delay is None:
+                        raise
+                else:
+                    self._on_success(state, stage, llm_name, started, reserved, prompt_tokens, result, model)
+                    return result
+            finally:
+                state.release()
+            time.sleep(delay)
+
+    async def acall(self, provider: str, fn: Callable[[], Awaitable[Any]], prompt: str = "", stage: str = "llm",
+                    llm_name: Optional[str] = None, model: Optional[str] = None,
+                    can_retry: Optional[Callable[[], bool]] = None, prompt_tokens: Optional[int] = None) -> Any:
+        """call的异步版本, 排队和等待期间不阻塞事件循环"""
+        state = self.provider(provider)
+        llm_name = llm_name or provider
+        priority = current_priority()
+        if prompt_tokens is None:
+            prompt_tokens = self.metrics.tokens.count(prompt, model)
+        for attempt in range(self.max_retries + 1):
+            reserved = state.estimate_tokens(stage, prompt_tokens)
+            wait = state.reserve(reserved)
+            rate_wait = queue_wait = 0.0
+            while True:
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                rate_wait += wait
+                waiting = time.perf_counter()
+                await state.aacquire(priority)
+                queue_wait += time.perf_counter() - waiting
+                wait = state.cooldown_remaining()
+                if wait <= 0:
+                    break
+                state.release()
+            try:
+                self.metrics.observe_queue_wait(stage, llm_name, rate_wait, "rate_limit")
+                self.metrics.observe_queue_wait(stage, llm_name, queue_wait, "provider_concurrency")
+                started = time.perf_counter()
+                try:
+                    result = await fn()
+                except Exception as exc:
+                    delay = self._on_error(state, exc, attempt, llm_name, can_retry)
+                    if delay is None:
+                        raise
+                else:
+                    self._on_success(state, stage, llm_name, started, reserved, prompt_tokens, result, model)
+                    return result
+            finally:
+                state.release()
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """各provider当前的并发上限、进行中的调用数、排队数和冷却时间"""
+        return {
+            name: {
+                "concurrency_limit": round(state.limit, 2),
+                "in_flight": state.in_flight,
+                "queued": state.queued(),
+                "cooldown_seconds": round(state.cooldown_remaining(), 3),
+            }
+            for name, state in list(self._providers.items())
+        }
+
+
+_default_scheduler: Optional[LLMScheduler] = None
+_default_lock = threading.Lock()
+
+
+def get_default_scheduler() -> LLMScheduler:
+    """进程内共享的调度器, 第一次调用时按环境变量创建; 同一provider的预算和并发上限在所有workflow之间共享"""
+    global _default_scheduler
+    if _default_scheduler is None:
+        with _default_lock:
+            if _default_scheduler is None:
+                _default_scheduler = LLMScheduler.from_env()
+    return _default_scheduler
@@ -0,0 +1,431 @@
+"""
+Prompt token预算
+各阶段的prompt渲染前按token预算压缩输入, 渲染后用tiktoken计数; 各阶段的预算和实际token数导出到Prometheus,
+也可以通过langserve_app的 GET /prompt/stats 查看。按输入变量压缩:
+- profile: 结构化字段(GPA、标化和语言成绩)每份profile只提取一次; 超出预算时保留这些字段, 再按相关性
+  (成绩和专业意向、目标学校 > 竞赛、活动、兴趣 > 其他)选取原文的行, 按原顺序输出
+- majors_report: 学校推荐只需要专业名称和简短理由, 超出预算时先压缩为每个专业一行的摘要
+- context: 知识库记录超出预算时只保留与学校通用章节相关的字段(录取、成绩要求、排名、学校介绍等), 过长的值截断
+- 其他文本(schools_report等): 超出预算时按行截断
+默认只计数不压缩, 设置PROMPT_COMPACTION=true后才压缩; 输入在预算以内时原样使用, 默认预算下常见的profile不会被压缩。
+压缩结果只取决于输入和预算, 不影响缓存和检查点命中。
+
+用法:
+    budget = get_default_prompt_budget()
+    inputs = budget.compact("school_reasons", prompt_template, {"school_name": school, "profile": profile}, model)
+    prompt_tokens = budget.measure("school_reasons", prompt_template.format(**inputs), llm_name, model)
+    # 计数结果传给调度器和LLM调用指标, 每个prompt只编码一次
+
+环境变量:
+    PROMPT_BUDGETS: 覆盖各阶段的默认预算(整个prompt的token数), 例如 "recommend_schools=1200,school_reasons=500"
+    PROMPT_COMPACTION: 为true时超出预算的输入在渲染前压缩, 默认false(只计数)
+"""
+
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.prompts import PromptTemplate
+
+from report_metrics import ReportMetrics, TokenCounter, get_default_metrics
+
+# 各阶段渲染后整个prompt的token预算(包括模板本身)
+DEFAULT_STAGE_BUDGETS = {
+    "recommend_majors": 1500,
+    "recommend_schools": 1500,
+    "recommend_schools_structured": 1800,
+    "extract_school_names": 2500,
+    "school_profile": 1500,
+    "school_reasons": 1500,
+}
+
+# 超出预算时各输入按权重分配剩余的token, 小于分配额的输入保持原样, 多出的额度分给其他输入
+_INPUT_WEIGHTS = {"profile": 2, "majors_report": 1, "context": 1, "schools_report": 1}
+# 预算设置得过小时每个输入至少保留的token数
+_MIN_INPUT_TOKENS = 64
+# 专业摘要中每个专业理由的token上限
+_MAJOR_REASON_TOKENS = 48
+_PROFILE_CACHE_SIZE = 256
+
+_INVISIBLE = "\u200b\u200c\u200d\ufeff"
+_FIELD_PATTERNS = (
+    ("GPA", re.compile(r"(?<![A-Za-z])GPA(?![A-Za-z])\D{0,12}?(\d(?:\.\d+)?(?:\s*/\s*\d(?:\.\d+)?)?)")),
+    ("SAT", re.compile(r"(?<![A-Za-z])SAT(?![A-Za-z])\D{0,20}?(\d{3,4})")),
+    ("ACT", re.compile(r"(?<![A-Za-z])ACT(?![A-Za-z])\D{0,20}?(\d{2})(?!\d)")),
+    ("TOEFL", re.compile(r"(?:(?<![A-Za-z])TOEFL(?![A-Za-z])|托福)\D{0,20}?(\d{2,3})(?!\d)", re.IGNORECASE)),
+    ("IELTS", re.compile(r"(?:(?<![A-Za-z])IELTS(?![A-Za-z])|雅思)\D{0,20}?(\d(?:\.\d)?)(?![\d.])", re.IGNORECASE)),
+)
+# profile各行的相关性: 成绩和专业意向、目标学校最重要, 其次是竞赛、活动和兴趣
+_PROFILE_PRIORITIES = (
+    (3, re.compile(r"(?<![A-Za-z])(?:GPA|SAT|ACT|TOEFL|IELTS|Duolingo|AP|IB|A-Level)(?![A-Za-z])|托福|雅思|成绩|分数|排名|专业|目标|申请")),
+    (3, re.compile(r"\b(?:major|target|dream school|apply|applying|intend|rank)", re.IGNORECASE)),
+    (2, re.compile(r"竞赛|比赛|获奖|奖项|研究|实习|项目|志愿|社团|社长|领导|创办|兴趣|感兴趣|喜爱|课程|擅长")),
+    (2, re.compile(r"\b(?:award|prize|olympiad|competition|research|intern|project|volunteer|club|president|"
+                   r"leader|founded|interest|passion|course)", re.IGNORECASE)),
+)
+_PROFILE_HEADING = re.compile(r"^\s*(?:#{1,6}\s+|[一二三四五六七八九十]+[、.．])")
+
+_MD_HEADING = re.compile(r"^\s*#{1,6}\s+(.*)$")
+_MD_BOLD_ITEM = re.compile(r"^\s*(?:\d+[.)、]|[-*+])?\s*\*\*(.+?)\*\*\s*[:：\-–—]?\s*(.*)$")
+_MD_TABLE_ROW = re.compile(r"^\s*\|(.*)\|\s*$")
+_MD_SEPARATOR = re.compile(r"^[\s|:\-]+$")
+_MD_MARKUP = re.compile(r"^\s*(?:\d+[.)、]|[-*+>])\s*|[*_`#]+")
+_LABEL_PREFIX = re.compile(r"^(?:reasons?|why|理由|原因)\s*[:：]\s*", re.IGNORECASE)
+_SENTENCE_END = re.compile(r"(?<=[.!?。！？])\s*")
+# 标题是这些词时不是专业名称(报告标题、"Reasons"小标题等)
+_GENERIC_HEADING = re.compile(r"recommend|report|summary|conclusion|overview|reason|推荐|总结|理由|概述", re.IGNORECASE)
+
+# 学校通用章节需要的知识库字段
+_CONTEXT_TERMS = re.compile(r"admi|accept|rate|gpa|sat|act|toefl|ielts|requir|deadline|applica|enrol|international|"
+                            r"asian|rank|desc|overview|intro|about|location|tuition|cost|major|program|student|"
+                            r"录取|申请|要求|排名|介绍|学费|专业|学生", re.IGNORECASE)
+_NAME_KEY = re.compile(r"name|名称", re.IGNORECASE)
+
+
+def _clean_line(line: str) -> str:
+    return line.strip().strip(_INVISIBLE).strip()
+
+
+def _line_priority(line: str) -> int:
+    return max((priority for priority, pattern in _PROFILE_PRIORITIES if pattern.search(line)), default=1)
+
+
+class ProfileDigest:
+    """一份profile的结构化字段和按相关性打分的各行, 每份profile只解析一次"""
+
+    def __init__(self, profile: str):
+        self.fields: Dict[str, str] = {}
+        for label, pattern in _FIELD_PATTERNS:
+            match = pattern.search(profile)
+            if match is not None:
+                self.fields[label] = match.group(1)
+        # (文本, 相关性, 是否为小节标题, 所属小节)
+        self.lines: List[Tuple[str, int, bool, int]] = []
+        section = -1
+        for line in profile.splitlines():
+            text = _clean_line(line)
+            if not text:
+                continue
+            heading = bool(_PROFILE_HEADING.match(text))
+            if heading:
+                section += 1
+            self.lines.append((text, _line_priority(text), heading, section))
+        # 按 (token上限, 模型) 缓存的压缩结果, 同一份报告的各学校章节共用
+        self.compacted: Dict[Tuple[int, Optional[str]], str] = {}
+
+    def header(self) -> str:
+        if not self.fields:
+            return ""
+        return "Key facts: " + "; ".join(f"{label} {value}" for label, value in self.fields.items())
+
+
+class PromptBudget:
+    """各阶段的prompt token预算: 渲染前压缩输入, 渲染后计数; 进程内共享一份(见get_default_prompt_budget)"""
+
+    def __init__(self, budgets: Optional[Dict[str, int]] = None, compaction: bool = False,
+                 metrics: Optional[ReportMetrics] = None):
+        self.budgets = {**DEFAULT_STAGE_BUDGETS, **(budgets or {})}
+        self.compaction = compaction
+        self.metrics = metrics if metrics is not None else get_default_metrics()
+        self.tokens = self.metrics.tokens
+        self._digests: "OrderedDict[str, ProfileDigest]" = OrderedDict()
+        self._overheads: Dict[Tuple[str, str, Optional[str]], int] = {}
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        for stage, tokens in self.budgets.items():
+            self.metrics.set_prompt_budget(stage, tokens)
+
+    @classmethod
+    def from_env(cls, metrics: Optional[ReportMetrics] = None) -> "PromptBudget":
+        budgets = {}
+        for item in os.getenv("PROMPT_BUDGETS", "").split(","):
+            stage, _, tokens = item.partition("=")
+            if stage.strip() and tokens.strip():
+                budgets[stage.strip()] = int(tokens)
+        compaction = os.getenv("PROMPT_COMPACTION", "false").lower() in ("1", "true", "yes")
+        return cls(budgets, compaction, metrics)
+
+    def count(self, text: str, model: Optional[str] = None) -> int:
+        return self.tokens.count(text, model)
+
+    def digest(self, profile: str) -> ProfileDigest:
+        """profile的结构化字段, 同一份profile在各阶段和各学校之间共用一次解析结果"""
+        key = hashlib.sha256(profile.encode("utf-8")).hexdigest()
+        with self._lock:
+            digest = self._digests.get(key)
+            if digest is not None:
+                self._digests.move_to_end(key)
+                return digest
+        digest = ProfileDigest(profile)
+        with self._lock:
+            self._digests[key] = digest
+            while len(self._digests) > _PROFILE_CACHE_SIZE:
+                self._digests.popitem(last=False)
+        return digest
+
+    def _overhead(self, stage: str, template: PromptTemplate, model: Optional[str]) -> int:
+        """模板本身(输入为空时)的token数"""
+        key = (stage, template.template, model)
+        if key not in self._overheads:
+            self._overheads[key] = self.count(template.format(**{name: "" for name in template.input_variables}), model)
+        return self._overheads[key]
+
+    def _size(self, value: Any, model: Optional[str]) -> int:
+        # 知识库记录等dict在模板中按str()渲染
+        return self.count(value if isinstance(value, str) else str(value), model)
+
+    def compact(self, stage: str, template: PromptTemplate, inputs: Dict[str, Any],
+                model: Optional[str] = None) -> Dict[str, Any]:
+        """按stage的预算压缩inputs中可以压缩的输入, 返回新的inputs; 没有该阶段的预算或关闭压缩时原样返回"""
+        budget = self.budgets.get(stage)
+        if not self.compaction or budget is None:
+            return inputs
+        compacted = dict(inputs)
+        sizes = {name: self._size(value, model) for name, value in inputs.items() if name in _INPUT_WEIGHTS}
+        original = dict(sizes)
+        fixed = sum(self._size(value, model) for name, value in inputs.items() if name not in _INPUT_WEIGHTS)
+        allowance = budget - self._overhead(stage, template, model) - fixed
+        if sum(sizes.values()) > allowance and "majors_report" in compacted:
+            # 超出预算时专业推荐报告先压缩为摘要, 仍然超出时再按权重分配
+            summary = summarize_majors(compacted["majors_report"], self.tokens, model)
+            if summary is not None:
+                summary_size = self._size(summary, model)
+                if summary_size < sizes["majors_report"]:
+                    compacted["majors_report"] = summary
+                    sizes["majors_report"] = summary_size
+        if sum(sizes.values()) > allowance:
+            for name, limit in self._allocate(sizes, allowance).items():
+                if sizes[name] > limit:
+                    compacted[name] = self._compact_input(name, compacted[name], limit, model)
+                    sizes[name] = self._size(compacted[name], model)
+        for name, size in sizes.items():
+            if size < original[name]:
+                self._record_compaction(stage, name, original[name] - size)
+        return compacted
+
+    @staticmethod
+    def _allocate(sizes: Dict[str, int], allowance: int) -> Dict[str, int]:
+        """按权重分配allowance: 从相对最小的输入开始, 不超过自身大小, 剩余额度留给后面的输入"""
+        limits = {}
+        remaining = allowance
+        weight_left = sum(_INPUT_WEIGHTS[name] for name in sizes)
+        for name in sorted(sizes, key=lambda name: sizes[name] / _INPUT_WEIGHTS[name]):
+            share = remaining * _INPUT_WEIGHTS[name] // weight_left if remaining > 0 else 0
+            limits[name] = min(sizes[name], max(share, _MIN_INPUT_TOKENS))
+            remaining -= limits[name]
+            weight_left -= _INPUT_WEIGHTS[name]
+        return limits
+
+    def _compact_input(self, name: str, value: Any, max_tokens: int, model: Optional[str]) -> Any:
+        if name == "profile":
+            digest = self.digest(value)
+            key = (max_tokens, model)
+            if key not in digest.compacted:
+                digest.compacted[key] = compact_profile(digest, max_tokens, self.tokens, model)
+            return digest.compacted[key]
+        if name == "context" and isinstance(value, dict):
+            return select_context(value, max_tokens, self.tokens, model)
+        return fit_lines(value if isinstance(value, str) else str(value), max_tokens, self.tokens, model)
+
+    def _stage_stats(self, stage: str) -> Dict[str, Any]:
+        if stage not in self._stats:
+            self._stats[stage] = {"prompts": 0, "tokens": 0, "max_tokens": 0, "over_budget": 0,
+                                  "compactions": {}, "tokens_saved": 0}
+        return self._stats[stage]
+
+    def _record_compaction(self, stage: str, name: str, saved: int) -> None:
+        with self._lock:
+            stats = self._stage_stats(stage)
+            stats["compactions"][name] = stats["compactions"].get(name, 0) + 1
+            stats["tokens_saved"] += saved
+        self.metrics.record_prompt_compaction(stage, name, saved)
+
+    def measure(self, stage: str, prompt: str, llm_name: str, model: Optional[str] = None) -> int:
+        """统计渲染好的prompt的token数, 返回token数"""
+        tokens = self.count(prompt, model)
+        budget = self.budgets.get(stage)
+        with self._lock:
+            stats = self._stage_stats(stage)
+            stats["prompts"] += 1
+            stats["tokens"] += tokens
+            stats["max_tokens"] = max(stats["max_tokens"], tokens)
+            if budget is not None and tokens > budget:
+                stats["over_budget"] += 1
+        self.metrics.observe_prompt(stage, llm_name, tokens)
+        return tokens
+
+    def stats(self) -> Dict[str, Any]:
+        """各阶段的预算、prompt数、平均和最大token数、超出预算的次数和压缩节省的token数"""
+        with self._lock:
+            stages = {}
+            for stage in sorted(set(self.budgets) | set(self._stats)):
+                stats = dict(self._stage_stats(stage))
+                stats["compactions"] = dict(stats["compactions"])
+                total = stats.pop("tokens")
+                stats["mean_tokens"] = round(total / stats["prompts"], 1) if stats["prompts"] else None
+                stages[stage] = {"budget": self.budgets.get(stage), **stats}
+            return {"compaction": self.compaction, "stages": stages}
+
+
+def compact_profile(digest: ProfileDigest, max_tokens: int, tokens: TokenCounter, model: Optional[str] = None) -> str:
+    """
+    结构化字段放在第一行, 再按相关性(相同时按原顺序)选取能放进预算的行, 保留选中行所在小节的标题;
+    输出按原顺序排列, 放不下的高相关性行截断后保留
+    """
+    header = digest.header()
+    remaining = max_tokens - (tokens.count(header, model) + 1 if header else 0)
+    kept: Dict[int, str] = {}
+    body = [i for i, line in enumerate(digest.lines) if not line[2]]
+    for i in sorted(body, key=lambda i: (-digest.lines[i][1], i)):
+        text = digest.lines[i][0]
+        cost = tokens.count(text, model) + 1
+        if cost <= remaining:
+            kept[i] = text
+            remaining -= cost
+        elif digest.lines[i][1] > 1 and remaining > _MIN_INPUT_TOKENS // 2:
+            kept[i] = tokens.truncate(text, remaining - 1, model)
+            remaining = 0
+    sections = {digest.lines[i][3] for i in kept}
+    for i, (text, _, heading, section) in enumerate(digest.lines):
+        if heading and section in sections:
+            cost = tokens.count(text, model) + 1
+            if cost <= remaining:
+                kept[i] = text
+                remaining -= cost
+    lines = ([header] if header else []) + [kept[i] for i in sorted(kept)]
+    result = "\n".join(lines)
+    # 按行累加的token数只是近似值, 最后再按整体截断一次
+    return tokens.truncate(result, max_tokens, model)
+
+
+def _first_sentence(text: str, tokens: TokenCounter, model: Optional[str]) -> str:
+    sentence = _SENTENCE_END.split(text, maxsplit=1)[0].strip()
+    return tokens.truncate(sentence, _MAJOR_REASON_TOKENS, model)
+
+
+def summarize_majors(majors_report: str, tokens: TokenCounter, model: Optional[str] = None) -> Optional[str]:
+    """
+    专业推荐报告压缩为 "- 专业: 第一句理由" 的列表; 专业名称取自标题、加粗的列表项或表格第一列。
+    找不到专业名称时返回None
+    """
+    entries: "OrderedDict[str, str]" = OrderedDict()
+    current: Optional[str] = None
+    in_table = False
+    for line in majors_report.splitlines():
+        if not line.strip():
+            continue
+        row = _MD_TABLE_ROW.match(line)
+        if row is not None:
+            cells = [_MD_MARKUP.sub("", cell).strip() for cell in row.group(1).split("|")]
+            # 表格第一行是表头
+            if not in_table or _MD_SEPARATOR.match(line):
+                in_table = True
+                continue
+            if cells[0] and cells[0] not in entries:
+                entries[cells[0]] = _first_sentence(cells[1], tokens, model) if len(cells) > 1 else ""
+            current = None
+            continue
+        in_table = False
+        heading = _MD_HEADING.match(line)
+        item = _MD_BOLD_ITEM.match(line) if heading is None else None
+        if heading is not None or item is not None:
+            name = _MD_MARKUP.sub("", (heading or item).group(1)).strip().rstrip(":：")
+            name = re.sub(r"^\d+[.)、]\s*", "", name)
+            if name and not _GENERIC_HEADING.search(name):
+                current = name
+                entries.setdefault(name, "")
+                if item is not None and item.group(2).strip():
+                    entries[name] = entries[name] or _first_sentence(_MD_MARKUP.sub("", item.group(2)), tokens, model)
+            continue
+        # 专业标题后的第一句正文作为理由
+        if current is not None and not entries[current]:
+            text = _LABEL_PREFIX.sub("", _MD_MARKUP.sub("", line).strip())
+            if text:
+                entries[current] = _first_sentence(text, tokens, model)
+    if not entries:
+        return None
+    return "\n".join(f"- {name}: {reason}" if reason else f"- {name}" for name, reason in entries.items())
+
+
+def _shrink_value(value: Any, max_tokens: int, tokens: TokenCounter, model: Optional[str]) -> Any:
+    """字段值截断到max_tokens左右: 字符串截断, 列表和dict保留前面能放下的元素"""
+    if isinstance(value, str):
+        return tokens.truncate(value, max_tokens, model)
+    if isinstance(value, (list, tuple)):
+        kept = []
+        for item in value:
+            if tokens.count(str(kept + [item]), model) > max_tokens:
+                break
+            kept.append(item)
+        return kept
+    if isinstance(value, dict):
+        kept_dict = {}
+        for key, item in value.items():
+            if tokens.count(str({**kept_dict, key: item}), model) > max_tokens:
+                break
+            kept_dict[key] = item
+        return kept_dict
+    return value
+
+
+def select_context(context: Dict[str, Any], max_tokens: int, tokens: TokenCounter, model: Optional[str] = None) -> Dict[str, Any]:
+    """
+    知识库记录超出预算时只保留相关字段: 名称字段最先, 其次是与录取、成绩要求、排名、学校介绍等相关的字段,
+    单个字段最多占预算的1/4; 空字段去掉, 保留的字段按原顺序排列
+    """
+    if tokens.count(str(context), model) <= max_tokens:
+        return context
+    items = [(key, value) for key, value in context.items() if value not in (None, "", [], {})]
+    order = sorted(range(len(items)), key=lambda i: (not _NAME_KEY.search(str(items[i][0])),
+                                                     not _CONTEXT_TERMS.search(str(items[i][0])), i))
+    field_tokens = max(_MIN_INPUT_TOKENS, max_tokens // 4)
+    remaining = max_tokens - 2
+    selected: Dict[int, Tuple[str, Any]] = {}
+    for i in order:
+        key, value = items[i]
+        value = _shrink_value(value, field_tokens, tokens, model)
+        cost = tokens.count(str({key: value}), model)
+        if cost <= remaining:
+            selected[i] = (key, value)
+            remaining -= cost
+    result = {key: value for _, (key, value) in sorted(selected.items())}
+    # 逐个字段累加的token数只是近似值, 整体超出时按相关性从低到高去掉字段
+    for i in reversed([i for i in order if i in selected][1:]):
+        if tokens.count(str(result), model) <= max_tokens:
+            break
+        result.pop(selected[i][0])
+    return result
+
+
+def fit_lines(text: str, max_tokens: int, tokens: TokenCounter, model: Optional[str] = None) -> str:
+    """保留开头能放进预算的整行, 下一行截断后补上"""
+    if tokens.count(text, model) <= max_tokens:
+        return text
+    kept = []
+    remaining = max_tokens
+    for line in text.splitlines():
+        cost = tokens.count(line, model) + 1
+        if cost > remaining:
+            if remaining > 1:
+                kept.append(tokens.truncate(line, remaining - 1, model))
+            break
+        kept.append(line)
+        remaining -= cost
+    return tokens.truncate("\n".join(kept), max_tokens, model)
+
+
+_default_budget: Optional[PromptBudget] = None
+_default_budget_lock = threading.Lock()
+
+
+def get_default_prompt_budget() -> PromptBudget:
+    """进程内共享的prompt预算, 按环境变量配置"""
+    global _default_budget
+    if _default_budget is None:
+        with _default_budget_lock:
+            if _default_budget is None:
+                _default_budget = PromptBudget.from_env()
+    return _default_budget
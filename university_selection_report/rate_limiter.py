@@ -0,0 +1,49 @@
+"""
+限流的基础组件
+令牌桶和 "openai=60,gemini=30" 格式的配置解析，LLMScheduler用它们实现按provider的请求数和token数预算。
+"""
+
+import threading
+import time
+from typing import Dict, Optional
+
+
+class TokenBucket:
+    """令牌桶，rate_per_minute为每分钟补充的令牌数，capacity为允许的突发量"""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float = 1.0) -> float:
+        """预留amount个令牌，返回需要等待的秒数；令牌不足时允许透支，后续调用顺延等待"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def refund(self, amount: float) -> None:
+        """退回多预留的令牌，退回后不超过capacity"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate + amount)
+            self.updated = now
+
+
+def parse_rate_limits(spec: str) -> Dict[str, float]:
+    """解析 "openai=60,gemini=30" 格式的按provider配置(每分钟请求数、token数等)"""
+    limits = {}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        provider, _, value = item.partition("=")
+        limits[provider.strip()] = float(value)
+    return limits
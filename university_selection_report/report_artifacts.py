@@ -0,0 +1,134 @@
+"""
+报告文件存储
+报告按内容哈希(与report_renderer的report_id相同)保存到 <root>/reports 下:
+- <report_id>.md: run()返回的报告内容
+- <report_id>.html: 服务端渲染好的独立HTML(内联样式), 不依赖marked.js等前端库
+文件先写入同目录的临时文件再os.replace, 并发生成报告时不会互相覆盖, 读者也不会看到写了一半的文件;
+内容相同的报告只写一次。
+
+环境变量:
+    REPORT_ARTIFACT_DIR: 默认存储的根目录, 默认为本目录下的output
+"""
+
+import gzip
+import os
+import re
+import tempfile
+import threading
+from typing import Dict, Optional
+
+from report_renderer import markdown_to_html, report_id_for
+
+DEFAULT_ARTIFACT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "output")
+
+_REPORT_ID = re.compile(r"^[0-9a-f]{32}$")
+_MEDIA_TYPES = {".md": "text/markdown; charset=utf-8", ".html": "text/html; charset=utf-8"}
+
+
+def atomic_write(path: str, data: bytes) -> bool:
+    """写入同目录的临时文件后os.replace; 文件已存在时不写(内容由文件名的哈希决定), 返回是否写入"""
+    if os.path.exists(path):
+        return False
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    return True
+
+
+class ArtifactStore:
+    """按内容哈希保存报告的目录, 多个workflow和进程可以共用"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.reports_dir = os.path.join(root, "reports")
+        self.saved = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.reports_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> "ArtifactStore":
+        return cls(os.getenv("REPORT_ARTIFACT_DIR") or DEFAULT_ARTIFACT_DIR)
+
+    def path(self, report_id: str, suffix: str = ".html") -> Optional[str]:
+        """报告文件路径; report_id不是内容哈希或后缀不支持时返回None"""
+        if not _REPORT_ID.match(report_id) or suffix not in _MEDIA_TYPES:
+            return None
+        return os.path.join(self.reports_dir, report_id + suffix)
+
+    def save_report(self, document: str) -> str:
+        """保存报告的markdown和渲染好的HTML, 返回report_id; 同一份报告已保存过时不重复渲染和写入"""
+        report_id = report_id_for(document)
+        md_path = self.path(report_id, ".md")
+        # markdown最后写入, 它存在即表示两个文件都已完整保存
+        if os.path.exists(md_path):
+            with self._lock:
+                self.skipped += 1
+            return report_id
+        atomic_write(self.path(report_id, ".html"), markdown_to_html(document).encode("utf-8"))
+        atomic_write(md_path, document.encode("utf-8"))
+        with self._lock:
+            self.saved += 1
+        return report_id
+
+    def read(self, report_id: str, suffix: str = ".html") -> Optional[bytes]:
+        path = self.path(report_id, suffix)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def read_gzipped(self, report_id: str, suffix: str = ".html") -> Optional[bytes]:
+        """gzip压缩后的报告文件, 第一次请求时压缩并保存为 .gz, 之后直接读取"""
+        path = self.path(report_id, suffix)
+        if path is None:
+            return None
+        try:
+            with open(path + ".gz", "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+        content = self.read(report_id, suffix)
+        if content is None:
+            return None
+        compressed = gzip.compress(content, compresslevel=9, mtime=0)
+        atomic_write(path + ".gz", compressed)
+        return compressed
+
+    def get_report(self, report_id: str) -> Optional[str]:
+        """按report_id读取已保存的markdown报告"""
+        content = self.read(report_id, ".md")
+        return content.decode("utf-8") if content is not None else None
+
+    @staticmethod
+    def media_type(suffix: str) -> str:
+        return _MEDIA_TYPES[suffix]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"saved": self.saved, "skipped": self.skipped}
+
+
+_default_store: Optional[ArtifactStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_default_artifact_store() -> ArtifactStore:
+    """进程内共享的报告文件存储, 按环境变量配置"""
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                _default_store = ArtifactStore.from_env()
+    return _default_store
@@ -0,0 +1,168 @@
+"""
+报告阶段检查点
+专业推荐、学校推荐、学校名称提取和每所学校的章节按各自的实际输入(上游章节内容、学生profile、
+学校信息、prompt模板、模型和locale)计算内容哈希保存。重新生成报告时只有输入发生变化的阶段才会调用LLM,
+例如只修改了学校推荐表时只需要生成新学校的章节。
+
+还可以显式指定需要重新生成的章节, 例如只重新生成冲刺校的章节:
+    workflow.run(profile, regenerate=["reach"])
+或者用修改过的章节内容替换对应阶段, 例如顾问修改了学校推荐表:
+    workflow.run(profile, overrides={"recommend_schools": edited_table})
+重新生成的章节同时跳过LLM响应缓存, 结果覆盖原来的检查点; 依赖它的下游章节因输入变化自动重新生成。
+重新生成的学校章节同时重新生成该学校的通用章节(SchoolSectionStore), 新内容由之后所有学生的报告共用。
+
+环境变量:
+    REPORT_CHECKPOINT_BACKEND: memory(默认) / sqlite / none
+    REPORT_CHECKPOINT_PATH: SQLite文件路径, 默认checkpoints/report_checkpoints.sqlite3
+    REPORT_CHECKPOINT_MAX_ENTRIES: 最大条目数, 默认10000
+"""
+
+import contextvars
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+
+from llm_cache import InMemoryLRUCache, LLMCache, SQLiteLLMCache, TieredLLMCache
+
+# 检查点内容的格式或章节拼接方式有变化时请增加版本号, 旧的检查点自动失效
+CHECKPOINT_VERSION = 2
+
+# 学校推荐表按保底校、匹配校、冲刺校的顺序排列, 可以用这些名称指定需要重新生成的学校章节
+SCHOOL_TIERS = ("safety", "target", "reach")
+
+
+def make_checkpoint_key(stage: str, inputs: Dict[str, Any], llm_name: str, model_params: Dict[str, Any],
+                        locale: str, templates: Iterable[str]) -> str:
+    """根据阶段名称、阶段输入、模型和prompt模板生成检查点key"""
+    payload = json.dumps(
+        {
+            "stage": stage,
+            "inputs": inputs,
+            "llm_name": llm_name,
+            "model_params": model_params,
+            "locale": locale,
+            "templates": list(templates),
+            "version": CHECKPOINT_VERSION,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ReportCheckpointStore:
+    """阶段检查点存储, 复用LLM缓存的内存LRU/SQLite后端, 内容以JSON保存"""
+
+    def __init__(self, backend: Optional[LLMCache] = None):
+        self.backend = backend if backend is not None else InMemoryLRUCache(max_entries=10000)
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.backend.get(key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key: str, value: Any) -> None:
+        self.backend.set(key, json.dumps(value, ensure_ascii=False))
+
+    def stats(self) -> Dict[str, Any]:
+        return self.backend.stats()
+
+
+def build_checkpoint_store_from_env() -> Optional[ReportCheckpointStore]:
+    """根据环境变量创建检查点存储, REPORT_CHECKPOINT_BACKEND=none时返回None(不保存检查点)"""
+    backend = os.getenv("REPORT_CHECKPOINT_BACKEND", "memory").lower()
+    if backend == "none":
+        return None
+    max_entries = int(os.getenv("REPORT_CHECKPOINT_MAX_ENTRIES", "10000"))
+    memory = InMemoryLRUCache(max_entries=max_entries)
+    if backend == "sqlite":
+        path = os.getenv("REPORT_CHECKPOINT_PATH",
+                         os.path.join(os.path.dirname(__file__), "checkpoints", "report_checkpoints.sqlite3"))
+        return ReportCheckpointStore(TieredLLMCache(memory, SQLiteLLMCache(path, max_entries=max_entries)))
+    return ReportCheckpointStore(memory)
+
+
+class ReportOverrides(BaseModel):
+    """可以直接给定内容的阶段及其类型, 其他阶段或类型不符时校验失败(HTTP接口返回422)"""
+
+    model_config = ConfigDict(extra="forbid")
+
+    recommend_majors: Optional[str] = Field(default=None, min_length=1, description="专业推荐章节(markdown)")
+    recommend_schools: Optional[str] = Field(default=None, min_length=1, description="学校推荐表(markdown)")
+    extract_school_names: Optional[List[str]] = Field(default=None, min_length=1, description="学校名单")
+
+    @field_validator("extract_school_names")
+    @classmethod
+    def _school_names(cls, value: Optional[List[str]]) -> Optional[List[str]]:
+        if value is None:
+            return None
+        names = [name.strip() for name in value]
+        if not all(names):
+            raise ValueError("学校名称不能为空")
+        return names
+
+
+def validate_overrides(overrides: Union[ReportOverrides, Dict[str, Any], None]) -> Dict[str, Any]:
+    """校验overrides并转换为 阶段名称 -> 内容, 形状不符时抛出pydantic.ValidationError(ValueError的子类)"""
+    if not overrides:
+        return {}
+    return ReportOverrides.model_validate(overrides).model_dump(exclude_none=True)
+
+
+class RegenerationPlan:
+    """
+    一次报告生成中需要重新生成的章节和直接给定内容的章节
+    regenerate: 阶段名称(recommend_majors、recommend_schools、extract_school_names、fill_school_info),
+                学校名称或safety/target/reach, 也可以写成 "fill_school_info:Reach University" / "fill_school_info:reach"
+    overrides: 阶段名称 -> 章节内容, 例如顾问修改过的学校推荐表 {"recommend_schools": "..."},
+               或直接指定学校列表 {"extract_school_names": [...]}; 给定的内容不写入检查点, 按ReportOverrides校验
+    """
+
+    def __init__(self, regenerate: Iterable[str] = (),
+                 overrides: Union[ReportOverrides, Dict[str, Any], None] = None):
+        self.targets = frozenset(target.strip().casefold() for target in regenerate)
+        self.overrides = validate_overrides(overrides)
+
+    def forces(self, stage: str, *aliases: str) -> bool:
+        """该阶段(或按学校名称、学校类别指定的学校章节)是否需要重新生成"""
+        names = [stage] + [alias for alias in aliases if alias]
+        names += [f"{stage}:{alias}" for alias in aliases if alias]
+        return any(name.casefold() in self.targets for name in names)
+
+
+_plan: contextvars.ContextVar[RegenerationPlan] = contextvars.ContextVar("regeneration_plan",
+                                                                         default=RegenerationPlan())
+_bypass_llm_cache: contextvars.ContextVar[bool] = contextvars.ContextVar("bypass_llm_cache", default=False)
+
+
+@contextmanager
+def regeneration(regenerate: Iterable[str] = (),
+                 overrides: Union[ReportOverrides, Dict[str, Any], None] = None) -> Iterator[None]:
+    """with块内(包括其中创建的线程任务和asyncio任务)生成的报告按RegenerationPlan重新生成或替换章节"""
+    token = _plan.set(RegenerationPlan(regenerate, overrides))
+    try:
+        yield
+    finally:
+        _plan.reset(token)
+
+
+def current_plan() -> RegenerationPlan:
+    return _plan.get()
+
+
+@contextmanager
+def bypass_llm_cache() -> Iterator[None]:
+    """重新生成章节时跳过LLM响应缓存的读取, 新结果照常写入缓存"""
+    token = _bypass_llm_cache.set(True)
+    try:
+        yield
+    finally:
+        _bypass_llm_cache.reset(token)
+
+
+def llm_cache_bypassed() -> bool:
+    return _bypass_llm_cache.get()
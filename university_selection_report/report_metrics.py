@@ -0,0 +1,218 @@
+"""
+选校报告的Prometheus指标
+
+按阶段(stage)和llm_name统计, llm_name标签只记录provider("openai:gpt-4o-mini"记为openai), 标签值的数量不随模型名称增长:
+- report_stage_duration_seconds: 各阶段耗时(专业推荐、学校推荐、名称提取、每所学校的信息填充、报告拼接、HTML/PDF渲染)
+- report_stage_queue_wait_seconds: 阶段开始前的排队时间(学校并发槽位、provider限流)
+- report_llm_call_duration_seconds: 实际发出的LLM调用耗时(缓存命中不计)
+- report_llm_tokens: 每次LLM调用的prompt/completion token数(tiktoken计数)
+- report_cache_requests_total: LLM响应缓存和学校通用章节的命中/未命中次数
+- report_llm_retries_total: 调度器重试LLM调用的次数(429限流 / 临时性错误)
+- report_llm_concurrency_limit: 调度器按AIMD调整后的当前并发上限
+- report_llm_routes_total: 多provider路由的调用次数(primary/hedge/failover)和胜出次数(win)
+- report_prompt_tokens: 每个渲染好的prompt的token数(包括缓存命中), report_prompt_budget_tokens为各阶段的预算
+- report_prompt_tokens_saved_total: 按预算压缩各阶段输入(profile、专业推荐、知识库字段等)节省的token数
+
+未安装prometheus-client时所有记录操作为空操作。
+多进程部署(uvicorn --workers)时设置PROMETHEUS_MULTIPROC_DIR, /metrics汇总所有worker的指标。
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+except ImportError:
+    REGISTRY = None
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+
+def _llm_label(llm_name: str) -> str:
+    """llm_name标签的值: 去掉 "provider:model" 中的模型名称"""
+    return llm_name.partition(":")[0]
+
+
+class TokenCounter:
+    """用tiktoken统计token数, 按模型名称缓存编码; 编码不可用(例如离线无法下载)时按4个字符一个token估算"""
+
+    def __init__(self, default_encoding: str = "cl100k_base"):
+        self.default_encoding = default_encoding
+        self._encodings: Dict[str, Any] = {}
+        # 模型没有对应编码时回退到默认编码, 会在持锁时再次获取
+        self._lock = threading.RLock()
+
+    def _get_encoding(self, model: Optional[str]):
+        key = model or ""
+        if key not in self._encodings:
+            with self._lock:
+                if key not in self._encodings:
+                    self._encodings[key] = self._load_encoding(model)
+        return self._encodings[key]
+
+    def _load_encoding(self, model: Optional[str]):
+        try:
+            import tiktoken
+        except ImportError:
+            return None
+        try:
+            return tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding(self.default_encoding)
+        except KeyError:
+            # 非OpenAI模型(例如gemini)使用默认编码近似
+            return self._get_encoding(None) if model else None
+        except Exception:
+            return None
+
+    def count(self, text: str, model: Optional[str] = None) -> int:
+        if not text:
+            return 0
+        encoding = self._get_encoding(model)
+        if encoding is None:
+            return max(1, len(text) // 4)
+        return len(encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int, model: Optional[str] = None) -> str:
+        """截取text的前max_tokens个token"""
+        if max_tokens <= 0:
+            return ""
+        encoding = self._get_encoding(model)
+        if encoding is None:
+            return text[:max_tokens * 4]
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        # 截断处可能落在多字节字符中间, 去掉不完整的字符
+        return encoding.decode(tokens[:max_tokens]).rstrip("\ufffd")
+
+
+class ReportMetrics:
+    """报告生成的各阶段指标, 进程内共享一份(见get_default_metrics)"""
+
+    def __init__(self, registry: Any = None):
+        """registry: prometheus的CollectorRegistry, 默认使用全局REGISTRY"""
+        self.tokens = TokenCounter()
+        self.enabled = REGISTRY is not None
+        if not self.enabled:
+            return
+        self.registry = registry if registry is not None else REGISTRY
+        self.stage_duration = Histogram(
+            "report_stage_duration_seconds", "报告各阶段耗时",
+            ["stage", "llm_name"], buckets=DURATION_BUCKETS, registry=self.registry)
+        self.queue_wait = Histogram(
+            "report_stage_queue_wait_seconds", "阶段开始前的排队时间(并发槽位/限流)",
+            ["stage", "llm_name", "queue"], buckets=DURATION_BUCKETS, registry=self.registry)
+        self.llm_call_duration = Histogram(
+            "report_llm_call_duration_seconds", "实际发出的LLM调用耗时",
+            ["stage", "llm_name"], buckets=DURATION_BUCKETS, registry=self.registry)
+        self.llm_tokens = Histogram(
+            "report_llm_tokens", "每次LLM调用的token数",
+            ["stage", "llm_name", "kind"], buckets=TOKEN_BUCKETS, registry=self.registry)
+        self.cache_requests = Counter(
+            "report_cache_requests_total", "缓存命中/未命中次数",
+            ["cache", "stage", "llm_name", "result"], registry=self.registry)
+        self.llm_retries = Counter(
+            "report_llm_retries_total", "调度器重试LLM调用的次数",
+            ["llm_name", "reason"], registry=self.registry)
+        self.concurrency_limit = Gauge(
+            "report_llm_concurrency_limit", "调度器当前的并发上限",
+            ["llm_name"], multiprocess_mode="livesum", registry=self.registry)
+        self.routes = Counter(
+            "report_llm_routes_total", "多provider路由: 发出(primary/hedge/failover)和胜出(win)的调用次数",
+            ["stage", "llm_name", "event"], registry=self.registry)
+        self.prompt_tokens = Histogram(
+            "report_prompt_tokens", "每个渲染好的prompt的token数",
+            ["stage", "llm_name"], buckets=TOKEN_BUCKETS, registry=self.registry)
+        self.prompt_budget = Gauge(
+            "report_prompt_budget_tokens", "各阶段prompt的token预算",
+            ["stage"], multiprocess_mode="max", registry=self.registry)
+        self.prompt_tokens_saved = Counter(
+            "report_prompt_tokens_saved_total", "按预算压缩阶段输入节省的token数",
+            ["stage", "input"], registry=self.registry)
+
+    @contextmanager
+    def time_stage(self, stage: str, llm_name: str) -> Iterator[None]:
+        """统计with块的耗时, 出错时同样记录"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, llm_name, time.perf_counter() - started)
+
+    def observe_stage(self, stage: str, llm_name: str, seconds: float) -> None:
+        if self.enabled:
+            self.stage_duration.labels(stage, _llm_label(llm_name)).observe(seconds)
+
+    def observe_queue_wait(self, stage: str, llm_name: str, seconds: float, queue: str = "concurrency") -> None:
+        """queue: concurrency(学校并发槽位) / provider_concurrency(调度器并发上限) / rate_limit(RPM/TPM预算和429冷却)"""
+        if self.enabled:
+            self.queue_wait.labels(stage, _llm_label(llm_name), queue).observe(seconds)
+
+    def observe_llm_call(self, stage: str, llm_name: str, seconds: float, prompt_tokens: int,
+                         completion_tokens: int) -> None:
+        """记录一次LLM调用的耗时和prompt/completion token数(由调用方计数, 不在这里重复编码)"""
+        if not self.enabled:
+            return
+        llm_name = _llm_label(llm_name)
+        self.llm_call_duration.labels(stage, llm_name).observe(seconds)
+        self.llm_tokens.labels(stage, llm_name, "prompt").observe(prompt_tokens)
+        self.llm_tokens.labels(stage, llm_name, "completion").observe(completion_tokens)
+
+    def record_cache(self, cache: str, stage: str, llm_name: str, hit: bool) -> None:
+        if self.enabled:
+            self.cache_requests.labels(cache, stage, _llm_label(llm_name), "hit" if hit else "miss").inc()
+
+    def record_llm_retry(self, llm_name: str, reason: str) -> None:
+        """reason: rate_limit / error"""
+        if self.enabled:
+            self.llm_retries.labels(_llm_label(llm_name), reason).inc()
+
+    def set_concurrency_limit(self, llm_name: str, limit: float) -> None:
+        if self.enabled:
+            self.concurrency_limit.labels(_llm_label(llm_name)).set(limit)
+
+    def record_route(self, stage: str, llm_name: str, event: str) -> None:
+        """event: primary / hedge / failover / win"""
+        if self.enabled:
+            self.routes.labels(stage, _llm_label(llm_name), event).inc()
+
+    def observe_prompt(self, stage: str, llm_name: str, tokens: int) -> None:
+        if self.enabled:
+            self.prompt_tokens.labels(stage, _llm_label(llm_name)).observe(tokens)
+
+    def set_prompt_budget(self, stage: str, tokens: int) -> None:
+        if self.enabled:
+            self.prompt_budget.labels(stage).set(tokens)
+
+    def record_prompt_compaction(self, stage: str, input_name: str, saved_tokens: int) -> None:
+        if self.enabled:
+            self.prompt_tokens_saved.labels(stage, input_name).inc(saved_tokens)
+
+    def render(self) -> Tuple[bytes, str]:
+        """导出Prometheus文本格式, 返回 (内容, content-type)"""
+        if not self.enabled:
+            raise RuntimeError("需要安装prometheus-client: pip install prometheus-client")
+        if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+            from prometheus_client import multiprocess
+
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+            return generate_latest(registry), CONTENT_TYPE_LATEST
+        return generate_latest(self.registry), CONTENT_TYPE_LATEST
+
+
+_default_metrics: Optional[ReportMetrics] = None
+_default_lock = threading.Lock()
+
+
+def get_default_metrics() -> ReportMetrics:
+    """进程内共享的指标实例, 同一个registry中的指标只能注册一次"""
+    global _default_metrics
+    if _default_metrics is None:
+        with _default_lock:
+            if _default_metrics is None:
+                _default_metrics = ReportMetrics()
+    return _default_metrics
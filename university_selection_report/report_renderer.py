@@ -0,0 +1,329 @@
+"""
+报告渲染服务
+markdown报告渲染为独立的HTML(内联样式)和PDF。PDF渲染很耗CPU, 在常驻的进程池中执行, 不占用请求线程和事件循环:
+- 进程池启动时探测一次可用的PDF后端(weasyprint、pandoc、markdown-pdf), 之后每份报告直接使用可用的后端
+- 进程池worker启动时导入weasyprint并渲染一份空文档, 预先加载字体等资源
+- 渲染结果按markdown内容哈希缓存, 同一份报告只渲染一次, 同时请求同一份报告时共享一次渲染
+- 报告按内容哈希登记为report_id, langserve_app通过 GET /reports/{report_id}.pdf 下载
+
+用法:
+    renderer = get_default_renderer()
+    renderer.start()  # 服务启动时调用, 探测后端并预热进程池
+    report_id = renderer.register(report)
+    pdf = await renderer.arender_pdf(report)
+
+环境变量:
+    RENDER_WORKERS: 进程池大小, 默认2; 0表示在调用线程中渲染(不使用进程池)
+    RENDER_TIMEOUT: 单份报告的渲染超时(秒), 默认60
+    RENDER_CACHE_MAX_BYTES: 渲染结果和已登记报告的缓存上限(字节), 默认256MB
+"""
+
+import asyncio
+import hashlib
+import importlib.util
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from report_metrics import ReportMetrics, get_default_metrics
+
+# 样式或渲染方式有变化时请增加版本号, 旧的渲染结果自动失效
+RENDER_VERSION = 1
+
+REPORT_CSS = """
+body { font-family: Arial, sans-serif; margin: 40px; line-height: 1.6; }
+h1, h2, h3 { color: #333; }
+h1 { border-bottom: 2px solid #333; padding-bottom: 10px; }
+h2 { border-bottom: 1px solid #ccc; padding-bottom: 5px; }
+table { border-collapse: collapse; width: 100%; margin: 1em 0; }
+th, td { border: 1px solid #e1e4e8; padding: 8px 12px; text-align: left; }
+th { background-color: #f3f6fa; }
+code { background-color: #f4f4f4; padding: 2px 4px; border-radius: 3px; }
+pre { background-color: #f4f4f4; padding: 10px; border-radius: 5px; overflow-x: auto; }
+blockquote { border-left: 4px solid #ccc; margin: 0; padding-left: 20px; }
+"""
+
+
+class RenderUnavailableError(RuntimeError):
+    """没有可用的PDF后端, 或渲染进程池已关闭"""
+
+
+def report_id_for(markdown_text: str) -> str:
+    """报告的内容哈希, 作为report_id"""
+    return hashlib.sha256(markdown_text.strip().encode("utf-8")).hexdigest()[:32]
+
+
+def markdown_to_html(markdown_text: str) -> str:
+    """markdown报告转换为带内联样式的独立HTML文档, 用于下载和weasyprint渲染PDF"""
+    from markdown import markdown
+
+    body = markdown(markdown_text.strip(), extensions=["tables", "fenced_code"])
+    return (f'<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<style>{REPORT_CSS}</style>\n</head>\n'
+            f"<body>\n{body}\n</body>\n</html>\n")
+
+
+def probe_backends() -> List[str]:
+    """检查各PDF后端是否可用: weasyprint实际渲染一份空文档(依赖的pango等系统库缺失时导入也会失败), 其他后端检查命令"""
+    backends = []
+    if importlib.util.find_spec("weasyprint") is not None and importlib.util.find_spec("markdown") is not None:
+        try:
+            import weasyprint
+            weasyprint.HTML(string="<p></p>").write_pdf()
+            backends.append("weasyprint")
+        except Exception:
+            pass
+    if importlib.util.find_spec("pypandoc") is not None and shutil.which("pandoc"):
+        backends.append("pandoc")
+    if shutil.which("markdown-pdf"):
+        backends.append("markdown-pdf")
+    return backends
+
+
+def _warm_worker() -> None:
+    """进程池worker的初始化: 预先导入markdown和weasyprint并加载字体, 第一份报告不再承担这些开销"""
+    try:
+        markdown_to_html("# warm up")
+        import weasyprint
+        weasyprint.HTML(string="<p></p>").write_pdf()
+    except Exception:
+        pass
+
+
+def _render_pdf_with(backend: str, markdown_text: str, timeout: float) -> bytes:
+    if backend == "weasyprint":
+        import weasyprint
+        return weasyprint.HTML(string=markdown_to_html(markdown_text)).write_pdf()
+    with tempfile.TemporaryDirectory(prefix="report-render-") as directory:
+        source = os.path.join(directory, "report.md")
+        target = os.path.join(directory, "report.pdf")
+        with open(source, "w", encoding="utf-8") as f:
+            f.write(markdown_text)
+        if backend == "pandoc":
+            import pypandoc
+            pypandoc.convert_file(source, "pdf", outputfile=target)
+        else:
+            result = subprocess.run(["markdown-pdf", source, "-o", target], capture_output=True, text=True,
+                                    timeout=timeout)
+            if result.returncode != 0:
+                raise RuntimeError(result.stderr.strip() or f"markdown-pdf退出码{result.returncode}")
+        with open(target, "rb") as f:
+            return f.read()
+
+
+def _render(kind: str, markdown_text: str, backends: Tuple[str, ...], timeout: float) -> Tuple[bytes, str]:
+    """在worker进程中渲染, 返回 (内容, 使用的后端); PDF依次尝试可用的后端"""
+    if kind == "html":
+        return markdown_to_html(markdown_text).encode("utf-8"), "markdown"
+    errors = []
+    for backend in backends:
+        try:
+            return _render_pdf_with(backend, markdown_text, timeout), backend
+        except Exception as e:
+            errors.append(f"{backend}: {e}")
+    raise RuntimeError("PDF渲染失败: " + "; ".join(errors))
+
+
+class _ByteLRU:
+    """按总字节数限制大小的LRU缓存"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._size, "max_bytes": self.max_bytes}
+
+
+class ReportRenderer:
+    """markdown报告的HTML/PDF渲染, PDF在预热的进程池中执行, 结果按内容哈希缓存"""
+
+    def __init__(self, max_workers: int = 2, timeout: float = 60.0, cache_max_bytes: int = 256 * 1024 * 1024,
+                 metrics: Optional[ReportMetrics] = None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.metrics = metrics if metrics is not None else get_default_metrics()
+        self._cache = _ByteLRU(cache_max_bytes)
+        self._backends: Optional[Tuple[str, ...]] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> "ReportRenderer":
+        return cls(
+            max_workers=int(os.getenv("RENDER_WORKERS", "2")),
+            timeout=float(os.getenv("RENDER_TIMEOUT", "60")),
+            cache_max_bytes=int(os.getenv("RENDER_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+        )
+
+    def start(self) -> None:
+        """启动并预热进程池、探测PDF后端, 只在第一次调用时执行; 服务启动时调用, 避免第一份报告承担这些开销"""
+        with self._lock:
+            if self._backends is not None:
+                return
+            if self.max_workers > 0:
+                # spawn启动的worker不继承服务进程中的线程和事件循环
+                self._pool = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"),
+                                                 initializer=_warm_worker)
+                # 每个worker同时探测一次, 所有worker都在启动时创建并完成预热
+                probes = [self._pool.submit(probe_backends) for _ in range(self.max_workers)]
+                backends = probes[0].result()
+            else:
+                backends = probe_backends()
+            self._backends = tuple(backends)
+
+    @property
+    def backends(self) -> Tuple[str, ...]:
+        """可用的PDF后端(按优先级排列)"""
+        if self._backends is None:
+            self.start()
+        return self._backends
+
+    def close(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+            self._backends = None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def register(self, markdown_text: str) -> str:
+        """登记报告, 返回report_id(内容哈希), 之后可以按report_id渲染"""
+        report_id = report_id_for(markdown_text)
+        self._cache.set(f"report:{report_id}", markdown_text.encode("utf-8"))
+        return report_id
+
+    def get_report(self, report_id: str) -> Optional[str]:
+        """已登记的报告markdown, 被淘汰或不存在时返回None"""
+        value = self._cache.get(f"report:{report_id}")
+        return value.decode("utf-8") if value is not None else None
+
+    def _submit(self, kind: str, markdown_text: str) -> Tuple[Future, bool]:
+        """返回渲染结果的Future以及是否命中缓存; 同一份内容正在渲染时共享同一个Future"""
+        if kind == "pdf" and not self.backends:
+            raise RenderUnavailableError("没有可用的PDF后端, 请安装weasyprint、pandoc+pypandoc或markdown-pdf")
+        key = f"{kind}:{RENDER_VERSION}:{hashlib.sha256(markdown_text.strip().encode('utf-8')).hexdigest()}"
+        cached = self._cache.get(key)
+        if cached is not None:
+            self.hits += 1
+            future: Future = Future()
+            future.set_result(cached)
+            return future, True
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future, True
+            self.misses += 1
+            future = Future()
+            self._inflight[key] = future
+        started = time.perf_counter()
+
+        def done(result: Future) -> None:
+            # 无论渲染结果如何处理出错, 等待的调用方都会得到结果或异常, 不会一直等到超时
+            try:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                if result.cancelled():
+                    # 进程池关闭时尚未开始的渲染任务被取消
+                    future.set_exception(RenderUnavailableError("渲染任务已取消, 渲染进程池已关闭"))
+                    return
+                if result.exception() is not None:
+                    future.set_exception(result.exception())
+                    return
+                content, backend = result.result()
+                self.metrics.observe_stage(f"render_{kind}", backend, time.perf_counter() - started)
+                self._cache.set(key, content)
+                future.set_result(content)
+            except BaseException as e:
+                if not future.done():
+                    future.set_exception(e)
+
+        args = (kind, markdown_text, self.backends, self.timeout)
+        if self._pool is None:
+            inline: Future = Future()
+            try:
+                inline.set_result(_render(*args))
+            except Exception as e:
+                inline.set_exception(e)
+            done(inline)
+        else:
+            self._pool.submit(_render, *args).add_done_callback(done)
+        return future, False
+
+    def _render_sync(self, kind: str, markdown_text: str) -> bytes:
+        future, hit = self._submit(kind, markdown_text)
+        self.metrics.record_cache("render", f"render_{kind}", "renderer", hit)
+        return future.result(timeout=self.timeout)
+
+    async def _arender(self, kind: str, markdown_text: str) -> bytes:
+        future, hit = self._submit(kind, markdown_text)
+        self.metrics.record_cache("render", f"render_{kind}", "renderer", hit)
+        # shield: 调用方取消时不取消共享的渲染
+        return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.timeout)
+
+    def render_pdf(self, markdown_text: str) -> bytes:
+        return self._render_sync("pdf", markdown_text)
+
+    def render_html(self, markdown_text: str) -> str:
+        return self._render_sync("html", markdown_text).decode("utf-8")
+
+    async def arender_pdf(self, markdown_text: str) -> bytes:
+        return await self._arender("pdf", markdown_text)
+
+    async def arender_html(self, markdown_text: str) -> str:
+        return (await self._arender("html", markdown_text)).decode("utf-8")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backends": list(self._backends) if self._backends is not None else None,
+            "workers": self.max_workers,
+            "hits": self.hits,
+            "misses": self.misses,
+            "inflight": len(self._inflight),
+            **self._cache.stats(),
+        }
+
+
+_default_renderer: Optional[ReportRenderer] = None
+_default_renderer_lock = threading.Lock()
+
+
+def get_default_renderer() -> ReportRenderer:
+    """进程内共享的渲染服务, 按环境变量配置"""
+    global _default_renderer
+    if _default_renderer is None:
+        with _default_renderer_lock:
+            if _default_renderer is None:
+                _default_renderer = ReportRenderer.from_env()
+    return _default_renderer
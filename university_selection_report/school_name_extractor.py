@@ -0,0 +1,155 @@
+"""
+从学校推荐报告中提取学校名称
+学校推荐prompt要求LLM输出 | School Name | Reason | 格式的markdown表格, 按保底校、匹配校、冲刺校排列。
+提取时逐行扫描一次报告, 用预编译的正则识别表头、分隔行和数据行, 学校名称所在的列按表头确定;
+每个单元格先用Aho-Corasick自动机查找标准名称或别名, 找不到时再做模糊归一化。
+表格中的学校不足时, 再用自动机扫描整篇报告。
+
+结果按类别排序(每行都标明了safety/target/reach等不同类别时)并去重, 否则保持表格中的顺序;
+prompt示例中的占位名称(Safety University等)不会作为学校名称返回。
+"""
+
+import re
+from typing import List, Optional, Tuple
+
+from normalization.university_normalization import UniversityNormalization, fold_name
+
+# 学校推荐表的类别顺序, 与report_checkpoints.SCHOOL_TIERS一致; match等同于target
+_TIER_ORDER = {"safety": 0, "target": 1, "match": 1, "reach": 2}
+_TIER = re.compile(r"\b(safety|target|match|reach)\b|(保底|匹配|冲刺)", re.IGNORECASE)
+_TIER_CELL = re.compile(r"^\W*(?:safety|target|match|reach|保底|匹配|冲刺)(?:\s*(?:school|校))?\W*$", re.IGNORECASE)
+_CHINESE_TIERS = {"保底": "safety", "匹配": "target", "冲刺": "reach"}
+
+# prompt示例和兜底结果中的占位名称, 其中Reach University与真实学校重名
+PLACEHOLDER_SCHOOLS = ("Safety University", "Target University", "Reach University", "TBD University")
+_PLACEHOLDER_KEYS = frozenset(fold_name(name) for name in PLACEHOLDER_SCHOOLS)
+
+# 单元格含有这些词时, 即使不在学校名单中也保留原文作为学校名称
+SCHOOL_KEYWORDS = re.compile(r"University|College|Institute|大学|学院", re.IGNORECASE)
+_NAME_HEADER = re.compile(r"school|university|college|学校|大学|院校", re.IGNORECASE)
+_TIER_HEADER = re.compile(r"tier|type|category|level|类别|类型|层次", re.IGNORECASE)
+
+_TABLE_ROW = re.compile(r"^\s*\|(.*?)\|?\s*$")
+_SEPARATOR_ROW = re.compile(r"^\s*\|?\s*:?-{2,}:?\s*(?:\|\s*:?-{2,}:?\s*)*\|?\s*$")
+_MARKDOWN_LINK = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+_MARKDOWN_EMPHASIS = re.compile(r"[*_`]+")
+_TRAILING_NOTE = re.compile(r"\s*(?:[(（][^()（）]*[)）]|\s[-–—]\s.*|[:：].*)$")
+
+
+def clean_cell(cell: str) -> str:
+    """去掉单元格中的markdown链接、加粗和首尾空白"""
+    cell = _MARKDOWN_LINK.sub(r"\1", cell)
+    return _MARKDOWN_EMPHASIS.sub("", cell).strip()
+
+
+def _split_row(line: str) -> Optional[List[str]]:
+    match = _TABLE_ROW.match(line)
+    if match is None:
+        return None
+    return [cell.strip() for cell in match.group(1).split("|")]
+
+
+def _tier(cell: str) -> Optional[str]:
+    match = _TIER.search(cell)
+    if match is None:
+        return None
+    return match.group(1).casefold() if match.group(1) else _CHINESE_TIERS[match.group(2)]
+
+
+def _row_tier(cells: List[str], column: int, tier_column: Optional[int]) -> Optional[str]:
+    """
+    数据行的类别: 表头中有类别列时取该列, 否则取学校名称单元格中的标注(例如 Purdue University (Safety)),
+    或者只有类别一个词的单元格; 推荐理由中顺带提到的reach/match等词不算
+    """
+    if tier_column is not None and tier_column < len(cells):
+        return _tier(cells[tier_column])
+    tier = _tier(cells[column])
+    if tier is None:
+        tier = next((_tier(cell) for cell in cells if _TIER_CELL.match(clean_cell(cell))), None)
+    return tier
+
+
+def parse_school_table(report: str) -> List[Tuple[str, Optional[str]]]:
+    """
+    逐行扫描一次报告, 返回学校推荐表每个数据行的 (学校名称单元格, 类别)。
+    只取表头中有School/University等列名的表格; 报告中没有这样的表格时取所有表格的第一列
+    """
+    rows: List[Tuple[str, Optional[str]]] = []
+    untitled: List[Tuple[str, Optional[str]]] = []
+    header: Optional[List[str]] = None
+    column: Optional[int] = None
+    tier_column: Optional[int] = None
+    in_table = False
+    for line in report.splitlines():
+        cells = _split_row(line)
+        if cells is None:
+            header, in_table = None, False
+            continue
+        if _SEPARATOR_ROW.match(line):
+            # 分隔行前一行是表头, 确定学校名称所在的列
+            if header is not None and not in_table:
+                column = next((i for i, cell in enumerate(header) if _NAME_HEADER.search(cell)), None)
+                tier_column = next((i for i, cell in enumerate(header) if _TIER_HEADER.search(cell)), None)
+                in_table = True
+            continue
+        if not in_table:
+            header = cells
+            continue
+        if column is None:
+            untitled.append((cells[0], _row_tier(cells, 0, tier_column)))
+        elif column < len(cells):
+            rows.append((cells[column], _row_tier(cells, column, tier_column)))
+    return rows or untitled
+
+
+class SchoolNameExtractor:
+    """从学校推荐报告和学生profile中提取标准学校名称, 使用进程内共享的学校名称归一化索引"""
+
+    def __init__(self, normalizer: UniversityNormalization):
+        self.normalizer = normalizer
+
+    def scan(self, text: str) -> List[str]:
+        """在任意文本中按出现顺序查找学校名称(去重), 不包括占位名称"""
+        return self.normalizer.scan(text, exclude=_PLACEHOLDER_KEYS)
+
+    def school_from_cell(self, cell: str) -> Optional[str]:
+        """
+        学校推荐表单元格中的学校名称: 单元格恰好是标准名称时原样返回(名单中有折叠后相同的不同写法);
+        否则先在单元格内查找标准名称或别名(最长匹配), 找不到时去掉括号和破折号后的说明
+        再做模糊归一化; 仍然没有结果但含有University等词时保留原文
+        """
+        cell = clean_cell(cell)
+        if not cell or fold_name(cell) in _PLACEHOLDER_KEYS:
+            return None
+        if self.normalizer.is_canonical(cell):
+            return cell
+        found = self.scan(cell)
+        if found:
+            return found[0]
+        stripped = _TRAILING_NOTE.sub("", cell)
+        if not stripped or fold_name(stripped) in _PLACEHOLDER_KEYS:
+            return None
+        name = self.normalizer.normalize(stripped)
+        if name is None and SCHOOL_KEYWORDS.search(cell):
+            # 名单中没有的学校保留表格中的原文
+            name = stripped if SCHOOL_KEYWORDS.search(stripped) else cell
+        return name
+
+    def from_table(self, report: str) -> List[str]:
+        """学校推荐表中的学校, 每行都标明了不同类别时按保底、匹配、冲刺排序, 否则保持表格顺序"""
+        schools: List[Tuple[str, Optional[str]]] = []
+        for cell, tier in parse_school_table(report):
+            name = self.school_from_cell(cell)
+            if name is not None and all(name != existing for existing, _ in schools):
+                schools.append((name, tier))
+        tiers = [tier for _, tier in schools]
+        if schools and None not in tiers and len({_TIER_ORDER[tier] for tier in tiers}) == len(tiers):
+            schools.sort(key=lambda school: _TIER_ORDER[school[1]])
+        return [name for name, _ in schools]
+
+    def extract(self, report: str, limit: int = 3) -> List[str]:
+        """先取学校推荐表中的学校, 不足limit所时按出现顺序补充报告正文中提到的学校"""
+        names = self.from_table(report)
+        if len(names) < limit:
+            names += [name for name in self.scan(report) if name not in names]
+        return names
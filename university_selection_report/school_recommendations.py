@@ -0,0 +1,90 @@
+"""
+学校推荐的结构化输出
+structured_output模式下学校推荐章节让LLM按JSON schema返回保底、匹配、冲刺三所学校的记录(tier, school, reason):
+支持tool calling的模型使用with_structured_output, 其他模型按prompt中的JSON schema输出JSON文本。
+记录用pydantic校验后在本地渲染为markdown表格, 学校名称直接传给后续阶段, 不需要再从报告中提取。
+"""
+
+import json
+import re
+from typing import Any, Callable, List, Literal, Optional
+
+from pydantic import BaseModel, Field, field_validator, model_validator
+
+from report_checkpoints import SCHOOL_TIERS
+
+_TIER_ALIASES = {"match": "target", "保底": "safety", "匹配": "target", "冲刺": "reach"}
+_CODE_FENCE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$", re.IGNORECASE)
+
+
+class SchoolRecommendation(BaseModel):
+    """一所推荐学校"""
+
+    tier: Literal["safety", "target", "reach"] = Field(description="safety, target or reach")
+    school: str = Field(description="Full official name of the university")
+    reason: str = Field(description="Why this school is recommended for the student")
+
+    @field_validator("tier", mode="before")
+    @classmethod
+    def _normalize_tier(cls, value: Any) -> Any:
+        if isinstance(value, str):
+            value = value.strip().casefold()
+            return _TIER_ALIASES.get(value, value)
+        return value
+
+    @field_validator("school", "reason")
+    @classmethod
+    def _strip(cls, value: str) -> str:
+        value = " ".join(value.split())
+        if not value:
+            raise ValueError("must not be empty")
+        return value
+
+
+class SchoolRecommendations(BaseModel):
+    """学校推荐结果: 保底、匹配、冲刺各一所, 校验后按类别排序"""
+
+    schools: List[SchoolRecommendation] = Field(description="Exactly one safety, one target and one reach school")
+
+    @model_validator(mode="after")
+    def _one_school_per_tier(self) -> "SchoolRecommendations":
+        tiers = sorted(school.tier for school in self.schools)
+        if tiers != sorted(SCHOOL_TIERS):
+            raise ValueError(f"expected one safety, one target and one reach school, got {tiers}")
+        if len({school.school.casefold() for school in self.schools}) != len(self.schools):
+            raise ValueError("schools must be distinct")
+        self.schools.sort(key=lambda school: SCHOOL_TIERS.index(school.tier))
+        return self
+
+    def school_names(self) -> List[str]:
+        return [school.school for school in self.schools]
+
+    def normalized(self, normalize: Callable[[str], Optional[str]]) -> "SchoolRecommendations":
+        """
+        学校名称替换为标准名称(找不到时保留原文); 重新校验, 不同类别的学校归一化为同一所时抛出ValidationError
+        (ValueError的子类)
+        """
+        schools = [{**school.model_dump(), "school": normalize(school.school) or school.school}
+                   for school in self.schools]
+        return SchoolRecommendations.model_validate({"schools": schools})
+
+    def to_markdown(self) -> str:
+        """渲染为与markdown模式相同列顺序的学校推荐表, 第一列为学校名称"""
+        rows = ["| School Name | Tier | Reason |", "| ------------- | ------------- | ------------- |"]
+        for school in self.schools:
+            cells = (school.school, school.tier.capitalize(), school.reason)
+            rows.append("| " + " | ".join(cell.replace("|", "\\|") for cell in cells) + " |")
+        return "\n".join(rows)
+
+
+# 写入prompt的JSON schema, 不支持tool calling的模型按它输出
+SCHOOL_RECOMMENDATIONS_SCHEMA = json.dumps(SchoolRecommendations.model_json_schema(), ensure_ascii=False)
+
+
+def parse_school_recommendations(text: str) -> SchoolRecommendations:
+    """解析并校验LLM输出的JSON文本(允许带```json代码块), 格式不符时抛出ValueError"""
+    text = _CODE_FENCE.sub("", text)
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        raise ValueError("no JSON object in output")
+    return SchoolRecommendations.model_validate_json(text[start:end + 1])
@@ -0,0 +1,160 @@
+"""
+学校通用章节存储
+学校简介、历史招生数据、录取要求、亚洲学生录取概况等内容与学生无关，
+按 (归一化学校名称, locale, 模型, 版本) 生成一次后在所有学生的报告之间复用，不同provider/模型生成的内容互不复用。
+支持内存和SQLite本地文件两种存储方式，条目带版本号和过期时间；内存中最多保留max_entries条，超出后淘汰最久未使用的条目。
+
+环境变量:
+    SCHOOL_SECTION_STORE_PATH: SQLite存储路径，不设置时只保存在内存中
+    SCHOOL_SECTION_MAX_ENTRIES: 内存中保留的条目数，默认1024
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from single_flight import SingleFlight
+
+# 通用章节prompt有变化时请增加版本号，旧版本的内容会自动失效
+SCHOOL_SECTION_VERSION = 1
+
+_NON_WORD = re.compile(r"[^\w\s]")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_school_key(school_name: str) -> str:
+    """学校名称归一化为存储key：去掉标点、统一大小写和空白"""
+    name = _NON_WORD.sub(" ", school_name.casefold())
+    name = _SPACES.sub(" ", name).strip()
+    if name.startswith("the "):
+        name = name[4:]
+    return name
+
+
+class SchoolSectionStore:
+    """学生无关的学校章节存储，path为None时只保存在内存中; model为生成内容的LLM(例如 "openai:gpt-4o-mini")"""
+
+    def __init__(self, path: Optional[str] = None, ttl: Optional[float] = 30 * 24 * 3600,
+                 version: int = SCHOOL_SECTION_VERSION, max_entries: int = 1024):
+        self.path = path
+        self.ttl = ttl
+        self.version = version
+        self.max_entries = max_entries
+        self._memory: "OrderedDict[Tuple[str, str, str], Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 正在生成中的key, 保证同一所学校并发请求(同步、异步、不同事件循环)时只生成一次
+        self._flight = SingleFlight("school_section")
+        self._conn = None
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(school_sections)")]
+            if columns and "model" not in columns:
+                # 旧表没有记录生成内容的模型, 无法区分来源, 按缓存失效处理后重建
+                self._conn.execute("DROP TABLE school_sections")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS school_sections ("
+                "school_key TEXT NOT NULL, locale TEXT NOT NULL, model TEXT NOT NULL, version INTEGER NOT NULL, "
+                "school_name TEXT NOT NULL, content TEXT NOT NULL, created_at REAL NOT NULL, "
+                "PRIMARY KEY (school_key, locale, model, version))"
+            )
+            self._conn.commit()
+
+    @classmethod
+    def from_env(cls) -> "SchoolSectionStore":
+        return cls(path=os.getenv("SCHOOL_SECTION_STORE_PATH"),
+                   max_entries=int(os.getenv("SCHOOL_SECTION_MAX_ENTRIES", "1024")))
+
+    def _key(self, school_name: str, locale: str, model: str) -> Tuple[str, str, str]:
+        return normalize_school_key(school_name), locale, model
+
+    def _remember(self, key: Tuple[str, str, str], created_at: float, content: str) -> None:
+        """写入内存中的LRU, 调用方持有_lock"""
+        self._memory[key] = (created_at, content)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    def get(self, school_name: str, locale: str, model: str = "") -> Optional[str]:
+        key = self._key(school_name, locale, model)
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None and not self._expired(item[0]):
+                self._memory.move_to_end(key)
+                return item[1]
+            if self._conn is None:
+                return None
+            row = self._conn.execute(
+                "SELECT content, created_at FROM school_sections "
+                "WHERE school_key = ? AND locale = ? AND model = ? AND version = ?",
+                (key[0], key[1], key[2], self.version),
+            ).fetchone()
+            if row is None or self._expired(row[1]):
+                return None
+            self._remember(key, row[1], row[0])
+            return row[0]
+
+    def put(self, school_name: str, locale: str, content: str, model: str = "") -> None:
+        key = self._key(school_name, locale, model)
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, content)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO school_sections "
+                    "(school_key, locale, model, version, school_name, content, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key[0], key[1], key[2], self.version, school_name, content, now),
+                )
+                self._conn.commit()
+
+    def get_or_create(self, school_name: str, locale: str, factory: Callable[[], str], refresh: bool = False,
+                      model: str = "") -> str:
+        """读取学校章节，不存在时调用factory生成；同一所学校并发调用只生成一次。refresh为True时重新生成并覆盖已有内容"""
+        content = None if refresh else self.get(school_name, locale, model)
+        if content is not None:
+            return content
+
+        def create() -> str:
+            content = None if refresh else self.get(school_name, locale, model)
+            if content is None:
+                content = factory()
+                self.put(school_name, locale, content, model)
+            return content
+
+        return self._flight.do(self._key(school_name, locale, model), create)
+
+    async def aget_or_create(self, school_name: str, locale: str, factory: Callable[[], Awaitable[str]],
+                             refresh: bool = False, model: str = "") -> str:
+        """get_or_create的异步版本，与同步调用方和其他事件循环中的并发请求共享同一次生成"""
+        content = None if refresh else self.get(school_name, locale, model)
+        if content is not None:
+            return content
+
+        async def create() -> str:
+            content = None if refresh else self.get(school_name, locale, model)
+            if content is None:
+                content = await factory()
+                self.put(school_name, locale, content, model)
+            return content
+
+        return await self._flight.ado(self._key(school_name, locale, model), create)
+
+    def flight_stats(self) -> Dict[str, int]:
+        """生成学校章节的调用中, 自己生成(leaders)和等待其他调用结果(followers)的次数"""
+        return self._flight.stats()
+
+    def __len__(self) -> int:
+        with self._lock:
+            if self._conn is not None:
+                return self._conn.execute(
+                    "SELECT COUNT(*) FROM school_sections WHERE version = ?", (self.version,)
+                ).fetchone()[0]
+            return len(self._memory)
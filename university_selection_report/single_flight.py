@@ -0,0 +1,171 @@
+"""
+相同请求的合并(single-flight)
+同一个key正在执行时, 后到的调用不再重复执行, 而是等待同一个结果: 顾问双击、前端重试时的同一份报告,
+以及很多学生同时请求同一所学校时相同prompt的LLM调用。
+
+同步和异步调用方共享同一次执行: 结果保存在concurrent.futures.Future中, 其他线程直接等待,
+其他事件循环中的协程通过asyncio.wrap_future等待。
+- 同步调用方成为leader时在当前线程中执行
+- 异步调用方成为leader时在当前事件循环中创建任务执行; 等待的调用方全部取消时才取消该任务,
+  某个调用方断开连接不影响其他等待同一结果的调用方
+执行出错时所有等待的调用方得到同一个异常, 之后的调用重新执行。
+
+用法:
+    flight = get_single_flight("llm_call")
+    result = flight.do(key, lambda: call_llm(prompt))
+    result = await flight.ado(key, lambda: acall_llm(prompt))
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from report_metrics import ReportMetrics
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def _consume(future: "asyncio.Future") -> None:
+    # 读取已经没有调用方等待的结果的异常, 避免 "exception was never retrieved" 警告
+    if not future.cancelled():
+        future.exception()
+
+
+class _Flight:
+    """一次正在执行的调用: 结果、等待的调用方数量, 异步leader的任务和所在的事件循环"""
+
+    def __init__(self):
+        self.future: Future = Future()
+        self.waiters = 0
+        self.task: Optional["asyncio.Task"] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+class SingleFlight:
+    """按key合并并发调用; name和metrics用于记录合并次数(report_cache_requests_total, cache=name)"""
+
+    def __init__(self, name: str = "single_flight", metrics: Optional[ReportMetrics] = None):
+        self.name = name
+        self.metrics = metrics
+        self.leaders = 0
+        self.followers = 0
+        self._inflight: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key: Hashable, stage: str, llm_name: str) -> Tuple[_Flight, bool]:
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+                self.leaders += 1
+            else:
+                self.followers += 1
+            flight.waiters += 1
+        if self.metrics is not None and stage:
+            self.metrics.record_cache(self.name, stage, llm_name, not leader)
+        return flight, leader
+
+    def _settle(self, key: Hashable, flight: _Flight, result: Any = None, error: Optional[BaseException] = None,
+                cancelled: bool = False) -> None:
+        with self._lock:
+            if self._inflight.get(key) is flight:
+                del self._inflight[key]
+        if flight.future.done():
+            return
+        if cancelled:
+            flight.future.cancel()
+        elif error is not None:
+            flight.future.set_exception(error)
+        else:
+            flight.future.set_result(result)
+
+    def _leave(self, key: Hashable, flight: _Flight, cancelled: bool = False) -> None:
+        """调用方不再等待; 异步执行的调用没有任何调用方等待时取消"""
+        with self._lock:
+            flight.waiters -= 1
+            abandon = cancelled and flight.waiters == 0 and flight.task is not None and not flight.task.done()
+            if abandon and self._inflight.get(key) is flight:
+                # 之后到达的调用重新执行, 不再等待即将取消的任务
+                del self._inflight[key]
+        if abandon:
+            flight.loop.call_soon_threadsafe(flight.task.cancel)
+
+    def do(self, key: Hashable, fn: Callable[[], Any], stage: str = "", llm_name: str = "") -> Any:
+        """同步执行fn, 相同key正在执行时等待其结果"""
+        flight, leader = self._join(key, stage, llm_name)
+        try:
+            if not leader:
+                if flight.loop is not None and flight.loop is _running_loop():
+                    # 在leader所在事件循环的线程中同步等待会阻塞该循环, 直接执行
+                    return fn()
+                return flight.future.result()
+            try:
+                result = fn()
+            except BaseException as e:
+                self._settle(key, flight, error=e)
+                raise
+            self._settle(key, flight, result)
+            return result
+        finally:
+            self._leave(key, flight)
+
+    async def ado(self, key: Hashable, fn: Callable[[], Awaitable[Any]], stage: str = "", llm_name: str = "") -> Any:
+        """异步执行fn, 相同key正在执行时(包括同步调用方)等待其结果, 不阻塞事件循环"""
+        flight, leader = self._join(key, stage, llm_name)
+        if leader:
+            flight.loop = asyncio.get_running_loop()
+            # 任务复制当前context(调度优先级、重新生成计划等)
+            flight.task = asyncio.ensure_future(fn())
+
+            def done(task: "asyncio.Task") -> None:
+                if task.cancelled():
+                    self._settle(key, flight, cancelled=True)
+                elif task.exception() is not None:
+                    self._settle(key, flight, error=task.exception())
+                else:
+                    self._settle(key, flight, task.result())
+
+            flight.task.add_done_callback(done)
+        waiter = asyncio.wrap_future(flight.future)
+        try:
+            result = await asyncio.shield(waiter)
+        except asyncio.CancelledError:
+            # 本调用方被取消(而不是共享的执行被取消)时, 之后的结果或异常不再有人读取
+            waiter.add_done_callback(_consume)
+            self._leave(key, flight, cancelled=not flight.future.cancelled())
+            raise
+        self._leave(key, flight)
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"leaders": self.leaders, "followers": self.followers, "inflight": len(self._inflight)}
+
+
+_flights: Dict[str, SingleFlight] = {}
+_flights_lock = threading.Lock()
+
+
+def get_single_flight(name: str, metrics: Optional[ReportMetrics] = None) -> SingleFlight:
+    """进程内按名称共享的SingleFlight, 所有workflow实例的相同调用互相合并"""
+    flight = _flights.get(name)
+    if flight is None:
+        with _flights_lock:
+            flight = _flights.get(name)
+            if flight is None:
+                flight = _flights[name] = SingleFlight(name, metrics)
+    return flight
+
+
+def single_flight_stats() -> Dict[str, Dict[str, int]]:
+    with _flights_lock:
+        flights = dict(_flights)
+    return {name: flight.stats() for name, flight in flights.items()}
@@ -1,41 +1,216 @@
+import asyncio
+import contextvars
+import hashlib
+import json
 import os
-import re
-from typing import Union, Dict, Any, Optional
-from langchain.chains import LLMChain
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Union, Dict, Any, AsyncIterator, Awaitable, Callable, FrozenSet, Iterable, Iterator, List, Optional, Tuple
 from langsmith import traceable
-from langchain.prompts import PromptTemplate
-from langchain.llms.base import BaseLLM
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.messages import BaseMessage
+from langchain_core.prompts import PromptTemplate
+from langchain_core.runnables import Runnable, RunnableLambda, RunnablePassthrough
 
-# Placeholders for future imports
-# from normalization.university_normalization import UniversityNormalization
-# from knowledge_base.university_knowledge import UniversityKnowledge
+from llm_cache import LLMCache, make_cache_key
+from llm_client_pool import get_default_client_pool
+from llm_router import DEFAULT_HEDGE_STAGES, HedgedRouter, LLMRoute
+from llm_scheduler import LLMScheduler, get_default_scheduler
+from prompt_budget import PromptBudget, get_default_prompt_budget
+from report_artifacts import ArtifactStore, get_default_artifact_store
+from report_checkpoints import (SCHOOL_TIERS, ReportCheckpointStore, bypass_llm_cache, current_plan,
+                                llm_cache_bypassed, make_checkpoint_key, regeneration)
+from report_metrics import ReportMetrics, get_default_metrics
+from school_recommendations import (SCHOOL_RECOMMENDATIONS_SCHEMA, SchoolRecommendations,
+                                    parse_school_recommendations)
+from school_section_store import SchoolSectionStore
+from single_flight import SingleFlight, get_single_flight
 
-os.environ["LANGCHAIN_ENDPOINT"] = "https://api.smith.langchain.com"
+# 添加项目根目录到Python路径, 以便导入normalization和knowledge_base
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from normalization.university_normalization import UniversityNormalization, get_default_normalizer
+from school_name_extractor import SchoolNameExtractor
+from knowledge_base.university_knowledge import UniversityKnowledge, get_default_knowledge
+
+# 知识库中没有该学校时传给LLM的上下文
+SCHOOL_CONTEXT_PLACEHOLDER = {"desc": "学校信息占位符"}
 
-# load environment variables from .env file with dotenv
-from dotenv import load_dotenv
-load_dotenv()
 locale = "English" # "Chinese"
 
-# LLM registry for switching
-LLM_REGISTRY = {}
+# run()返回值中报告前后的空白, 流式输出时需要保持一致
+REPORT_PREFIX = "\n            "
+REPORT_SUFFIX = "\n        "
+_STREAM_END = object()
+# 学校章节中推荐理由前的标题
+_REASONS_HEADING = "\n\n### Reasons for recommendation\n\n"
+
+# 各检查点阶段使用的prompt, 模板内容是检查点key的一部分
+_CHECKPOINT_PROMPTS = {
+    "recommend_majors": ("recommend_majors",),
+    "recommend_schools": ("recommend_schools",),
+    "recommend_schools_structured": ("recommend_schools_structured",),
+    "extract_school_names": ("extract_school_names",),
+    "fill_school_info": ("school_profile", "school_reasons"),
+}
+
+# 流水线模式下按学生profile中列出的目标学校预先生成的学校章节数上限
+_MAX_SPECULATIVE_SCHOOLS = 3
+
+_environment_loaded = False
+_environment_lock = threading.Lock()
+
+
+def load_environment() -> None:
+    """读取.env文件并设置LangSmith端点默认值, 只在第一次调用时执行(导入模块时不修改环境变量)"""
+    global _environment_loaded
+    if _environment_loaded:
+        return
+    with _environment_lock:
+        if _environment_loaded:
+            return
+        try:
+            from dotenv import load_dotenv
+            load_dotenv()
+        except ImportError:
+            pass
+        os.environ.setdefault("LANGCHAIN_ENDPOINT", "https://api.smith.langchain.com")
+        _environment_loaded = True
+
 
-try:
+# LLM registry for switching, provider的SDK在第一次创建模型时才导入
+def _openai_llm(model: Optional[str] = None) -> BaseLanguageModel:
     from langchain_openai import ChatOpenAI
-    LLM_REGISTRY['openai'] = lambda: ChatOpenAI()
-except ImportError:
-    pass
-try:
+    pool = get_default_client_pool()
+    kwargs = {"model": model} if model else {}
+    # 共享进程内的keep-alive连接池; 重试由LLMScheduler统一处理, SDK不再自行重试
+    return ChatOpenAI(http_client=pool.http_client("openai"), http_async_client=pool.http_async_client("openai"),
+                      timeout=pool.timeout, max_retries=0, **kwargs)
+
+
+def _gemini_llm(model: Optional[str] = None) -> BaseLanguageModel:
     from langchain_google_genai import ChatGoogleGenerativeAI
-    LLM_REGISTRY['gemini'] = lambda: ChatGoogleGenerativeAI()
-except ImportError:
-    pass
+    kwargs = {"model": model} if model else {}
+    # gRPC channel随模型实例一起由客户端池复用; max_retries=1即只调用一次, 重试由LLMScheduler统一处理
+    return ChatGoogleGenerativeAI(timeout=get_default_client_pool().timeout_seconds, max_retries=1, **kwargs)
+
 
+LLM_REGISTRY = {
+    'openai': _openai_llm,
+    'gemini': _gemini_llm,
+}
+
+
+def allowed_models() -> FrozenSet[str]:
+    """可以用 "provider:model" 指定的模型: LLM_ALLOWED_MODELS 和 LLM_FALLBACKS 中列出的名称(逗号分隔)"""
+    names = ",".join(os.getenv(var, "") for var in ("LLM_ALLOWED_MODELS", "LLM_FALLBACKS")).split(",")
+    return frozenset(name.strip() for name in names if ":" in name)
 
-def get_llm(llm_name: str) -> BaseLLM:
-    if llm_name not in LLM_REGISTRY:
+
+def get_llm(llm_name: str) -> BaseLanguageModel:
+    """
+    从进程内客户端池获取LLM实例, 同一个名称的所有workflow共享一个实例和连接池;
+    llm_name可以带模型名称, 例如 "openai:gpt-4o-mini", 模型名称需要在allowed_models()中,
+    请求不能任意指定模型名称, 使客户端池、workflow缓存不会无限增长
+    """
+    provider, _, model = llm_name.partition(":")
+    if provider not in LLM_REGISTRY:
         raise ValueError(f"LLM '{llm_name}' is not supported or not installed.")
-    return LLM_REGISTRY[llm_name]()
+    if model and llm_name not in allowed_models():
+        raise ValueError(f"LLM '{llm_name}' is not allowed, add it to LLM_ALLOWED_MODELS.")
+    try:
+        return get_default_client_pool().get(provider, LLM_REGISTRY[provider], model or None)
+    except ImportError as e:
+        raise ValueError(f"LLM '{llm_name}' is not supported or not installed.") from e
+
+
+def _identifying_params(llm: BaseLanguageModel) -> Dict[str, Any]:
+    """LLM的模型参数(模型名、temperature等)"""
+    try:
+        return dict(getattr(llm, "_identifying_params", {}) or {})
+    except Exception:
+        return {}
+
+
+def _model_name(params: Dict[str, Any]) -> Optional[str]:
+    # tiktoken按模型名称选择编码
+    return params.get("model_name") or params.get("model")
+
+
+def _recommendations_json(output: Any) -> str:
+    """校验学校推荐的结构化输出, 返回JSON文本(缓存和检查点中保存的内容); 不符合schema时抛出ValueError"""
+    if isinstance(output, SchoolRecommendations):
+        return output.model_dump_json()
+    if isinstance(output, dict):
+        return SchoolRecommendations.model_validate(output).model_dump_json()
+    return parse_school_recommendations(_output_text(output)).model_dump_json()
+
+
+def _output_text(output: Any) -> str:
+    """LLM输出转为文本: chat模型返回消息(content可能是分块列表), 文本模型直接返回str"""
+    return output.text() if isinstance(output, BaseMessage) else str(output)
+
+
+def _report_document(result: str) -> str:
+    """run()返回和写入HTML文件的报告内容"""
+    return f"{REPORT_PREFIX}{result}{REPORT_SUFFIX}"
+
+
+def _consume_exception(task: "asyncio.Task") -> None:
+    # 被取消的预先生成任务可能已经失败, 读取其异常避免 "exception was never retrieved" 警告
+    if not task.cancelled():
+        task.exception()
+
+
+class _TableRowStream:
+    """从流式输出中取出markdown表格每一行的第一列: 第一列的右侧竖线出现即可取出, 不必等整行结束; 跳过分隔行"""
+
+    def __init__(self):
+        self._buffer = ""
+        self._taken = False
+
+    def _first_cell(self, line: str) -> Optional[str]:
+        line = line.strip()
+        if self._taken or not line.startswith("|") or line.count("|") < 2:
+            return None
+        self._taken = True
+        cell = line[1:].split("|", 1)[0].strip()
+        return cell if cell and not set(cell) <= set("-: ") else None
+
+    def feed(self, delta: str) -> List[str]:
+        self._buffer += delta
+        *lines, self._buffer = self._buffer.split("\n")
+        cells = []
+        for line in lines:
+            cell = self._first_cell(line)
+            if cell is not None:
+                cells.append(cell)
+            # 完整的一行结束, 下一行重新取第一列
+            self._taken = False
+        cell = self._first_cell(self._buffer)
+        if cell is not None:
+            cells.append(cell)
+        return cells
+
+
+def _regeneration_scope(regenerate: Iterable[str], overrides: Optional[Dict[str, Any]]):
+    """没有指定重新生成或替换的章节时沿用调用方的设置"""
+    if not regenerate and not overrides:
+        return nullcontext()
+    return regeneration(regenerate, overrides)
+
+
+def _school_heading(school: str) -> str:
+    return f"## {school}\n\n"
+
+
+def _school_aliases(index: int, school: str) -> List[str]:
+    """学校章节可以按学校名称或保底/匹配/冲刺类别指定重新生成"""
+    return [school] + ([SCHOOL_TIERS[index]] if index < len(SCHOOL_TIERS) else [])
 
 
 def read_profile(profile_input: str) -> str:
@@ -46,18 +221,71 @@ def read_profile(profile_input: str) -> str:
 
 
 class UniversitySelectionWorkflow:
-    def __init__(self, llm_name: str = 'openai', debug: bool = True, project_name: str = "university-selection", output_dir: Optional[str] = None):
+    def __init__(self, llm_name: str = 'openai', debug: bool = True, project_name: str = "university-selection", output_dir: Optional[str] = None, max_concurrency: int = 3, cache: Optional[LLMCache] = None, school_store: Optional[SchoolSectionStore] = None, scheduler: Optional[LLMScheduler] = None, knowledge: Optional[UniversityKnowledge] = None, metrics: Optional[ReportMetrics] = None, fallback_llms: Optional[List[str]] = None, hedge_after: Optional[float] = None, hedge_stages: Iterable[str] = DEFAULT_HEDGE_STAGES, checkpoints: Optional[ReportCheckpointStore] = None, pipelined: bool = False, structured_output: bool = False, prompt_budget: Optional[PromptBudget] = None):
+        load_environment()
         self.llm_name = llm_name
+        # 限流预算和并发上限按provider计算, "openai:gpt-4o"与"openai"共用
+        self.provider = llm_name.partition(":")[0]
         self.llm = get_llm(llm_name)
         self.debug = debug
+        # 学校信息填充的最大并发数, 1表示逐个顺序执行
+        self.max_concurrency = max(1, max_concurrency)
+        # LLM响应缓存, None表示不缓存
+        self.cache = cache
+        # 按阶段输入保存的章节检查点, 重新生成报告时只重新计算输入有变化的阶段; None表示不保存
+        self.checkpoints = checkpoints
+        # 流水线模式(arun/astream): 学校推荐表边生成边开始各学校章节, profile中列出的目标学校提前生成
+        self.pipelined = pipelined
+        # 结构化输出模式: 学校推荐按JSON schema返回并校验, 在本地渲染表格, 学校名单不需要再提取
+        self.structured_output = structured_output
+        # 学生无关的学校通用章节存储, 默认只在内存中跨请求复用
+        self.school_store = school_store if school_store is not None else SchoolSectionStore()
+        # 按provider的预算限流、优先级排队、自适应并发和重试, 默认进程内共享
+        self.scheduler = scheduler if scheduler is not None else get_default_scheduler()
+        # 各阶段耗时、排队、token和缓存命中的Prometheus指标, 默认进程内共享
+        self.metrics = metrics if metrics is not None else get_default_metrics()
+        # 各阶段prompt的token预算: 渲染前压缩profile、专业推荐和知识库字段, 渲染后计数, 默认进程内共享
+        self.prompt_budget = prompt_budget if prompt_budget is not None else get_default_prompt_budget()
+        # 进程内合并相同的并发调用: 相同prompt的LLM调用只发一次, 相同输入的报告只生成一次(双击、重试)
+        self.llm_flight: SingleFlight = get_single_flight("llm_call", self.metrics)
+        self.report_flight: SingleFlight = get_single_flight("report", self.metrics)
         self.project_name = project_name
-        # self.univ_norm = UniversityNormalization()
-        # self.univ_knowledge = UniversityKnowledge()
-        if output_dir is None:
-            self.output_dir = os.path.join(os.path.dirname(__file__), "output")
-        else:
-            self.output_dir = output_dir
-        os.makedirs(self.output_dir, exist_ok=True)
+        # 学校名称归一化, 进程内共享同一份索引
+        self.univ_norm: UniversityNormalization = get_default_normalizer()
+        self.school_extractor = SchoolNameExtractor(self.univ_norm)
+        # 大学知识库, 默认使用knowledge_base/下的DuckDB文件, 不存在时为None
+        self.univ_knowledge = knowledge if knowledge is not None else get_default_knowledge()
+        # 报告按内容哈希保存, 默认使用进程内共享的存储(REPORT_ARTIFACT_DIR, 默认为本目录下的output)
+        self.artifacts = get_default_artifact_store() if output_dir is None else ArtifactStore(output_dir)
+        self.output_dir = self.artifacts.root
+        # prompt和整条管道只在构造时编译一次, 每次请求直接复用
+        self._prompts: Dict[str, PromptTemplate] = {
+            "recommend_majors": self._majors_prompt(),
+            "recommend_schools": self._schools_prompt(),
+            "recommend_schools_structured": self._schools_structured_prompt(),
+            "school_profile": self._school_profile_prompt(),
+            "school_reasons": self._school_reasons_prompt(),
+            "extract_school_names": self._extract_prompt(),
+        }
+        self._llm_params = self._model_params()
+        self._model_name = _model_name(self._llm_params)
+        # 学校通用章节按生成内容的模型区分, 不同provider/模型之间不复用
+        self._section_model = f"{self.provider}:{self._model_name}" if self._model_name else llm_name
+        self._route = LLMRoute(llm_name, self.llm, self._model_name)
+        # 多provider路由: fallback_llms按顺序作为对冲和故障切换的备选, hedge_stages中的调用超过主LLM的p95
+        # (或hedge_after秒)时对冲, 所有调用在主LLM熔断或失败时切换; 结果缓存在主LLM的缓存key下
+        self.fallback_llms = [name for name in (fallback_llms or []) if name != llm_name]
+        self.hedge_stages = frozenset(hedge_stages)
+        self.router: Optional[HedgedRouter] = None
+        if self.fallback_llms:
+            routes = [self._route]
+            for name in self.fallback_llms:
+                llm = get_llm(name)
+                routes.append(LLMRoute(name, llm, _model_name(_identifying_params(llm))))
+            self.router = HedgedRouter(routes, hedge_after=hedge_after, metrics=self.metrics)
+        # 各LLM实例的with_structured_output版本, 第一次结构化调用时创建
+        self._structured_llms: Dict[int, Optional[Runnable]] = {}
+        self._pipeline = self._build_pipeline()
         # 设置LangSmith tracing
         self._setup_langsmith()
 
@@ -83,10 +311,8 @@ class UniversitySelectionWorkflow:
             if data is not None:
                 print(data)
 
-    @traceable(run_type="chain")
-    def recommend_majors(self, profile: str) -> str:
-        """专业推荐章节 - 独立的LangSmith trace"""
-        prompt = PromptTemplate(
+    def _majors_prompt(self) -> PromptTemplate:
+        return PromptTemplate(
             input_variables=["profile"],
             template=(
                 "You are an expert in US undergraduate university selection. Based on the following student profile, recommend 3 most suitable majors and provide reasons for each.\n"
@@ -95,15 +321,9 @@ class UniversitySelectionWorkflow:
                 f"All output must be in {locale}."
             )
         )
-        chain = LLMChain(llm=self.llm, prompt=prompt)
-        result = chain.run({"profile": profile})
-        self.log("专业推荐结果：", result)
-        return result
 
-    @traceable(run_type="chain")
-    def recommend_schools(self, profile: str, majors_report: str) -> str:
-        """学校推荐章节 - 独立的LangSmith trace"""
-        prompt = PromptTemplate(
+    def _schools_prompt(self) -> PromptTemplate:
+        return PromptTemplate(
             input_variables=["profile", "majors_report"],
             template=(
                 "You are an expert in US undergraduate university selection. Based on the following student profile and major recommendation report, recommend 1 safety school, 1 target school, and 1 reach school, and provide reasons for each.\n"
@@ -119,75 +339,627 @@ class UniversitySelectionWorkflow:
                 "| Reach University | Reason 3 |"
             )
         )
-        chain = LLMChain(llm=self.llm, prompt=prompt)
-        result = chain.run({"profile": profile, "majors_report": majors_report})
-        self.log("学校推荐结果：", result)
-        return result
 
-    @traceable(run_type="chain")
-    def fill_school_info(self, school_name: str, context: Dict[str, Any]) -> str:
-        """学校信息填充章节 - 独立的LangSmith trace"""
-        prompt = PromptTemplate(
+    def _schools_structured_prompt(self) -> PromptTemplate:
+        """结构化输出模式的学校推荐prompt, JSON schema写在模板中(修改schema时检查点自动失效)"""
+        schema = SCHOOL_RECOMMENDATIONS_SCHEMA.replace("{", "{{").replace("}", "}}")
+        return PromptTemplate(
+            input_variables=["profile", "majors_report"],
+            template=(
+                "You are an expert in US undergraduate university selection. Based on the following student profile and major recommendation report, recommend 1 safety school, 1 target school, and 1 reach school, and provide reasons for each.\n"
+                "Student profile:\n{profile}\n"
+                "Major recommendation report:\n{majors_report}\n"
+                "Use the full official name of each school.\n"
+                f"Write the reasons in {locale}.\n"
+                f"Return only a JSON object matching this JSON schema:\n{schema}"
+            )
+        )
+
+    def _school_profile_prompt(self) -> PromptTemplate:
+        """学校通用章节prompt, 与学生无关, 修改后请同步增加SCHOOL_SECTION_VERSION"""
+        return PromptTemplate(
             input_variables=["school_name", "context"],
             template=(
-                "You are an expert in US undergraduate university selection. Based on the following school information, generate a section of the university selection report for this school, including:\n"
-                "1. School description and introduction\n2. Reasons for recommendation\n3. Historical admission data\n4. Admission requirements\n5. Admission rate and overview for Asian students\n"
+                "You are an expert in US undergraduate university selection. Based on the following school information, generate the general part of the university selection report for this school, including:\n"
+                "1. School description and introduction\n2. Historical admission data\n3. Admission requirements\n4. Admission rate and overview for Asian students\n"
                 "School name: {school_name}\nSchool information: {context}\n"
+                "Use a level-3 markdown heading (###) for each part and do not add a title for the school itself.\n"
                 "Please output in markdown format.\n"
                 f"All output must be in {locale}."
             )
         )
-        chain = LLMChain(llm=self.llm, prompt=prompt)
-        result = chain.run({"school_name": school_name, "context": context})
-        self.log(f"学校 {school_name} 详细信息：", result)
+
+    def _school_reasons_prompt(self) -> PromptTemplate:
+        """学生相关的推荐理由prompt, 每份报告单独生成"""
+        return PromptTemplate(
+            input_variables=["school_name", "profile"],
+            template=(
+                "You are an expert in US undergraduate university selection. Based on the following student profile, briefly explain why {school_name} is recommended for this student.\n"
+                "Student profile:\n{profile}\n"
+                "Answer with 2-4 concise markdown bullet points and no heading.\n"
+                f"All output must be in {locale}."
+            )
+        )
+
+    def _extract_prompt(self) -> PromptTemplate:
+        return PromptTemplate(
+            input_variables=["schools_report"],
+            template=(
+                "Please extract the names of 3 universities from the following school recommendation report.\n"
+                "Only return the school names, one per line, nothing else.\n"
+                "All output must be in English.\n\n"
+                "{schools_report}"
+            )
+        )
+
+    def _model_params(self) -> Dict[str, Any]:
+        """当前LLM的模型参数(模型名、temperature等), 作为缓存key的一部分"""
+        return _identifying_params(self.llm)
+
+    def _call_key(self, prompt: str) -> str:
+        """LLM调用的key: 渲染好的prompt、LLM和模型参数, 同时用于缓存和合并相同的并发调用"""
+        return make_cache_key(prompt, self.llm_name, self._llm_params, locale)
+
+    def _report_key(self, profile: str, save: bool) -> str:
+        """
+        报告的key: 空白归一化后的profile、LLM配置和当前的重新生成计划, 用于合并相同的并发报告请求;
+        debug等不影响报告内容的参数不计入
+        """
+        plan = current_plan()
+        payload = {
+            "profile": " ".join(profile.split()),
+            "llm": [self.llm_name] + self.fallback_llms,
+            "params": self._llm_params,
+            "locale": locale,
+            "structured_output": self.structured_output,
+            "regenerate": sorted(plan.targets),
+            "overrides": plan.overrides,
+            "output_dir": self.output_dir if save else None,
+        }
+        data = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def _cache_get(self, stage: str, key: Optional[str]) -> Optional[str]:
+        # 显式重新生成的章节不读取缓存
+        if key is None or llm_cache_bypassed():
+            return None
+        result = self.cache.get(key)
+        self.metrics.record_cache("llm", stage, self.llm_name, result is not None)
+        if result is not None:
+            self.log(f"LLM缓存命中: {key[:12]}")
+        return result
+
+    def _checkpoint_key(self, stage: str, inputs: Dict[str, Any]) -> Optional[str]:
+        if self.checkpoints is None:
+            return None
+        templates = [self._prompts[name].template for name in _CHECKPOINT_PROMPTS[stage]]
+        return make_checkpoint_key(stage, inputs, self.llm_name, self._llm_params, locale, templates)
+
+    def _checkpoint_get(self, stage: str, key: Optional[str], forced: bool) -> Optional[Any]:
+        if key is None or forced:
+            return None
+        result = self.checkpoints.get(key)
+        self.metrics.record_cache("checkpoint", stage, self.llm_name, result is not None)
+        if result is not None:
+            self.log(f"检查点命中: {stage} {key[:12]}")
+        return result
+
+    def _checkpointed(self, stage: str, inputs: Dict[str, Any], compute: Callable[[], Any],
+                      aliases: Iterable[str] = ()) -> Any:
+        """
+        按阶段输入读取检查点, 没有检查点或需要重新生成时调用compute并保存结果;
+        替换内容(overrides)中的阶段直接使用给定内容, aliases为学校章节的学校名称和类别
+        """
+        plan = current_plan()
+        aliases = tuple(aliases)
+        if not aliases and stage in plan.overrides:
+            return plan.overrides[stage]
+        forced = plan.forces(stage, *aliases)
+        key = self._checkpoint_key(stage, inputs)
+        result = self._checkpoint_get(stage, key, forced)
+        if result is not None:
+            return result
+        with bypass_llm_cache() if forced else nullcontext():
+            result = compute()
+        if key is not None:
+            self.checkpoints.set(key, result)
+        return result
+
+    async def _acheckpointed(self, stage: str, inputs: Dict[str, Any], compute: Callable[[], Awaitable[Any]],
+                             aliases: Iterable[str] = (), on_token: Optional[Callable[[str], None]] = None) -> Any:
+        """_checkpointed的异步版本, 直接使用检查点或给定内容时整段内容作为一个token回调"""
+        plan = current_plan()
+        aliases = tuple(aliases)
+        result = plan.overrides.get(stage) if not aliases else None
+        forced = plan.forces(stage, *aliases)
+        key = self._checkpoint_key(stage, inputs)
+        if result is None:
+            result = self._checkpoint_get(stage, key, forced)
+        if result is not None:
+            if on_token is not None:
+                on_token(result)
+            return result
+        with bypass_llm_cache() if forced else nullcontext():
+            result = await compute()
+        if key is not None:
+            self.checkpoints.set(key, result)
+        return result
+
+    def _compact_inputs(self, stage: str, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """按stage的token预算压缩输入; 在检查点之前压缩, 检查点key与实际发给LLM的输入一致"""
+        return self.prompt_budget.compact(stage, self._prompts[stage], inputs, self._model_name)
+
+    def _school_inputs(self, school: str, context: Dict[str, Any], profile: str) -> Dict[str, Any]:
+        """学校章节的输入: 知识库字段按school_profile的预算选取, profile按school_reasons的预算压缩"""
+        context = self._compact_inputs("school_profile", {"school_name": school, "context": context})["context"]
+        profile = self._compact_inputs("school_reasons", {"school_name": school, "profile": profile})["profile"]
+        return {"school_name": school, "context": context, "profile": profile}
+
+    def _structured_llm(self, llm: BaseLanguageModel) -> Optional[Runnable]:
+        """LLM的with_structured_output版本, 模型不支持tool calling时为None(按prompt中的JSON schema输出文本)"""
+        key = id(llm)
+        if key not in self._structured_llms:
+            try:
+                self._structured_llms[key] = llm.with_structured_output(SchoolRecommendations)
+            except NotImplementedError:
+                self._structured_llms[key] = None
+        return self._structured_llms[key]
+
+    def _invoke_chain(self, stage: str, inputs: Dict[str, Any], structured: bool = False) -> str:
+        """
+        同步调用stage对应的prompt -> LLM -> 文本, 优先读取缓存;
+        渲染好的prompt同时用于缓存key和LLM调用, 直接调用LLM而不经过RunnableSequence, 省去每一步的callback开销。
+        structured为True时使用LLM的结构化输出, 返回校验后的学校推荐JSON
+        """
+        prompt_value = self._prompts[stage].format_prompt(**inputs)
+        prompt = prompt_value.to_string()
+        # 只编码一次, token数传给调度器(预算和LLM调用指标)
+        prompt_tokens = self.prompt_budget.measure(stage, prompt, self.llm_name, self._model_name)
+        call_key = self._call_key(prompt)
+        key = call_key if self.cache is not None else None
+        result = self._cache_get(stage, key)
+        if result is not None:
+            return result
+
+        def call(route: LLMRoute) -> str:
+            def run() -> str:
+                if structured:
+                    llm = self._structured_llm(route.llm) or route.llm
+                    return _recommendations_json(llm.invoke(prompt_value))
+                return _output_text(route.llm.invoke(prompt_value))
+            return self.scheduler.call(route.provider, run, prompt, stage, route.llm_name, route.model_name,
+                                       prompt_tokens=prompt_tokens)
+
+        def compute() -> str:
+            if self.router is None:
+                result = call(self._route)
+            else:
+                result = self.router.invoke(stage, call, hedge=stage in self.hedge_stages)
+            if key is not None:
+                self.cache.set(key, result)
+            return result
+
+        # 相同prompt的调用正在进行时(例如很多学生同时生成同一所学校的章节)等待其结果, 不重复调用LLM
+        return self.llm_flight.do((call_key, structured), compute, stage, self.llm_name)
+
+    async def _ainvoke_chain(self, stage: str, inputs: Dict[str, Any],
+                             on_token: Optional[Callable[[str], None]] = None, structured: bool = False) -> str:
+        """
+        异步调用stage对应的prompt -> LLM -> 文本, 等待期间不阻塞事件循环, 优先读取缓存; 传入on_token时按token流式回调。
+        structured为True时使用LLM的结构化输出(不流式输出), 返回校验后的学校推荐JSON
+        """
+        prompt_value = self._prompts[stage].format_prompt(**inputs)
+        prompt = prompt_value.to_string()
+        # 只编码一次, token数传给调度器(预算和LLM调用指标)
+        prompt_tokens = self.prompt_budget.measure(stage, prompt, self.llm_name, self._model_name)
+        call_key = self._call_key(prompt)
+        key = call_key if self.cache is not None else None
+        result = self._cache_get(stage, key)
+        if result is not None:
+            if on_token is not None:
+                on_token(result)
+            return result
+
+        async def call(route: LLMRoute, commit: Callable[[], bool]) -> str:
+            parts: List[str] = []
+
+            async def run() -> str:
+                if structured:
+                    llm = self._structured_llm(route.llm) or route.llm
+                    output = _recommendations_json(await llm.ainvoke(prompt_value))
+                elif on_token is None:
+                    output = _output_text(await route.llm.ainvoke(prompt_value))
+                else:
+                    async for chunk in route.llm.astream(prompt_value):
+                        delta = _output_text(chunk)
+                        if not delta:
+                            continue
+                        # 第一个token决定对冲中哪个LLM胜出, 落选的调用不再输出
+                        if not parts and not commit():
+                            raise asyncio.CancelledError()
+                        parts.append(delta)
+                        on_token(delta)
+                    output = "".join(parts)
+                return output
+
+            # 已经推送给调用方的token无法撤回, 流式输出开始后失败不再重试
+            return await self.scheduler.acall(route.provider, run, prompt, stage, route.llm_name, route.model_name,
+                                              can_retry=lambda: not parts, prompt_tokens=prompt_tokens)
+
+        leader = False
+
+        async def compute() -> str:
+            nonlocal leader
+            leader = True
+            if self.router is None:
+                result = await call(self._route, lambda: True)
+            else:
+                result = await self.router.ainvoke(stage, call, hedge=stage in self.hedge_stages)
+            if key is not None:
+                self.cache.set(key, result)
+            return result
+
+        result = await self.llm_flight.ado((call_key, structured), compute, stage, self.llm_name)
+        # 等待其他调用方结果时没有逐token输出, 与缓存命中一样整段回调一次
+        if not leader and on_token is not None:
+            on_token(result)
         return result
 
     @traceable(run_type="chain")
-    def extract_school_names(self, schools_report: str) -> list:
-        """从学校推荐报告中提取学校名称"""
-        import re
-        
-        # 方法1: 使用正则表达式提取学校名称
-        patterns = [
-            r'([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*\s+(?:University|College|Institute))',
-            r'([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*\s+(?:大学|学院))',
-            r'([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*\s+(?:University|College))',
-        ]
-        
-        school_names = []
-        for pattern in patterns:
-            matches = re.findall(pattern, schools_report, re.IGNORECASE)
-            school_names.extend(matches)
-        
-        # 去重并过滤
-        school_names = list(set(school_names))
-        school_names = [name.strip() for name in school_names if len(name.strip()) > 3]
-        
-        # 如果正则表达式没有找到足够的学校，使用LLM提取
-        if len(school_names) < 3:
+    def recommend_majors(self, profile: str) -> str:
+        """专业推荐章节 - 独立的LangSmith trace"""
+        with self.metrics.time_stage("recommend_majors", self.llm_name):
+            inputs = self._compact_inputs("recommend_majors", {"profile": profile})
+            result = self._checkpointed("recommend_majors", inputs,
+                                        lambda: self._invoke_chain("recommend_majors", inputs))
+        self.log("专业推荐结果：", result)
+        return result
+
+    @traceable(run_type="chain")
+    async def arecommend_majors(self, profile: str, on_token: Optional[Callable[[str], None]] = None) -> str:
+        """专业推荐章节（异步版本）"""
+        with self.metrics.time_stage("recommend_majors", self.llm_name):
+            inputs = self._compact_inputs("recommend_majors", {"profile": profile})
+            result = await self._acheckpointed("recommend_majors", inputs,
+                                               lambda: self._ainvoke_chain("recommend_majors", inputs, on_token),
+                                               on_token=on_token)
+        self.log("专业推荐结果：", result)
+        return result
+
+    @traceable(run_type="chain")
+    def recommend_schools(self, profile: str, majors_report: str) -> str:
+        """学校推荐章节 - 独立的LangSmith trace"""
+        with self.metrics.time_stage("recommend_schools", self.llm_name):
+            inputs = self._compact_inputs("recommend_schools", {"profile": profile, "majors_report": majors_report})
+            result = self._checkpointed("recommend_schools", inputs,
+                                        lambda: self._invoke_chain("recommend_schools", inputs))
+        self.log("学校推荐结果：", result)
+        return result
+
+    @traceable(run_type="chain")
+    async def arecommend_schools(self, profile: str, majors_report: str,
+                                 on_token: Optional[Callable[[str], None]] = None) -> str:
+        """学校推荐章节（异步版本）"""
+        with self.metrics.time_stage("recommend_schools", self.llm_name):
+            inputs = self._compact_inputs("recommend_schools", {"profile": profile, "majors_report": majors_report})
+            result = await self._acheckpointed("recommend_schools", inputs,
+                                               lambda: self._ainvoke_chain("recommend_schools", inputs, on_token),
+                                               on_token=on_token)
+        self.log("学校推荐结果：", result)
+        return result
+
+    def _parse_recommendations(self, result: str) -> SchoolRecommendations:
+        """结构化学校推荐(已校验的JSON)转换为记录, 学校名称归一化为标准名称; 归一化后学校重复时抛出ValueError"""
+        return parse_school_recommendations(result).normalized(self.univ_norm.normalize)
+
+    @traceable(run_type="chain")
+    def recommend_school_list(self, profile: str, majors_report: str) -> Optional[SchoolRecommendations]:
+        """结构化输出模式的学校推荐章节, LLM输出不符合schema时返回None(改用markdown表格)"""
+        with self.metrics.time_stage("recommend_schools", self.llm_name):
+            inputs = self._compact_inputs("recommend_schools_structured",
+                                          {"profile": profile, "majors_report": majors_report})
             try:
-                extract_prompt = PromptTemplate(
-                    input_variables=["schools_report"],
-                    template=(
-                        "Please extract the names of 3 universities from the following school recommendation report.\n"
-                        "Only return the school names, one per line, nothing else.\n"
-                        "All output must be in English.\n\n"
-                        "{schools_report}"
-                    )
+                # 指定重新生成recommend_schools时同样重新生成结构化结果
+                result = self._checkpointed(
+                    "recommend_schools_structured", inputs,
+                    lambda: self._invoke_chain("recommend_schools_structured", inputs, structured=True),
+                    aliases=("recommend_schools",))
+                return self._parse_recommendations(result)
+            except ValueError as e:
+                self.log(f"结构化学校推荐不符合schema, 改用markdown表格: {e}")
+                return None
+
+    @traceable(run_type="chain")
+    async def arecommend_school_list(self, profile: str, majors_report: str) -> Optional[SchoolRecommendations]:
+        """结构化输出模式的学校推荐章节（异步版本）"""
+        with self.metrics.time_stage("recommend_schools", self.llm_name):
+            inputs = self._compact_inputs("recommend_schools_structured",
+                                          {"profile": profile, "majors_report": majors_report})
+            try:
+                result = await self._acheckpointed(
+                    "recommend_schools_structured", inputs,
+                    lambda: self._ainvoke_chain("recommend_schools_structured", inputs, structured=True),
+                    aliases=("recommend_schools",))
+                return self._parse_recommendations(result)
+            except ValueError as e:
+                self.log(f"结构化学校推荐不符合schema, 改用markdown表格: {e}")
+                return None
+
+    def _use_structured_output(self) -> bool:
+        """直接给定了学校推荐表时按markdown模式处理"""
+        return self.structured_output and "recommend_schools" not in current_plan().overrides
+
+    def _recommended_school_names(self, recommendations: SchoolRecommendations) -> List[str]:
+        """结构化学校推荐中的学校名单, 直接给定了学校名单时以给定的为准"""
+        plan = current_plan()
+        if "extract_school_names" in plan.overrides:
+            return plan.overrides["extract_school_names"]
+        return self._finalize_school_names(recommendations.school_names())
+
+    def _schools_report(self, profile: str, majors_report: str) -> Tuple[str, Optional[List[str]]]:
+        """学校推荐表和学校名单, 学校名单为None时需要从推荐表中提取"""
+        recommendations = self.recommend_school_list(profile, majors_report) if self._use_structured_output() else None
+        if recommendations is None:
+            return self.recommend_schools(profile, majors_report), None
+        return recommendations.to_markdown(), self._recommended_school_names(recommendations)
+
+    async def _aschools_report(self, profile: str, majors_report: str,
+                               on_token: Optional[Callable[[str], None]] = None) -> Tuple[str, Optional[List[str]]]:
+        """_schools_report的异步版本, 结构化输出模式下渲染好的推荐表整段作为一个token回调"""
+        recommendations = None
+        if self._use_structured_output():
+            recommendations = await self.arecommend_school_list(profile, majors_report)
+        if recommendations is None:
+            return await self.arecommend_schools(profile, majors_report, on_token), None
+        schools_report = recommendations.to_markdown()
+        if on_token is not None:
+            on_token(schools_report)
+        return schools_report, self._recommended_school_names(recommendations)
+
+    def _assemble_school_section(self, school_name: str, school_profile: str, reasons: str) -> str:
+        return f"{_school_heading(school_name)}{school_profile}{_REASONS_HEADING}{reasons}"
+
+    @traceable(run_type="chain")
+    def school_profile(self, school_name: str, context: Dict[str, Any]) -> str:
+        """学校通用章节, 按学校名称和locale生成一次后跨学生复用"""
+        created = []
+
+        def create() -> str:
+            created.append(school_name)
+            return self._invoke_chain("school_profile", {"school_name": school_name, "context": context})
+
+        # 显式重新生成该学校的章节时(跳过LLM缓存)通用章节也重新生成, 覆盖共用的内容
+        result = self.school_store.get_or_create(school_name, locale, create, refresh=llm_cache_bypassed(),
+                                                 model=self._section_model)
+        self.metrics.record_cache("school_section", "school_profile", self.llm_name, not created)
+        return result
+
+    @traceable(run_type="chain")
+    async def aschool_profile(self, school_name: str, context: Dict[str, Any],
+                              on_token: Optional[Callable[[str], None]] = None) -> str:
+        """学校通用章节（异步版本）"""
+        created = []
+
+        def create():
+            created.append(school_name)
+            return self._ainvoke_chain("school_profile", {"school_name": school_name, "context": context}, on_token)
+
+        result = await self.school_store.aget_or_create(school_name, locale, create, refresh=llm_cache_bypassed(),
+                                                        model=self._section_model)
+        self.metrics.record_cache("school_section", "school_profile", self.llm_name, not created)
+        return result
+
+    @traceable(run_type="chain")
+    def fill_school_info(self, school_name: str, context: Dict[str, Any], profile: str = "") -> str:
+        """学校信息填充章节 - 独立的LangSmith trace, 只有推荐理由按学生生成"""
+        with self.metrics.time_stage("fill_school_info", self.llm_name):
+            school_profile = self.school_profile(school_name, context)
+            reasons = self._invoke_chain("school_reasons", {"school_name": school_name, "profile": profile})
+            result = self._assemble_school_section(school_name, school_profile, reasons)
+        self.log(f"学校 {school_name} 详细信息：", result)
+        return result
+
+    @traceable(run_type="chain")
+    async def afill_school_info(self, school_name: str, context: Dict[str, Any], profile: str = "",
+                                on_token: Optional[Callable[[str], None]] = None) -> str:
+        """
+        学校信息填充章节（异步版本）, 通用章节和推荐理由并发生成。
+        传入on_token时按章节顺序回调: 标题、通用章节, 再是推荐理由的标题和推荐理由;
+        通用章节完成前推荐理由的token先缓存, 所有token拼接后与返回的章节一致
+        """
+        reasons_inputs = {"school_name": school_name, "profile": profile}
+        with self.metrics.time_stage("fill_school_info", self.llm_name):
+            if on_token is None:
+                school_profile, reasons = await asyncio.gather(
+                    self.aschool_profile(school_name, context),
+                    self._ainvoke_chain("school_reasons", reasons_inputs),
                 )
-                extract_chain = LLMChain(llm=self.llm, prompt=extract_prompt)
-                extracted_text = extract_chain.run({"schools_report": schools_report})
-                
-                # 解析LLM返回的学校名称
-                llm_schools = [line.strip() for line in extracted_text.split('\n') 
-                              if line.strip() and len(line.strip()) > 3]
-                school_names.extend(llm_schools[:3])
-                school_names = list(set(school_names))  # 去重
-                
-            except Exception as e:
-                if self.debug:
-                    print(f"[DEBUG] LLM提取学校名称失败: {e}")
-        
+            else:
+                profile_parts: List[str] = []
+                pending_reasons: Optional[List[str]] = []
+
+                def on_profile_token(delta: str) -> None:
+                    profile_parts.append(delta)
+                    on_token(delta)
+
+                def on_reasons_token(delta: str) -> None:
+                    if pending_reasons is None:
+                        on_token(delta)
+                    else:
+                        pending_reasons.append(delta)
+
+                async def profile_then_reasons() -> str:
+                    nonlocal pending_reasons
+                    text = await self.aschool_profile(school_name, context, on_profile_token)
+                    # 共用的通用章节直接命中或等待其他请求生成时没有token回调, 整段输出
+                    if not profile_parts:
+                        on_token(text)
+                    on_token(_REASONS_HEADING + "".join(pending_reasons))
+                    pending_reasons = None
+                    return text
+
+                on_token(_school_heading(school_name))
+                school_profile, reasons = await asyncio.gather(
+                    profile_then_reasons(),
+                    self._ainvoke_chain("school_reasons", reasons_inputs, on_reasons_token),
+                )
+            result = self._assemble_school_section(school_name, school_profile, reasons)
+        self.log(f"学校 {school_name} 详细信息：", result)
+        return result
+
+    def school_contexts(self, school_names: List[str]) -> Dict[str, Dict[str, Any]]:
+        """从知识库批量查询报告中所有学校的信息, 查不到的学校使用占位符"""
+        records = self.univ_knowledge.query_many(school_names) if self.univ_knowledge is not None else {}
+        contexts = {school: records.get(school) or SCHOOL_CONTEXT_PLACEHOLDER for school in school_names}
+        self.log("知识库查询结果：", contexts)
+        return contexts
+
+    def fill_school_sections(self, school_names: List[str], profile: str = "") -> List[str]:
+        """并发填充所有学校的信息, 返回的章节顺序与school_names一致"""
+        contexts = self.school_contexts(school_names)
+        submitted = time.perf_counter()
+
+        def fill_one(index: int, school: str) -> str:
+            self.metrics.observe_queue_wait("fill_school_info", self.llm_name, time.perf_counter() - submitted)
+            inputs = self._school_inputs(school, contexts[school], profile)
+            return self._checkpointed("fill_school_info", inputs, lambda: self.fill_school_info(**inputs),
+                                      _school_aliases(index, school))
+
+        if self.max_concurrency == 1 or len(school_names) <= 1:
+            return [fill_one(i, school) for i, school in enumerate(school_names)]
+
+        max_workers = min(self.max_concurrency, len(school_names))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fill-school-info") as executor:
+            # 每个任务复制一份当前context, 调度优先级等contextvars在工作线程中同样生效; 按输入顺序取结果
+            futures = [executor.submit(contextvars.copy_context().run, fill_one, i, school)
+                       for i, school in enumerate(school_names)]
+            return [future.result() for future in futures]
+
+    async def afill_school_sections(self, school_names: List[str], profile: str = "",
+                                    emit: Optional[Callable[[Dict[str, Any]], None]] = None) -> List[str]:
+        """并发填充所有学校的信息（异步版本）, 并发数受max_concurrency限制; 传入emit时推送token和章节事件"""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        contexts = await asyncio.to_thread(self.school_contexts, school_names)
+
+        async def fill_one(index: int, school: str) -> str:
+            on_token = None
+            if emit is not None:
+                on_token = lambda delta: emit({"type": "token", "stage": "fill_school_info", "school": school, "index": index, "delta": delta})
+            section = await self._afill_section(school, contexts[school], profile, semaphore,
+                                                _school_aliases(index, school), on_token)
+            if emit is not None:
+                emit({"type": "section", "stage": "fill_school_info", "school": school, "index": index, "content": section})
+            return section
+
+        # gather按输入顺序返回结果, 保证章节顺序不变
+        return list(await asyncio.gather(*(fill_one(i, school) for i, school in enumerate(school_names))))
+
+    async def _afill_section(self, school: str, context: Dict[str, Any], profile: str, semaphore: asyncio.Semaphore,
+                             aliases: Iterable[str] = (), on_token: Optional[Callable[[str], None]] = None) -> str:
+        """带检查点的单个学校章节, 生成时占用semaphore的一个槽位"""
+        inputs = self._school_inputs(school, context, profile)
+
+        async def compute() -> str:
+            waiting = time.perf_counter()
+            async with semaphore:
+                self.metrics.observe_queue_wait("fill_school_info", self.llm_name, time.perf_counter() - waiting)
+                return await self.afill_school_info(**inputs, on_token=on_token)
+
+        return await self._acheckpointed("fill_school_info", inputs, compute, aliases, on_token)
+
+    def _table_row_school(self, cell: str) -> Optional[str]:
+        """学校推荐表某一行第一列的学校名称, 与extract_school_names使用相同的单元格归一化"""
+        return self.school_extractor.school_from_cell(cell)
+
+    async def _apipelined_report(self, profile: str, emit: Optional[Callable[[Dict[str, Any]], None]] = None) -> str:
+        """
+        流水线模式生成报告: 学校推荐表流式生成, 每解析出完整的一行就开始该学校的章节; profile中列出的目标学校
+        与专业推荐同时开始。学校章节只依赖学校和profile, 最终的学校名单仍从完整的学校推荐报告中提取,
+        不在名单中的预先生成随即取消。指定了需要重新生成的章节时不预先生成(学校类别要等名单确定后才知道)
+        """
+        emit = emit or (lambda event: None)
+        plan = current_plan()
+        speculate = not plan.targets
+        # 直接给定了学校推荐表或学校名单时不需要按profile猜测
+        speculate_profile = speculate and not {"recommend_schools", "extract_school_names"} & plan.overrides.keys()
+        # 结构化输出模式下推荐表和学校名单同时得到, 不需要按表格行猜测
+        speculate_rows = speculate and not self._use_structured_output()
+        # 预先生成的章节不占用名单中学校的并发槽位
+        semaphore = asyncio.Semaphore(self.max_concurrency + _MAX_SPECULATIVE_SCHOOLS)
+        tasks: Dict[str, asyncio.Task] = {}
+        speculative: List[str] = []
+        rows = _TableRowStream()
+
+        def start(school: str, aliases: List[str]) -> None:
+            async def fill() -> str:
+                contexts = await asyncio.to_thread(self.school_contexts, [school])
+                return await self._afill_section(school, contexts[school], profile, semaphore, aliases)
+
+            task = asyncio.ensure_future(fill())
+            task.add_done_callback(_consume_exception)
+            tasks[school] = task
+
+        def speculate_on(school: Optional[str]) -> None:
+            if school is not None and school not in tasks:
+                self.log(f"预先生成学校章节: {school}")
+                speculative.append(school)
+                start(school, [school])
+
+        def on_schools_token(delta: str) -> None:
+            emit({"type": "token", "stage": "recommend_schools", "delta": delta})
+            if speculate_rows:
+                for cell in rows.feed(delta):
+                    speculate_on(self._table_row_school(cell))
+
+        try:
+            if speculate_profile:
+                for school in self.school_extractor.scan(profile)[:_MAX_SPECULATIVE_SCHOOLS]:
+                    speculate_on(school)
+
+            majors_report = await self.arecommend_majors(
+                profile, lambda delta: emit({"type": "token", "stage": "recommend_majors", "delta": delta}))
+            emit({"type": "section", "stage": "recommend_majors", "content": majors_report})
+
+            schools_report, school_names = await self._aschools_report(profile, majors_report, on_schools_token)
+            emit({"type": "section", "stage": "recommend_schools", "content": schools_report})
+
+            if school_names is None:
+                school_names = await self.aextract_school_names(schools_report)
+            self.log("提取的学校名称：", school_names)
+            emit({"type": "section", "stage": "extract_school_names", "content": school_names})
+
+            for school in speculative:
+                used = school in school_names
+                self.metrics.record_cache("speculative", "fill_school_info", self.llm_name, used)
+                if not used:
+                    tasks.pop(school).cancel()
+            for index, school in enumerate(school_names):
+                if school not in tasks:
+                    start(school, _school_aliases(index, school))
+
+            async def finish(index: int, school: str) -> str:
+                section = await tasks[school]
+                emit({"type": "section", "stage": "fill_school_info", "school": school, "index": index, "content": section})
+                return section
+
+            school_sections = await asyncio.gather(*(finish(i, school) for i, school in enumerate(school_names)))
+        finally:
+            for task in tasks.values():
+                task.cancel()
+        return self._assemble_report(majors_report, schools_report, "\n\n".join(school_sections))
+
+    def _merge_llm_school_names(self, school_names: List[str], extracted_text: str) -> List[str]:
+        """解析LLM返回的学校名称, 归一化后与表格中提取的结果合并"""
+        llm_schools = [line.strip() for line in extracted_text.split('\n') 
+                      if line.strip() and len(line.strip()) > 3]
+        school_names = list(school_names)
+        for name in llm_schools[:3]:
+            name = self.univ_norm.normalize(name) or name
+            if name not in school_names:
+                school_names.append(name)
+        return school_names
+
+    def _finalize_school_names(self, school_names: List[str]) -> List[str]:
         # 如果还是没有找到足够的学校，使用默认名称
         if len(school_names) < 3:
             school_names = ["Safety University", "Target University", "Reach University"]
@@ -200,280 +972,286 @@ class UniversitySelectionWorkflow:
         
         return school_names[:3]
 
-    @traceable(run_type="chain", name="选校报告Run")
-    def run(self, profile_input: str) -> str:
-        """主workflow - 使用管道操作符连接各个步骤"""
-        profile = read_profile(profile_input)
-        self.log("学生profile：", profile)
-        
-        # 定义各个步骤的函数
-        def recommend_majors_step(profile: str) -> str:
-            """专业推荐步骤"""
-            return self.recommend_majors(profile)
-        
-        def recommend_schools_step(inputs: dict) -> dict:
-            """学校推荐步骤"""
-            profile = inputs["profile"]
-            majors_report = inputs["majors_report"]
-            schools_report = self.recommend_schools(profile, majors_report)
-            return {"profile": profile, "majors_report": majors_report, "schools_report": schools_report}
-        
-        def extract_schools_step(inputs: dict) -> dict:
-            """提取学校名称步骤"""
-            schools_report = inputs["schools_report"]
-            school_names = self.extract_school_names(schools_report)
-            self.log("提取的学校名称：", school_names)
-            return {**inputs, "school_names": school_names}
-        
-        def fill_school_info_step(inputs: dict) -> dict:
-            """填充学校信息步骤"""
-            school_names = inputs["school_names"]
-            school_sections = []
-            
-            for school in school_names:
-                # context = self.univ_knowledge.query(school)  # Placeholder
-                context = {"desc": "学校信息占位符"}
-                section = self.fill_school_info(school, context)
-                school_sections.append(section)
-            
-            full_school_report = "\n\n".join(school_sections)
-            return {**inputs, "full_school_report": full_school_report}
-        
-        def generate_final_report_step(inputs: dict) -> str:
-            """生成最终报告步骤"""
-            majors_report = inputs["majors_report"]
-            schools_report = inputs["schools_report"]
-            full_school_report = inputs["full_school_report"]
-            
-            final_report = f"# Major report \n\n{majors_report}\n\n# University selection report\n\n{schools_report}\n\n{full_school_report}"
-            self.log("最终报告：", final_report)
-            return final_report
-        
-        
-        # 如果没有LangSmith或出错，使用普通方式
-        # 定义管道（普通版本）
-        def recommend_majors_step_plain(profile: str) -> str:
-            """专业推荐步骤（普通版本）"""
-            return self.recommend_majors(profile)
-        
-        def recommend_schools_step_plain(inputs: dict) -> dict:
-            """学校推荐步骤（普通版本）"""
-            profile = inputs["profile"]
-            majors_report = inputs["majors_report"]
-            schools_report = self.recommend_schools(profile, majors_report)
-            return {"profile": profile, "majors_report": majors_report, "schools_report": schools_report}
-        
-        def extract_schools_step_plain(inputs: dict) -> dict:
-            """提取学校名称步骤（普通版本）"""
-            schools_report = inputs["schools_report"]
-            school_names = self.extract_school_names(schools_report)
-            self.log("提取的学校名称：", school_names)
-            return {**inputs, "school_names": school_names}
-        
-        def fill_school_info_step_plain(inputs: dict) -> dict:
-            """填充学校信息步骤（普通版本）"""
-            school_names = inputs["school_names"]
-            school_sections = []
-            
-            for school in school_names:
-                # context = self.univ_knowledge.query(school)  # Placeholder
-                context = {"desc": "学校信息占位符"}
-                section = self.fill_school_info(school, context)
-                school_sections.append(section)
-            
-            full_school_report = "\n\n".join(school_sections)
-            return {**inputs, "full_school_report": full_school_report}
-        
-        def generate_final_report_step_plain(inputs: dict) -> str:
-            """生成最终报告步骤（普通版本）"""
-            majors_report = inputs["majors_report"]
-            schools_report = inputs["schools_report"]
-            full_school_report = inputs["full_school_report"]
-            
+    @traceable(run_type="chain")
+    def extract_school_names(self, schools_report: str) -> list:
+        """从学校推荐报告中提取学校名称"""
+        with self.metrics.time_stage("extract_school_names", self.llm_name):
+            inputs = {"schools_report": schools_report}
+            return self._checkpointed("extract_school_names", inputs,
+                                      lambda: self._extract_school_names(schools_report))
+
+    def _extract_school_names(self, schools_report: str) -> list:
+        # 学校推荐表(不足时加上正文中提到的学校), 按保底、匹配、冲刺排序
+        school_names = self.school_extractor.extract(schools_report)
+
+        # 如果归一化后的学校不足3所，才使用LLM提取
+        if len(school_names) < 3:
+            try:
+                inputs = self._compact_inputs("extract_school_names", {"schools_report": schools_report})
+                extracted_text = self._invoke_chain("extract_school_names", inputs)
+                school_names = self._merge_llm_school_names(school_names, extracted_text)
+            except Exception as e:
+                if self.debug:
+                    print(f"[DEBUG] LLM提取学校名称失败: {e}")
+
+        return self._finalize_school_names(school_names)
+
+    @traceable(run_type="chain")
+    async def aextract_school_names(self, schools_report: str) -> list:
+        """从学校推荐报告中提取学校名称（异步版本）"""
+        with self.metrics.time_stage("extract_school_names", self.llm_name):
+            inputs = {"schools_report": schools_report}
+            return await self._acheckpointed("extract_school_names", inputs,
+                                             lambda: self._aextract_school_names(schools_report))
+
+    async def _aextract_school_names(self, schools_report: str) -> list:
+        # 学校推荐表(不足时加上正文中提到的学校), 按保底、匹配、冲刺排序
+        school_names = self.school_extractor.extract(schools_report)
+
+        if len(school_names) < 3:
+            try:
+                inputs = self._compact_inputs("extract_school_names", {"schools_report": schools_report})
+                extracted_text = await self._ainvoke_chain("extract_school_names", inputs)
+                school_names = self._merge_llm_school_names(school_names, extracted_text)
+            except Exception as e:
+                if self.debug:
+                    print(f"[DEBUG] LLM提取学校名称失败: {e}")
+
+        return self._finalize_school_names(school_names)
+
+    def _assemble_report(self, majors_report: str, schools_report: str, full_school_report: str) -> str:
+        """拼接最终报告, 普通、异步和流式模式共用"""
+        with self.metrics.time_stage("assemble_report", self.llm_name):
             final_report = f"# Major report \n\n{majors_report}\n\n# University report\n\n{schools_report}\n\n{full_school_report}"
-            self.log("最终报告：", final_report)
-            return final_report
-        
-        # 创建普通管道流程
-        from langchain.schema.runnable import RunnablePassthrough, RunnableLambda
-        import markdown as mdlib
-        
-        def markdown_to_html_step(md_content: str) -> str:
-            """将markdown内容渲染为HTML"""
-            return mdlib.markdown(md_content, extensions=['tables', 'fenced_code'])
-        
-        pipeline_plain = (
-            {"profile": RunnablePassthrough()} 
-            | {"profile": RunnablePassthrough(), "majors_report": RunnableLambda(recommend_majors_step_plain)}
-            | RunnableLambda(recommend_schools_step_plain)
-            | RunnableLambda(extract_schools_step_plain)
-            | RunnableLambda(fill_school_info_step_plain)
-            | RunnableLambda(generate_final_report_step_plain)
-            #| RunnableLambda(markdown_to_html_step)
+        self.log("最终报告：", final_report)
+        return final_report
+
+    def _recommend_majors_step(self, profile: str) -> str:
+        """专业推荐步骤"""
+        return self.recommend_majors(profile)
+
+    async def _arecommend_majors_step(self, profile: str) -> str:
+        """专业推荐步骤（异步版本）"""
+        return await self.arecommend_majors(profile)
+
+    def _recommend_schools_step(self, inputs: dict) -> dict:
+        """学校推荐步骤, 结构化输出模式下同时得到学校名单"""
+        schools_report, school_names = self._schools_report(inputs["profile"], inputs["majors_report"])
+        return {**inputs, "schools_report": schools_report, "school_names": school_names}
+
+    async def _arecommend_schools_step(self, inputs: dict) -> dict:
+        """学校推荐步骤（异步版本）"""
+        schools_report, school_names = await self._aschools_report(inputs["profile"], inputs["majors_report"])
+        return {**inputs, "schools_report": schools_report, "school_names": school_names}
+
+    def _extract_schools_step(self, inputs: dict) -> dict:
+        """提取学校名称步骤, 已经有结构化的学校名单时跳过"""
+        school_names = inputs["school_names"]
+        if school_names is None:
+            school_names = self.extract_school_names(inputs["schools_report"])
+        self.log("提取的学校名称：", school_names)
+        return {**inputs, "school_names": school_names}
+
+    async def _aextract_schools_step(self, inputs: dict) -> dict:
+        """提取学校名称步骤（异步版本）"""
+        school_names = inputs["school_names"]
+        if school_names is None:
+            school_names = await self.aextract_school_names(inputs["schools_report"])
+        self.log("提取的学校名称：", school_names)
+        return {**inputs, "school_names": school_names}
+
+    def _fill_school_info_step(self, inputs: dict) -> dict:
+        """填充学校信息步骤, 各学校并发生成"""
+        school_sections = self.fill_school_sections(inputs["school_names"], inputs["profile"])
+        return {**inputs, "full_school_report": "\n\n".join(school_sections)}
+
+    async def _afill_school_info_step(self, inputs: dict) -> dict:
+        """填充学校信息步骤（异步版本）, 各学校并发生成"""
+        school_sections = await self.afill_school_sections(inputs["school_names"], inputs["profile"])
+        return {**inputs, "full_school_report": "\n\n".join(school_sections)}
+
+    def _final_report_step(self, inputs: dict) -> str:
+        """生成最终报告步骤"""
+        return self._assemble_report(inputs["majors_report"], inputs["schools_report"], inputs["full_school_report"])
+
+    async def _afinal_report_step(self, inputs: dict) -> str:
+        """生成最终报告步骤（异步版本）, 直接在事件循环中拼接, 不占用线程池"""
+        return self._final_report_step(inputs)
+
+    def _build_pipeline(self) -> Runnable:
+        """
+        用管道操作符连接各个步骤, 构造时编译一次;
+        每个步骤同时提供同步和异步实现, run()用invoke, arun()用ainvoke
+        """
+        return (
+            {
+                "profile": RunnablePassthrough(),
+                "majors_report": RunnableLambda(self._recommend_majors_step, afunc=self._arecommend_majors_step),
+            }
+            | RunnableLambda(self._recommend_schools_step, afunc=self._arecommend_schools_step)
+            | RunnableLambda(self._extract_schools_step, afunc=self._aextract_schools_step)
+            | RunnableLambda(self._fill_school_info_step, afunc=self._afill_school_info_step)
+            | RunnableLambda(self._final_report_step, afunc=self._afinal_report_step)
         )
-        
-        # 执行普通管道
-        result = pipeline_plain.invoke(profile)
-        
-        # 保存HTML到静态文件
-        html_output_path = os.path.join(self.output_dir, 'UniversitySelectionReport.html')
-        css_path = os.path.join(self.output_dir, 'report_style.css')
-        app_js_path = os.path.join(self.output_dir, 'report_app.js')
-        marked_js_path = os.path.join(self.output_dir, 'marked.min.js')
-        
-        # Download marked.js if not exists
-        if not os.path.exists(marked_js_path):
-            import urllib.request
-            url = "https://cdn.jsdelivr.net/npm/marked/marked.min.js"
-            urllib.request.urlretrieve(url, marked_js_path)
-        
-        # React/JSX template (pass raw markdown, not HTML)
-        react_html = f"""
-            {result}
+
+    @traceable(run_type="chain", name="选校报告Run")
+    def run(self, profile_input: str, save: bool = True, regenerate: Iterable[str] = (),
+            overrides: Optional[Dict[str, Any]] = None) -> str:
         """
-        with open(html_output_path, 'w', encoding='utf-8') as f:
-            f.write(react_html)
-        print(f"\nHTML报告已保存为: {html_output_path}\n")
-        
-        # 如果CSS文件不存在则创建一个美观的样式
-        if not os.path.exists(css_path):
-            with open(css_path, 'w', encoding='utf-8') as f:
-                f.write('''
-body {
-  font-family: "Segoe UI", "Helvetica Neue", Arial, "Liberation Sans", sans-serif;
-  background: #f8f9fa;
-  color: #222;
-  margin: 0;
-  padding: 40px 0;
-}
+        主workflow - 执行构造时编译好的管道; save为False时不写入output_dir, 只返回报告。
+        各阶段优先使用检查点, regenerate指定需要重新生成的章节, overrides替换指定阶段的内容(见report_checkpoints)
+        """
+        profile = read_profile(profile_input)
+        self.log("学生profile：", profile)
+        with self.metrics.time_stage("report", self.llm_name), _regeneration_scope(regenerate, overrides):
+            # 相同输入的报告正在生成时(双击、客户端重试)等待同一个结果
+            return self.report_flight.do(self._report_key(profile, save), lambda: self._run_pipeline(profile, save),
+                                         "report", self.llm_name)
 
-h1, h2, h3 {
-  color: #2c3e50;
-  margin-top: 1.5em;
-}
+    def _run_pipeline(self, profile: str, save: bool) -> str:
+        result = self._pipeline.invoke(profile)
+        return self._save_report(result) if save else _report_document(result)
 
-.container {
-  max-width: 900px;
-  margin: 0 auto;
-  background: #fff;
-  border-radius: 12px;
-  box-shadow: 0 2px 16px rgba(0,0,0,0.07);
-  padding: 32px 40px;
-}
+    @traceable(run_type="chain", name="选校报告Run")
+    async def arun(self, profile_input: str, save: bool = True, regenerate: Iterable[str] = (),
+                   overrides: Optional[Dict[str, Any]] = None) -> str:
+        """主workflow（异步版本） - 各LLM调用使用ainvoke, 不阻塞事件循环; pipelined时各阶段按流水线重叠执行"""
+        profile = read_profile(profile_input)
+        self.log("学生profile：", profile)
+        with self.metrics.time_stage("report", self.llm_name), _regeneration_scope(regenerate, overrides):
+            # 与run()共享正在生成的相同报告; 所有等待的调用方都断开时才取消生成
+            return await self.report_flight.ado(self._report_key(profile, save),
+                                                lambda: self._arun_pipeline(profile, save), "report", self.llm_name)
 
-table {
-  border-collapse: collapse;
-  width: 100%;
-  margin: 2em 0;
-  background: #fff;
-  border-radius: 8px;
-  overflow: hidden;
-  box-shadow: 0 1px 4px rgba(0,0,0,0.04);
-}
+    async def _arun_pipeline(self, profile: str, save: bool) -> str:
+        if self.pipelined:
+            result = await self._apipelined_report(profile)
+        else:
+            result = await self._pipeline.ainvoke(profile)
+        if not save:
+            return _report_document(result)
+        # 渲染HTML和写文件放到线程中执行
+        return await asyncio.to_thread(self._save_report, result)
 
-table th, table td {
-  border: 1px solid #e1e4e8;
-  padding: 12px 16px;
-  text-align: left;
-}
+    async def _arun_with_events(self, profile_input: str, emit: Callable[[Dict[str, Any]], None],
+                                save: bool = True, regenerate: Iterable[str] = (),
+                                overrides: Optional[Dict[str, Any]] = None) -> str:
+        """按章节执行workflow, 每产生一个token或章节就通过emit推送事件"""
+        with _regeneration_scope(regenerate, overrides):
+            return await self._arun_sections(profile_input, emit, save)
 
-table th {
-  background: #f3f6fa;
-  color: #34495e;
-  font-weight: 600;
-}
+    async def _arun_sections(self, profile_input: str, emit: Callable[[Dict[str, Any]], None], save: bool) -> str:
+        started = time.perf_counter()
+        profile = read_profile(profile_input)
+        self.log("学生profile：", profile)
 
-table tr:nth-child(even) {
-  background: #f9fbfd;
-}
+        if self.pipelined:
+            result = await self._apipelined_report(profile, emit)
+        else:
+            majors_report = await self.arecommend_majors(
+                profile, lambda delta: emit({"type": "token", "stage": "recommend_majors", "delta": delta}))
+            emit({"type": "section", "stage": "recommend_majors", "content": majors_report})
 
-code, pre {
-  background: #f4f4f4;
-  border-radius: 4px;
-  padding: 2px 6px;
-  font-size: 95%;
-}
+            schools_report, school_names = await self._aschools_report(
+                profile, majors_report, lambda delta: emit({"type": "token", "stage": "recommend_schools", "delta": delta}))
+            emit({"type": "section", "stage": "recommend_schools", "content": schools_report})
 
-pre {
-  padding: 12px;
-  overflow-x: auto;
-}
+            if school_names is None:
+                school_names = await self.aextract_school_names(schools_report)
+            self.log("提取的学校名称：", school_names)
+            emit({"type": "section", "stage": "extract_school_names", "content": school_names})
 
-blockquote {
-  border-left: 4px solid #b2bec3;
-  margin: 1em 0;
-  padding-left: 18px;
-  color: #636e72;
-  background: #f7fafd;
-}
+            school_sections = await self.afill_school_sections(school_names, profile, emit)
+            result = self._assemble_report(majors_report, schools_report, "\n\n".join(school_sections))
+        report = await asyncio.to_thread(self._save_report, result) if save else _report_document(result)
+        self.metrics.observe_stage("report", self.llm_name, time.perf_counter() - started)
+        emit({"type": "report", "content": report})
+        return report
 
-@media (max-width: 600px) {
-  .container {
-    padding: 10px 2vw;
-  }
-  table th, table td {
-    padding: 8px 4px;
-  }
-}
-.loading-indicator {
-  display: flex;
-  flex-direction: column;
-  align-items: center;
-  justify-content: center;
-  height: 60vh;
-  font-size: 1.5em;
-  color: #888;
-}
-.spinner {
-  border: 6px solid #f3f3f3;
-  border-top: 6px solid #3498db;
-  border-radius: 50%;
-  width: 48px;
-  height: 48px;
-  animation: spin 1s linear infinite;
-  margin-bottom: 18px;
-}
-@keyframes spin {
-  0% { transform: rotate(0deg); }
-  100% { transform: rotate(360deg); }
-}
-''')
-        
-        # 创建React app js
-        with open(app_js_path, 'w', encoding='utf-8') as f:
-            f.write('''
-const { useState, useEffect } = React;
-
-function LoadingIndicator() {
-  return (
-    <div className="loading-indicator">
-      <div className="spinner"></div>
-      <div>Loading report...</div>
-    </div>
-  );
-}
+    async def astream(self, profile_input: str, save: bool = True, regenerate: Iterable[str] = (),
+                      overrides: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式生成报告(save为False时不写入output_dir, regenerate和overrides与run相同), 依次产出事件:
+        - {"type": "token", "stage": ..., "delta": ...}: LLM增量输出, 学校章节事件带school和index
+        - {"type": "section", "stage": ..., "content": ...}: 章节完成
+        - {"type": "report", "content": ...}: 完整报告, 与arun的返回值一致
+        """
+        events: asyncio.Queue = asyncio.Queue()
 
-function ReportApp() {
-  const [show, setShow] = useState(false);
-  useEffect(() => {
-    const timer = setTimeout(() => setShow(true), 3000);
-    return () => clearTimeout(timer);
-  }, []);
-  return (
-    <div className="container">
-      {show ? (
-        <div dangerouslySetInnerHTML={{ __html: window.marked.parse(window.REPORT_MD) }} />
-      ) : (
-        <LoadingIndicator />
-      )}
-    </div>
-  );
-}
+        async def produce():
+            try:
+                await self._arun_with_events(profile_input, events.put_nowait, save, regenerate, overrides)
+            except Exception as e:
+                events.put_nowait(e)
+            finally:
+                events.put_nowait(_STREAM_END)
 
-ReactDOM.createRoot(document.getElementById("root")).render(<ReportApp />);
-''')
-        
-        return react_html
+        task = asyncio.ensure_future(produce())
+        try:
+            while True:
+                event = await events.get()
+                if event is _STREAM_END:
+                    break
+                if isinstance(event, Exception):
+                    raise event
+                yield event
+        finally:
+            if not task.done():
+                task.cancel()
+
+    async def astream_text(self, profile_input: str, save: bool = True, regenerate: Iterable[str] = (),
+                           overrides: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """流式产出报告文本, 所有片段按顺序拼接后与arun的返回值完全一致(参数与astream相同)"""
+        pending_sections: Dict[int, str] = {}
+        next_index = 0
+        yield REPORT_PREFIX + "# Major report \n\n"
+        async for event in self.astream(profile_input, save, regenerate, overrides):
+            if event["type"] == "token" and event["stage"] in ("recommend_majors", "recommend_schools"):
+                yield event["delta"]
+            elif event["type"] == "section" and event["stage"] == "recommend_majors":
+                yield "\n\n# University report\n\n"
+            elif event["type"] == "section" and event["stage"] == "recommend_schools":
+                yield "\n\n"
+            elif event["type"] == "section" and event["stage"] == "fill_school_info":
+                # 学校章节并发完成, 按原顺序输出
+                pending_sections[event["index"]] = event["content"]
+                while next_index in pending_sections:
+                    yield ("\n\n" if next_index else "") + pending_sections.pop(next_index)
+                    next_index += 1
+        yield REPORT_SUFFIX
+
+    def stream(self, profile_input: str) -> Iterator[Dict[str, Any]]:
+        """astream的同步版本, 在后台线程中运行事件循环"""
+        events: "queue.Queue[Any]" = queue.Queue()
+
+        def produce():
+            async def consume():
+                async for event in self.astream(profile_input):
+                    events.put(event)
+            try:
+                asyncio.run(consume())
+            except Exception as e:
+                events.put(e)
+            finally:
+                events.put(_STREAM_END)
+
+        # 后台线程沿用调用方的context(调度优先级等)
+        threading.Thread(target=contextvars.copy_context().run, args=(produce,), name="report-stream", daemon=True).start()
+        while True:
+            event = events.get()
+            if event is _STREAM_END:
+                break
+            if isinstance(event, Exception):
+                raise event
+            yield event
+
+    def _save_report(self, result: str) -> str:
+        """按内容哈希保存报告的markdown和HTML到output_dir/reports, 耗时记为render_html阶段"""
+        report = _report_document(result)
+        with self.metrics.time_stage("render_html", self.llm_name):
+            report_id = self.artifacts.save_report(report)
+        self.log("HTML报告已保存为：", self.artifacts.path(report_id))
+        return report
 
 
 def main():
@@ -496,99 +1274,27 @@ def main():
     print(report)
     print(f"\n报告已保存为: {output_path}\n")
 
-    # 尝试将Markdown渲染为PDF
+    # 将Markdown渲染为PDF: 只使用启动时探测到的可用后端, 在渲染进程池中执行
+    from report_renderer import RenderUnavailableError, get_default_renderer
+
     pdf_path = os.path.join(output_dir, 'UniversitySelectionReport.pdf')
-    
-    # 尝试多种PDF生成方式
-    pdf_generated = False
-    
-    # 方式1: 使用pypandoc
-    if not pdf_generated:
-        try:
-            import importlib
-            pypandoc = importlib.import_module('pypandoc')
-            pypandoc.convert_file(output_path, 'pdf', outputfile=pdf_path)
-            print(f"PDF已保存为: {pdf_path}\n")
-            pdf_generated = True
-        except ImportError:
-            print("未检测到pypandoc库，尝试其他方式...")
-        except Exception as e:
-            if "No pandoc was found" in str(e):
-                print("pandoc未安装，尝试其他方式...")
-            else:
-                print(f"pypandoc转换失败: {e}")
-    
-    # 方式2: 使用weasyprint
-    if not pdf_generated:
-        try:
-            import weasyprint
-            from markdown import markdown
-            
-            # 读取markdown内容
-            with open(output_path, 'r', encoding='utf-8') as f:
-                md_content = f.read()
-            
-            # 转换为HTML
-            html_content = markdown(md_content, extensions=['tables', 'fenced_code'])
-            
-            # 添加CSS样式
-            styled_html = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <meta charset="utf-8">
-                <style>
-                    body {{ font-family: Arial, sans-serif; margin: 40px; line-height: 1.6; }}
-                    h1, h2, h3 {{ color: #333; }}
-                    h1 {{ border-bottom: 2px solid #333; padding-bottom: 10px; }}
-                    h2 {{ border-bottom: 1px solid #ccc; padding-bottom: 5px; }}
-                    code {{ background-color: #f4f4f4; padding: 2px 4px; border-radius: 3px; }}
-                    pre {{ background-color: #f4f4f4; padding: 10px; border-radius: 5px; overflow-x: auto; }}
-                    blockquote {{ border-left: 4px solid #ccc; margin: 0; padding-left: 20px; }}
-                </style>
-            </head>
-            <body>
-                {html_content}
-            </body>
-            </html>
-            """
-            
-            # 生成PDF
-            weasyprint.HTML(string=styled_html).write_pdf(pdf_path)
-            print(f"PDF已保存为: {pdf_path} (使用weasyprint)\n")
-            pdf_generated = True
-            
-        except ImportError:
-            print("未检测到weasyprint库，尝试其他方式...")
-        except Exception as e:
-            print(f"weasyprint转换失败: {e}")
-    
-    # 方式3: 使用markdown-pdf (如果可用)
-    if not pdf_generated:
-        try:
-            import subprocess
-            result = subprocess.run(['markdown-pdf', output_path, '-o', pdf_path], 
-                                  capture_output=True, text=True, timeout=30)
-            if result.returncode == 0:
-                print(f"PDF已保存为: {pdf_path} (使用markdown-pdf)\n")
-                pdf_generated = True
-            else:
-                print(f"markdown-pdf转换失败: {result.stderr}")
-        except FileNotFoundError:
-            print("未检测到markdown-pdf命令")
-        except Exception as e:
-            print(f"markdown-pdf转换失败: {e}")
-    
-    # 如果所有方式都失败，提供安装指导
-    if not pdf_generated:
+    renderer = get_default_renderer()
+    try:
+        with workflow.metrics.time_stage("render_pdf", workflow.llm_name):
+            pdf = renderer.render_pdf(report)
+        with open(pdf_path, 'wb') as f:
+            f.write(pdf)
+        print(f"PDF已保存为: {pdf_path} (使用{renderer.backends[0]})\n")
+    except RenderUnavailableError:
+        # 没有可用的PDF后端时提供安装指导
         print("\n=== PDF生成失败 ===\n")
-        print("已尝试多种PDF生成方式，但都失败了。")
+        print("未检测到可用的PDF生成方式。")
         print("\n要启用PDF生成，请安装以下工具之一：")
-        print("\n1. pandoc + pypandoc:")
+        print("\n1. weasyprint:")
+        print("   pip install weasyprint markdown")
+        print("\n2. pandoc + pypandoc:")
         print("   pip install pypandoc")
         print("   # 然后安装pandoc: https://pandoc.org/installing.html")
-        print("\n2. weasyprint:")
-        print("   pip install weasyprint markdown")
         print("\n3. markdown-pdf (Node.js):")
         print("   npm install -g markdown-pdf")
         print("\n4. 手动转换:")
@@ -596,6 +1302,10 @@ def main():
         print("   或使用本地编辑器如Typora、VSCode等")
         print(f"\nMarkdown文件已保存为: {output_path}")
         print("可以手动将其转换为PDF。\n")
+    except Exception as e:
+        print(f"PDF转换失败: {e}")
+    finally:
+        renderer.close()
 
 if __name__ == "__main__":
     main()